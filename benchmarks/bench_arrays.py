@@ -0,0 +1,59 @@
+import argparse
+import io
+import time
+
+from bench_engines import DEFAULT_INTERPRETER, load_interpreter
+
+def make_loop_program(lang, size):
+    # Sums I * 3 + 2 for I from 0 to size - 1, one element at a time
+    p, i = lang.COMMAND_PREFIX, lang.TYPE_PREFIX_INTEGER
+    return '\n'.join([
+        f"N = {i} {size}",
+        f"I = {i} 0",
+        f"TOTAL = {i} 0",
+        f"{p}WHILE N - I:",
+        f"    TOTAL = TOTAL + I * {i} 3 + {i} 2",
+        f"    I = I + {i} 1",
+        lang.BLOCK_END,
+        f"{p}PRINT(TOTAL)",
+    ])
+
+def make_array_program(lang, size):
+    # The same sum over an array
+    p, i = lang.COMMAND_PREFIX, lang.TYPE_PREFIX_INTEGER
+    return '\n'.join([
+        f"VALUES = {p}RANGE({i} {size})",
+        f"{p}PRINT({p}SUM(VALUES * {i} 3 + {i} 2))",
+    ])
+
+def best_time(lang, code, mode, repeat):
+    best = None
+    for _ in range(repeat):
+        stream = io.StringIO()
+        start = time.perf_counter()
+        lang.run(code, mode, output=lang.Output(stream))
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, stream.getvalue()
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare a loop over numbers with the same calculation on an array")
+    parser.add_argument('--interpreter', default=DEFAULT_INTERPRETER, help="Path to a generated interpreter module")
+    parser.add_argument('--size', type=int, default=200000, help="Numbers in the calculation")
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    lang = load_interpreter(args.interpreter)
+    print(f"array backend: {'numpy' if lang.NumericArray.backend() else 'array.array'}")
+    loop = make_loop_program(lang, args.size)
+    vectorized = make_array_program(lang, args.size)
+    print(f"{'mode':>12} {'loop (s)':>9} {'array (s)':>10} {'speedup':>8}")
+    for mode in lang.EXECUTION_MODES:
+        loop_time, loop_output = best_time(lang, loop, mode, args.repeat)
+        array_time, array_output = best_time(lang, vectorized, mode, args.repeat)
+        if loop_output != array_output:
+            raise SystemExit(f"The loop printed {loop_output!r} but the array program {array_output!r}")
+        print(f"{mode:>12} {loop_time:>9.3f} {array_time:>10.4f} {loop_time / array_time:>7.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from bench_server import DEFAULT_INTERPRETER, language_constants
+
+def make_programs(lang, directory, count):
+    # Small jobs of a few statements each, like the ones batch users run
+    p, i, s = lang['COMMAND_PREFIX'], lang['TYPE_PREFIX_INTEGER'], lang['TYPE_PREFIX_STRING']
+    filenames = []
+    for number in range(count):
+        filename = os.path.join(directory, f"job{number:05}{lang['FILE_EXTENSION']}")
+        with open(filename, 'w') as file:
+            file.write('\n'.join([
+                f"X = {i} {number}",
+                f"Y = X * {i} 3 + {i} 7",
+                f'{p}PRINT({s} "JOB", X, {p}SHOUT({s} "done"), Y)',
+            ]))
+        filenames.append(filename)
+    return filenames
+
+def time_processes(command, filenames):
+    # One process per program, the way a shell loop over the files would run them
+    start = time.perf_counter()
+    for filename in filenames:
+        subprocess.run([*command, '--no-cache', filename], stdout=subprocess.DEVNULL, check=True)
+    return (time.perf_counter() - start) / len(filenames)
+
+def time_batch(interpreter, directory, count, jobs, mode):
+    start = time.perf_counter()
+    subprocess.run([sys.executable, interpreter, '--batch', directory, '--jobs', str(jobs), '--mode', mode],
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+    return (time.perf_counter() - start) / count
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare per-program overhead of --batch with one process per program")
+    parser.add_argument('--interpreter', default=DEFAULT_INTERPRETER, help="Path to a generated interpreter module")
+    parser.add_argument('--programs', type=int, default=5000, help="Programs in the batch")
+    parser.add_argument('--sample', type=int, default=50, help="Programs to time one process at a time")
+    parser.add_argument('--jobs', type=int, default=os.cpu_count() or 1, help="Worker processes for --batch")
+    parser.add_argument('--mode', default='interpret', help="Execution mode")
+    parser.add_argument('--launcher', help="Path to the language's shell launcher, to also time starting through sh")
+    args = parser.parse_args()
+
+    lang = language_constants(args.interpreter)
+    with tempfile.TemporaryDirectory() as directory:
+        filenames = make_programs(lang, directory, args.programs)
+        sample = filenames[:args.sample]
+        print(f"{'runner':>28} {'ms/program':>11}")
+        python = time_processes([sys.executable, args.interpreter, '--mode', args.mode], sample)
+        print(f"{'python per program':>28} {python * 1000:>11.2f}")
+        if args.launcher:
+            shell = time_processes(['sh', args.launcher, '--mode', args.mode], sample)
+            print(f"{'launcher per program':>28} {shell * 1000:>11.2f}")
+        cold = time_batch(args.interpreter, directory, args.programs, args.jobs, args.mode)
+        print(f"{'--batch, empty cache':>28} {cold * 1000:>11.3f}")
+        warm = time_batch(args.interpreter, directory, args.programs, args.jobs, args.mode)
+        print(f"{'--batch, warm cache':>28} {warm * 1000:>11.3f}")
+        print(f"--batch runs {python / warm:.0f}x faster per program than a process per program")
+
+if __name__ == "__main__":
+    main()
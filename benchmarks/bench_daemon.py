@@ -0,0 +1,84 @@
+import argparse
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from bench_server import DEFAULT_INTERPRETER, language_constants
+
+HISTOGRAM_BUCKETS_MS = (0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+def client_path(interpreter):
+    directory, name = os.path.split(os.path.abspath(interpreter))
+    return os.path.join(directory, name[:-len('.py')] + 'client.py')
+
+def first_output_in_process(socket_path, filename):
+    # Seconds from connecting to the daemon to the first byte of output,
+    # without any process startup
+    start = time.perf_counter()
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(socket_path)
+        connection.sendall(json.dumps({'file': filename}).encode() + b'\n')
+        connection.recv(1)
+        elapsed = time.perf_counter() - start
+        while connection.recv(65536):
+            pass
+    return elapsed
+
+def first_output_of_process(command):
+    # Seconds from starting a process to the first byte it writes
+    start = time.perf_counter()
+    process = subprocess.Popen(command, stdout=subprocess.PIPE)
+    process.stdout.read(1)
+    elapsed = time.perf_counter() - start
+    process.communicate()
+    return elapsed
+
+def summarize(label, samples):
+    samples = sorted(sample * 1000 for sample in samples)
+    def percentile(fraction):
+        return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+    print(f"{label}: p50 {percentile(0.5):.2f} ms, p90 {percentile(0.9):.2f} ms, p99 {percentile(0.99):.2f} ms")
+    lower = 0
+    for upper in HISTOGRAM_BUCKETS_MS + (float('inf'),):
+        count = sum(1 for sample in samples if lower <= sample < upper)
+        if count:
+            bar = '#' * max(1, round(40 * count / len(samples)))
+            print(f"  {lower:>6g}-{upper:<6g} ms {count:>6} {bar}")
+        lower = upper
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure time to first output through the daemon and without it")
+    parser.add_argument('--interpreter', default=DEFAULT_INTERPRETER, help="Path to a generated interpreter module")
+    parser.add_argument('--requests', type=int, default=2000, help="Requests sent straight to the daemon")
+    parser.add_argument('--processes', type=int, default=50, help="Client and interpreter processes to start")
+    args = parser.parse_args()
+
+    lang = language_constants(args.interpreter)
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, f"hello{lang['FILE_EXTENSION']}")
+        with open(filename, 'w') as file:
+            file.write(f'{lang["COMMAND_PREFIX"]}PRINT({lang["TYPE_PREFIX_STRING"]} "HELLO")\n')
+        socket_path = os.path.join(directory, 'daemon.sock')
+        daemon = subprocess.Popen([sys.executable, args.interpreter, '--daemon', '--socket', socket_path],
+                                  stdout=subprocess.PIPE, text=True)
+        try:
+            daemon.stdout.readline()
+            summarize("daemon request", [first_output_in_process(socket_path, filename) for _ in range(args.requests)])
+            client = [sys.executable, '-S', client_path(args.interpreter), '--socket', socket_path, filename]
+            summarize("client process", [first_output_of_process(client) for _ in range(args.processes)])
+        finally:
+            daemon.send_signal(signal.SIGTERM)
+            daemon.wait()
+        direct = [sys.executable, args.interpreter, '--no-cache', filename]
+        summarize("interpreter process", [first_output_of_process(direct) for _ in range(args.processes)])
+    # The floor for any client process
+    bare = [sys.executable, '-S', '-c', 'print()']
+    summarize("python -S process", [first_output_of_process(bare) for _ in range(args.processes)])
+
+if __name__ == "__main__":
+    main()
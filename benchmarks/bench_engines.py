@@ -0,0 +1,64 @@
+import argparse
+import contextlib
+import importlib.util
+import io
+import os
+import time
+
+DEFAULT_INTERPRETER = os.path.join(os.path.dirname(__file__), '..', 'langs', 'bhav', 'lib', 'bhav.py')
+
+def load_interpreter(path, name='interpreter_under_test'):
+    # Benchmarks that compare two interpreters load them under different names
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def make_loop_program(lang, iterations):
+    return '\n'.join([
+        f"N = {lang.TYPE_PREFIX_INTEGER} {iterations}",
+        f"TOTAL = {lang.TYPE_PREFIX_INTEGER} 0",
+        f"{lang.COMMAND_PREFIX}WHILE N:",
+        f"    TOTAL = TOTAL + N * {lang.TYPE_PREFIX_INTEGER} 2 - (N - {lang.TYPE_PREFIX_INTEGER} 1)",
+        f"    {lang.COMMAND_PREFIX}IF N - {lang.TYPE_PREFIX_INTEGER} 1:",
+        "        LAST = N",
+        f"    {lang.COMMAND_PREFIX}ELSE:",
+        f"        LAST = {lang.TYPE_PREFIX_INTEGER} 0",
+        f"    {lang.BLOCK_END}",
+        f"    N = N - {lang.TYPE_PREFIX_INTEGER} 1",
+        lang.BLOCK_END,
+        f"{lang.COMMAND_PREFIX}PRINT(TOTAL, LAST)",
+    ])
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare execution modes on a loop-heavy program")
+    parser.add_argument('--interpreter', default=DEFAULT_INTERPRETER, help="Path to a generated interpreter module")
+    parser.add_argument('--iterations', type=int, default=200000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    lang = load_interpreter(args.interpreter)
+    code = make_loop_program(lang, args.iterations)
+    timings = {}
+    outputs = {}
+    for mode in lang.EXECUTION_MODES:
+        best = None
+        for _ in range(args.repeat):
+            output = io.StringIO()
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(output):
+                lang.run(code, mode)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        timings[mode] = best
+        outputs[mode] = output.getvalue()
+
+    baseline = timings['interpret']
+    print(f"{'mode':>12} {'best (s)':>10} {'speedup':>8}")
+    for mode, elapsed in timings.items():
+        print(f"{mode:>12} {elapsed:>10.3f} {baseline / elapsed:>7.1f}x")
+    if len(set(outputs.values())) != 1:
+        raise SystemExit("Execution modes produced different output")
+
+if __name__ == "__main__":
+    main()
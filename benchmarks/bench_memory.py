@@ -0,0 +1,70 @@
+import argparse
+import gc
+import tracemalloc
+
+from bench_engines import DEFAULT_INTERPRETER, load_interpreter
+
+def make_program(lang, statements):
+    lines = []
+    for i in range(statements):
+        if i % 10 == 9:
+            lines.append(f"{lang.COMMAND_PREFIX}WHILE X:")
+            lines.append(f"    X = X - {lang.TYPE_PREFIX_INTEGER} 1")
+            lines.append(lang.BLOCK_END)
+        elif i % 10 == 4:
+            lines.append(f'{lang.COMMAND_PREFIX}PRINT({lang.TYPE_PREFIX_STRING} "STATEMENT {i}:", X)')
+        else:
+            lines.append(f"X = {lang.TYPE_PREFIX_INTEGER} {i} * (Y + {lang.TYPE_PREFIX_INTEGER} 2)")
+    return '\n'.join(lines)
+
+def children(node):
+    if hasattr(node, '__dict__'):
+        return list(vars(node).values())
+    return [getattr(node, name) for name in node.__slots__ if hasattr(node, name)]
+
+def count_nodes(lang, statements):
+    count = 0
+    pending = list(statements)
+    while pending:
+        node = pending.pop()
+        if isinstance(node, list):
+            pending.extend(node)
+        elif isinstance(node, lang.AST):
+            count += 1
+            pending.extend(children(node))
+    return count
+
+def measure(lang, statements):
+    # Bytes allocated by parse() that are still alive in the returned program
+    tokens = lang.lexer(make_program(lang, statements))
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    program = lang.parse(tokens)
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return size, count_nodes(lang, program)
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure how much memory parsed programs hold per AST node")
+    parser.add_argument('--interpreter', default=DEFAULT_INTERPRETER, help="Path to a generated interpreter module")
+    parser.add_argument('--compare', help="Path to another interpreter module to measure against")
+    parser.add_argument('--statements', type=int, default=100000)
+    args = parser.parse_args()
+
+    interpreters = [('interpreter', args.interpreter)]
+    if args.compare:
+        interpreters.append(('compare', args.compare))
+    results = {}
+    print(f"{'interpreter':>12} {'nodes':>10} {'MB':>8} {'bytes/node':>11}")
+    for label, path in interpreters:
+        lang = load_interpreter(path, f'{label}_under_test')
+        size, nodes = measure(lang, args.statements)
+        results[label] = size / nodes
+        print(f"{label:>12} {nodes:>10} {size / 2**20:>8.1f} {size / nodes:>11.1f}")
+    if args.compare:
+        print(f"interpreter uses {results['interpreter'] / results['compare']:.2f}x the memory per node of compare")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+import argparse
+import io
+import json
+import time
+
+from bench_engines import DEFAULT_INTERPRETER, load_interpreter, make_loop_program
+
+def best_time(lang, code, mode, repeat, metered):
+    best = None
+    snapshot = None
+    for _ in range(repeat):
+        metrics = lang.Metrics() if metered else None
+        output = lang.Output(io.StringIO())
+        start = time.perf_counter()
+        if metered:
+            lang.run(code, mode, output=output, metrics=metrics)
+        else:
+            lang.run(code, mode, output=output)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+        if metered:
+            snapshot = metrics.snapshot()
+    return best, snapshot
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the cost of metering a program")
+    parser.add_argument('--interpreter', default=DEFAULT_INTERPRETER, help="Path to a generated interpreter module")
+    parser.add_argument('--iterations', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    lang = load_interpreter(args.interpreter)
+    code = make_loop_program(lang, args.iterations)
+    print(f"{'mode':>12} {'off (s)':>9} {'metered (s)':>12} {'slowdown':>9} {'statements/s':>13}")
+    for mode in ('interpret', 'compile'):
+        off, _ = best_time(lang, code, mode, args.repeat, False)
+        metered, snapshot = best_time(lang, code, mode, args.repeat, True)
+        print(f"{mode:>12} {off:>9.3f} {metered:>12.3f} {metered / off:>8.2f}x "
+              f"{snapshot['statements'] / metered:>13.0f}")
+    print("last snapshot:", json.dumps({name: snapshot[name] for name in ('statements', 'loop_iterations',
+                                                                         'builtin_calls')}))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,32 @@
+import argparse
+import io
+import time
+
+from bench_engines import DEFAULT_INTERPRETER, load_interpreter, make_loop_program
+
+def main():
+    # The corpus that checks that every level behaves the same is
+    # tests/test_optimizer.py
+    parser = argparse.ArgumentParser(description="Time a loop at each optimization level")
+    parser.add_argument('--interpreter', default=DEFAULT_INTERPRETER, help="Path to a generated interpreter module")
+    parser.add_argument('--iterations', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    lang = load_interpreter(args.interpreter)
+    code = make_loop_program(lang, args.iterations)
+    print(f"{'mode':>12} " + ' '.join(f"{f'-O{level} (s)':>10}" for level in lang.OPT_LEVELS))
+    for mode in lang.EXECUTION_MODES:
+        timings = []
+        for level in lang.OPT_LEVELS:
+            best = None
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                lang.run(code, mode, opt_level=level, output=lang.Output(io.StringIO()))
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            timings.append(best)
+        print(f"{mode:>12} " + ' '.join(f"{elapsed:>10.3f}" for elapsed in timings))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from bench_server import DEFAULT_INTERPRETER, language_constants
+
+def make_program(lang, lines):
+    # Prints one short line per iteration, so that writing the output rather
+    # than running the loop dominates once it is unbuffered
+    p, i, s = lang['COMMAND_PREFIX'], lang['TYPE_PREFIX_INTEGER'], lang['TYPE_PREFIX_STRING']
+    return '\n'.join([
+        f"N = {i} {lines}",
+        f"{p}WHILE N:",
+        f'    {p}PRINT({s} "LINE", N)',
+        f"    N = N - {i} 1",
+        lang['BLOCK_END'],
+    ])
+
+def time_run(command):
+    # Seconds to run the program with its output going into a pipe that is
+    # drained as fast as it fills; returns the time and the bytes read
+    env = dict(os.environ)
+    # PYTHONUNBUFFERED would turn buffering off for every run
+    env.pop('PYTHONUNBUFFERED', None)
+    start = time.perf_counter()
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, env=env)
+    size = 0
+    while True:
+        chunk = process.stdout.read1(1 << 16)
+        if not chunk:
+            break
+        size += len(chunk)
+    if process.wait():
+        raise SystemExit(f"{' '.join(command)} exited with status {process.returncode}")
+    return time.perf_counter() - start, size
+
+def main():
+    parser = argparse.ArgumentParser(description="Time printing many lines into a pipe, buffered and unbuffered")
+    parser.add_argument('--interpreter', default=DEFAULT_INTERPRETER, help="Path to a generated interpreter module")
+    parser.add_argument('--compare', help="Path to another interpreter, such as one without buffered output")
+    parser.add_argument('--lines', type=int, default=1000000, help="Lines the program prints")
+    parser.add_argument('--modes', default='interpret,compile,python', help="Comma-separated execution modes")
+    args = parser.parse_args()
+
+    lang = language_constants(args.interpreter)
+    runs = [(args.interpreter, 'buffered', []), (args.interpreter, '--unbuffered', ['--unbuffered'])]
+    if args.compare:
+        runs.append((args.compare, 'compared', []))
+    with tempfile.TemporaryDirectory() as directory:
+        program_path = os.path.join(directory, f"print{lang['FILE_EXTENSION']}")
+        with open(program_path, 'w') as file:
+            file.write(make_program(lang, args.lines))
+        print(f"{'mode':>10} {'output':>13} {'seconds':>8} {'lines/s':>10} {'MB':>6}")
+        for mode in args.modes.split(','):
+            for interpreter, label, flags in runs:
+                elapsed, size = time_run([sys.executable, interpreter, '--no-cache', '--mode', mode,
+                                          *flags, program_path])
+                print(f"{mode:>10} {label:>13} {elapsed:>8.2f} {args.lines / elapsed:>10.0f} {size / 1e6:>6.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+import argparse
+import time
+
+from bench_engines import DEFAULT_INTERPRETER, load_interpreter
+
+def make_program(lang, statements):
+    lines = []
+    for i in range(statements):
+        if i % 10 == 9:
+            lines.append(f"{lang.COMMENT_PREFIX} STATEMENT {i}")
+            lines.append(f"{lang.COMMAND_PREFIX}IF {lang.TRUE_VALUE}:")
+            lines.append(f"    X = X + {lang.TYPE_PREFIX_INTEGER} {i}")
+            lines.append(lang.BLOCK_END)
+        elif i % 10 == 4:
+            lines.append(f'{lang.COMMAND_PREFIX}PRINT({lang.TYPE_PREFIX_STRING} "STATEMENT {i}:", X)')
+        else:
+            lines.append(f"X = {lang.TYPE_PREFIX_INTEGER} {i} * (Y + {lang.TYPE_PREFIX_INTEGER} 2)")
+    return '\n'.join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure how lexer() and parse() scale with program length")
+    parser.add_argument('--interpreter', default=DEFAULT_INTERPRETER, help="Path to a generated interpreter module")
+    parser.add_argument('--sizes', default='1000,10000,100000', help="Comma-separated statement counts")
+    parser.add_argument('--repeat', type=int, default=3, help="Report the best of this many runs")
+    args = parser.parse_args()
+
+    lang = load_interpreter(args.interpreter)
+    print(f"{'statements':>12} {'tokens':>10} {'lex (s)':>10} {'parse (s)':>10} {'parse us/stmt':>14}")
+    for size in [int(s) for s in args.sizes.split(',')]:
+        code = make_program(lang, size)
+        lex_time = parse_time = None
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            tokens = lang.lexer(code)
+            lexed = time.perf_counter()
+            token_count = len(tokens)
+            lang.parse(tokens)
+            parsed = time.perf_counter()
+            lex_time = lexed - start if lex_time is None else min(lex_time, lexed - start)
+            parse_time = parsed - lexed if parse_time is None else min(parse_time, parsed - lexed)
+        per_statement = parse_time / size * 1e6
+        print(f"{size:>12} {token_count:>10} {lex_time:>10.3f} {parse_time:>10.3f} {per_statement:>14.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+import argparse
+import asyncio
+import multiprocessing
+import os
+import re
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+from bench_server import DEFAULT_INTERPRETER, free_port, language_constants
+
+def make_server_program(lang, port, work):
+    # A keep-alive echo server that counts down from `work` before each reply,
+    # so that the interpreter rather than the network is the bottleneck
+    p, i, s = lang['COMMAND_PREFIX'], lang['TYPE_PREFIX_INTEGER'], lang['TYPE_PREFIX_STRING']
+    end = lang['BLOCK_END']
+    return '\n'.join([
+        f'SERVER = {p}SOCKET({s} "BENCH")',
+        f"{p}BIND(SERVER, {i} {port})",
+        f"{p}LISTEN(SERVER, {i} 4096)",
+        f'{p}PRINT({s} "READY")',
+        f"{p}WHILE {lang['TRUE_VALUE']}:",
+        f"    CONNECTION = {p}ACCEPT(SERVER)",
+        f"    LINE = {p}RECVLINE(CONNECTION)",
+        f"    {p}WHILE LINE:",
+        f"        WORK = {i} {work}",
+        f"        {p}WHILE WORK:",
+        f"            WORK = WORK - {i} 1",
+        f"        {end}",
+        f"        {p}SENDALL(CONNECTION, LINE)",
+        f"        LINE = {p}RECVLINE(CONNECTION)",
+        f"    {end}",
+        f"    {p}CLOSE(CONNECTION)",
+        end,
+    ])
+
+def client_process(port, duration, connections, requests, results):
+    # Keeps `connections` connections busy until `duration` has passed,
+    # reconnecting after every `requests` requests; reports requests answered
+    async def session(deadline):
+        completed = 0
+        while time.perf_counter() < deadline:
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            for _ in range(requests):
+                writer.write(b'PING\n')
+                if await reader.readline() != b'PING\n':
+                    raise ConnectionError("Bad response")
+                completed += 1
+            writer.close()
+            await writer.wait_closed()
+        return completed
+
+    async def run():
+        deadline = time.perf_counter() + duration
+        return sum(await asyncio.gather(*[session(deadline) for _ in range(connections)]))
+    results.put(asyncio.run(run()))
+
+def run_setting(args, program_path, port, workers):
+    server = subprocess.Popen([sys.executable, args.interpreter, '--no-cache', '--mode', args.mode,
+                               '--workers', str(workers), program_path],
+                              stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+                              env=dict(os.environ, PYTHONUNBUFFERED='1'))
+    try:
+        if server.stdout.readline().strip() != 'READY':
+            raise SystemExit(f"Server failed to start: {server.stderr.read()}")
+        results = multiprocessing.Queue()
+        clients = [multiprocessing.Process(target=client_process,
+                                           args=(port, args.duration, args.connections, args.requests, results))
+                   for _ in range(args.clients)]
+        start = time.perf_counter()
+        for client in clients:
+            client.start()
+        completed = sum(results.get() for _ in clients)
+        elapsed = time.perf_counter() - start
+        for client in clients:
+            client.join()
+    finally:
+        server.send_signal(signal.SIGTERM)
+        try:
+            _, report = server.communicate(timeout=30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+            _, report = server.communicate()
+    # The master's final report has one line per worker
+    per_worker = [int(count) for count in re.findall(r'^WORKER \d+ .*?: (\d+) CONNECTIONS', report, re.M)]
+    return completed / elapsed, per_worker[-workers:]
+
+def main():
+    cores = os.cpu_count() or 1
+    default_workers = [1]
+    while default_workers[-1] * 2 <= cores:
+        default_workers.append(default_workers[-1] * 2)
+    parser = argparse.ArgumentParser(description="Measure how prefork server throughput scales with --workers")
+    parser.add_argument('--interpreter', default=DEFAULT_INTERPRETER, help="Path to a generated interpreter module")
+    parser.add_argument('--workers', default=','.join(map(str, default_workers)),
+                        help="Comma-separated worker counts (default: powers of two up to the core count)")
+    parser.add_argument('--mode', default='compile', help="Execution mode of the server")
+    parser.add_argument('--work', type=int, default=200, help="Loop iterations the server runs per request")
+    parser.add_argument('--clients', type=int, default=max(1, cores // 2), help="Load generator processes")
+    parser.add_argument('--connections', type=int, default=32, help="Connections kept open by each client process")
+    parser.add_argument('--requests', type=int, default=20, help="Requests sent on each connection before reconnecting")
+    parser.add_argument('--duration', type=float, default=5.0, help="Seconds to load each setting")
+    args = parser.parse_args()
+
+    lang = language_constants(args.interpreter)
+    print(f"{cores} cores, {args.clients} client processes")
+    print(f"{'workers':>8} {'req/s':>9} {'speedup':>8} {'efficiency':>11} {'conns/worker (min-max)':>23}")
+    baseline = None
+    with tempfile.TemporaryDirectory() as directory:
+        for workers in [int(count) for count in args.workers.split(',')]:
+            port = free_port()
+            program_path = os.path.join(directory, f"server{lang['FILE_EXTENSION']}")
+            with open(program_path, 'w') as file:
+                file.write(make_server_program(lang, port, args.work))
+            rate, per_worker = run_setting(args, program_path, port, workers)
+            baseline = baseline or rate / workers
+            spread = f"{min(per_worker)}-{max(per_worker)}" if per_worker else '-'
+            print(f"{workers:>8} {rate:>9.0f} {rate / baseline:>7.2f}x {rate / baseline / workers:>10.0%} {spread:>23}")
+
+if __name__ == "__main__":
+    main()
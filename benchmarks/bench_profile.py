@@ -0,0 +1,40 @@
+import argparse
+import io
+import time
+
+from bench_engines import DEFAULT_INTERPRETER, load_interpreter, make_loop_program
+
+def best_time(lang, code, mode, repeat, profile):
+    best = None
+    for _ in range(repeat):
+        profiler = lang.Profiler() if profile else None
+        output = lang.Output(io.StringIO())
+        start = time.perf_counter()
+        if profile:
+            lang.run(code, mode, output=output, profiler=profiler)
+        else:
+            lang.run(code, mode, output=output)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the cost of --profile, and of having it when it is off")
+    parser.add_argument('--interpreter', default=DEFAULT_INTERPRETER, help="Path to a generated interpreter module")
+    parser.add_argument('--compare', help="Path to an interpreter without the profiler, to time with profiling off")
+    parser.add_argument('--iterations', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    lang = load_interpreter(args.interpreter)
+    other = load_interpreter(args.compare) if args.compare else None
+    code = make_loop_program(lang, args.iterations)
+    print(f"{'mode':>12} {'off (s)':>9} {'compared (s)':>13} {'profiled (s)':>13} {'slowdown':>9}")
+    for mode in ('interpret', 'compile'):
+        off = best_time(lang, code, mode, args.repeat, False)
+        compared = f"{best_time(other, code, mode, args.repeat, False):.3f}" if other else '-'
+        profiled = best_time(lang, code, mode, args.repeat, True)
+        print(f"{mode:>12} {off:>9.3f} {compared:>13} {profiled:>13.3f} {profiled / off:>8.1f}x")
+
+if __name__ == "__main__":
+    main()
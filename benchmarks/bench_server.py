@@ -0,0 +1,126 @@
+import argparse
+import asyncio
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+DEFAULT_INTERPRETER = os.path.join(os.path.dirname(__file__), '..', 'langs', 'bhav', 'lib', 'bhav.py')
+CONSTANT_NAMES = ('COMMAND_PREFIX', 'TYPE_PREFIX_INTEGER', 'TYPE_PREFIX_STRING', 'TRUE_VALUE', 'BLOCK_END', 'FILE_EXTENSION')
+
+def language_constants(path):
+    # Reads the constants without importing the interpreter into this process
+    constants = {}
+    with open(path) as file:
+        for line in file:
+            name, _, value = line.partition(' = ')
+            if name in CONSTANT_NAMES and name not in constants:
+                constants[name] = value.strip().strip('"')
+    return constants
+
+def make_server_program(lang, port):
+    # A keep-alive echo server: each connection is served line by line until
+    # the client closes it
+    p, i, s = lang['COMMAND_PREFIX'], lang['TYPE_PREFIX_INTEGER'], lang['TYPE_PREFIX_STRING']
+    return '\n'.join([
+        f'SERVER = {p}SOCKET({s} "BENCH")',
+        f"{p}BIND(SERVER, {i} {port})",
+        f"{p}LISTEN(SERVER, {i} 4096)",
+        f'{p}PRINT({s} "READY")',
+        f"{p}WHILE {lang['TRUE_VALUE']}:",
+        f"    CONNECTION = {p}ACCEPT(SERVER)",
+        f"    LINE = {p}RECVLINE(CONNECTION)",
+        f"    {p}WHILE LINE:",
+        f"        {p}SENDALL(CONNECTION, LINE)",
+        f"        LINE = {p}RECVLINE(CONNECTION)",
+        f"    {lang['BLOCK_END']}",
+        f"    {p}CLOSE(CONNECTION)",
+        lang['BLOCK_END'],
+    ])
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+async def load(port, args, request):
+    # Opens args.connections connections, at most args.concurrency at a time,
+    # sends args.requests requests on each (pausing args.think_ms between
+    # them) and returns the time each connection took to get every response
+    latencies = []
+    failures = 0
+    limit = asyncio.Semaphore(args.concurrency)
+
+    async def client():
+        nonlocal failures
+        async with limit:
+            start = time.perf_counter()
+            try:
+                reader, writer = await asyncio.open_connection('127.0.0.1', port)
+                for number in range(args.requests):
+                    if number and args.think_ms:
+                        await asyncio.sleep(args.think_ms / 1000)
+                    writer.write(request)
+                    if await reader.readline() != request:
+                        raise asyncio.IncompleteReadError(b'', None)
+                writer.close()
+                latencies.append(time.perf_counter() - start)
+            except (OSError, asyncio.IncompleteReadError):
+                failures += 1
+
+    await asyncio.gather(*[client() for _ in range(args.connections)])
+    return latencies, failures
+
+def run_setting(interpreter, program_path, port, flags, args):
+    env = dict(os.environ, PYTHONUNBUFFERED='1')
+    server = subprocess.Popen([sys.executable, interpreter, '--no-cache', *flags, program_path],
+                              stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, env=env)
+    try:
+        if server.stdout.readline().strip() != 'READY':
+            raise SystemExit(f"Server failed to start: {server.stderr.read()}")
+        start = time.perf_counter()
+        latencies, failures = asyncio.run(load(port, args, b'PING\n'))
+        elapsed = time.perf_counter() - start
+    finally:
+        server.send_signal(signal.SIGTERM)
+        try:
+            server.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+    latencies.sort()
+    def percentile(fraction):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * fraction))] * 1000 if latencies else float('nan')
+    return len(latencies), failures, elapsed, percentile(0.5), percentile(0.99)
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test a generated-language server with many concurrent clients")
+    parser.add_argument('--interpreter', default=DEFAULT_INTERPRETER, help="Path to a generated interpreter module")
+    parser.add_argument('--connections', type=int, default=5000, help="Total connections to open")
+    parser.add_argument('--concurrency', type=int, default=2000, help="Connections open at the same time")
+    parser.add_argument('--requests', type=int, default=1, help="Requests sent on each keep-alive connection")
+    parser.add_argument('--think-ms', type=float, default=0, help="Pause between a client's requests, in milliseconds")
+    parser.add_argument('--max-workers', type=int, default=64, help="Handler threads for --concurrent runs")
+    parser.add_argument('--modes', default='interpret,compile', help="Comma-separated execution modes")
+    args = parser.parse_args()
+
+    lang = language_constants(args.interpreter)
+    print(f"{'server':>28} {'ok':>7} {'failed':>7} {'conn/s':>9} {'req/s':>9} {'p50 ms':>8} {'p99 ms':>8}")
+    with tempfile.TemporaryDirectory() as directory:
+        for mode in args.modes.split(','):
+            for concurrent in (False, True):
+                port = free_port()
+                program_path = os.path.join(directory, f"server{lang['FILE_EXTENSION']}")
+                with open(program_path, 'w') as file:
+                    file.write(make_server_program(lang, port))
+                flags = ['--mode', mode]
+                if concurrent:
+                    flags += ['--concurrent', '--max-workers', str(args.max_workers)]
+                ok, failed, elapsed, p50, p99 = run_setting(args.interpreter, program_path, port, flags, args)
+                label = f"{mode} {'concurrent' if concurrent else 'serial'}"
+                print(f"{label:>28} {ok:>7} {failed:>7} {ok / elapsed:>9.0f} {ok * args.requests / elapsed:>9.0f} {p50:>8.1f} {p99:>8.1f}")
+
+if __name__ == "__main__":
+    main()
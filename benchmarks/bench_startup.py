@@ -0,0 +1,99 @@
+import argparse
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from bench_server import DEFAULT_INTERPRETER, language_constants
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+def time_command(command, env, runs):
+    # Best and median seconds for command to start, run and exit, after one
+    # untimed run that writes any bytecode and program caches
+    subprocess.run(command, stdout=subprocess.DEVNULL, env=env, check=True)
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command, stdout=subprocess.DEVNULL, env=env, check=True)
+        samples.append(time.perf_counter() - start)
+    return min(samples), statistics.median(samples)
+
+def import_cost(lib_dir, name, env):
+    # Milliseconds to import the interpreter module with cached bytecode,
+    # and how many modules importing it loads, under python -S
+    script = (f"import sys, time; sys.path[0] = {lib_dir!r}; before = set(sys.modules); start = time.perf_counter()\n"
+              f"import {name}\n"
+              f"print((time.perf_counter() - start) * 1000, len(set(sys.modules) - before))")
+    subprocess.run([sys.executable, '-S', '-c', script], stdout=subprocess.DEVNULL, env=env, check=True)
+    samples = []
+    for _ in range(10):
+        result = subprocess.run([sys.executable, '-S', '-c', script], capture_output=True, text=True, env=env,
+                                check=True)
+        milliseconds, modules = result.stdout.split()
+        samples.append((float(milliseconds), int(modules)))
+    return min(samples)
+
+def make_language(directory, interpreter, zipapp=True):
+    # A copy of the interpreter in directory/lib with both shell launchers and
+    # a zipapp, built by langmaker
+    sys.path.insert(0, ROOT)
+    import langmaker
+    name = os.path.splitext(os.path.basename(interpreter))[0]
+    lib_dir = os.path.join(directory, 'lib')
+    os.makedirs(lib_dir)
+    shutil.copy(interpreter, lib_dir)
+    langmaker.generate_shell_script(directory, 'run', name)
+    langmaker.generate_shell_script(directory, 'run-isolated', name, isolated=True)
+    if zipapp:
+        langmaker.generate_zipapp(directory, lib_dir, name)
+    return name, lib_dir
+
+def main():
+    parser = argparse.ArgumentParser(description="Time starting the interpreter and running a one-line program "
+                                                 "in a new process, through each kind of launcher")
+    parser.add_argument('--interpreter', default=DEFAULT_INTERPRETER, help="Path to a generated interpreter module")
+    parser.add_argument('--compare', help="Path to another interpreter, such as one that imports everything "
+                                          "eagerly, to time run as a script")
+    parser.add_argument('--runs', type=int, default=30, help="Timed runs of each command")
+    args = parser.parse_args()
+
+    lang = language_constants(args.interpreter)
+    env = dict(os.environ)
+    # Launchers rely on cached bytecode, which this would turn off
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    with tempfile.TemporaryDirectory() as directory:
+        program = os.path.join(directory, f"hello{lang['FILE_EXTENSION']}")
+        with open(program, 'w') as file:
+            file.write(f'{lang["COMMAND_PREFIX"]}PRINT({lang["TYPE_PREFIX_STRING"]} "HELLO")\n')
+        language_dir = os.path.join(directory, 'language')
+        name, lib_dir = make_language(language_dir, args.interpreter)
+        commands = [
+            ('python -S (floor)', [sys.executable, '-S', '-c', 'pass']),
+            ('script', [sys.executable, os.path.join(lib_dir, f"{name}.py"), program]),
+            ('launcher', [os.path.join(language_dir, 'run'), program]),
+            ('isolated launcher', [os.path.join(language_dir, 'run-isolated'), program]),
+            ('zipapp', [sys.executable, os.path.join(language_dir, f"{name}.pyz"), program]),
+        ]
+        imports = [('interpreter', import_cost(lib_dir, name, env))]
+        if args.compare:
+            compare_dir = os.path.join(directory, 'compared')
+            compare_name, compare_lib = make_language(compare_dir, args.compare, zipapp=False)
+            commands.append(('compared script', [sys.executable, os.path.join(compare_lib, f"{compare_name}.py"),
+                                                 program]))
+            imports.append(('compared', import_cost(compare_lib, compare_name, env)))
+
+        print(f"{'interpreter':>18} {'import ms':>10} {'modules':>8}")
+        for label, (milliseconds, modules) in imports:
+            print(f"{label:>18} {milliseconds:>10.1f} {modules:>8}")
+        print()
+        print(f"{'command':>18} {'best ms':>8} {'median ms':>10}")
+        for label, command in commands:
+            best, median = time_command(command, env, args.runs)
+            print(f"{label:>18} {best * 1000:>8.1f} {median * 1000:>10.1f}")
+
+if __name__ == "__main__":
+    main()
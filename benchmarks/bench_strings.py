@@ -0,0 +1,56 @@
+import argparse
+import io
+import time
+
+from bench_engines import DEFAULT_INTERPRETER, load_interpreter
+
+def make_builder_program(lang, megabytes, piece_length):
+    # Appends piece_length-character pieces to a string until it holds
+    # megabytes million characters, then prints its length
+    p, i, s = lang.COMMAND_PREFIX, lang.TYPE_PREFIX_INTEGER, lang.TYPE_PREFIX_STRING
+    piece = ('ABCDEFGHIJ' * (piece_length // 10 + 1))[:piece_length - 1] + ' '
+    return '\n'.join([
+        f'BODY = {s} ""',
+        f"N = {i} {megabytes * 1000000 // piece_length}",
+        f"{p}WHILE N:",
+        f'    BODY = BODY + {s} "{piece}"',
+        f"    N = N - {i} 1",
+        lang.BLOCK_END,
+        f"{p}PRINT({p}LENGTH(BODY))",
+    ])
+
+def best_time(lang, code, mode, repeat):
+    best = None
+    for _ in range(repeat):
+        stream = io.StringIO()
+        start = time.perf_counter()
+        lang.run(code, mode, output=lang.Output(stream))
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, stream.getvalue()
+
+def main():
+    parser = argparse.ArgumentParser(description="Time building a large string by appending to it in a loop")
+    parser.add_argument('--interpreter', default=DEFAULT_INTERPRETER, help="Path to a generated interpreter module")
+    parser.add_argument('--compare', help="Path to another interpreter, such as one without ropes, to time too")
+    parser.add_argument('--megabytes', type=int, default=10, help="Length of the string built, in millions of characters")
+    parser.add_argument('--piece', type=int, default=100, help="Characters appended at a time")
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    lang = load_interpreter(args.interpreter)
+    other = load_interpreter(args.compare) if args.compare else None
+    code = make_builder_program(lang, args.megabytes, args.piece)
+    print(f"{'mode':>12} {'best (s)':>9} {'MB/s':>8} {'compared (s)':>13}")
+    for mode in lang.EXECUTION_MODES:
+        elapsed, output = best_time(lang, code, mode, args.repeat)
+        compared = '-'
+        if other is not None:
+            other_elapsed, other_output = best_time(other, code, mode, args.repeat)
+            if other_output != output:
+                raise SystemExit(f"The interpreters printed {output!r} and {other_output!r} in {mode} mode")
+            compared = f"{other_elapsed:.3f}"
+        print(f"{mode:>12} {elapsed:>9.3f} {args.megabytes / elapsed:>8.1f} {compared:>13}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+import argparse
+import contextlib
+import gc
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+from bench_engines import DEFAULT_INTERPRETER, load_interpreter, make_loop_program
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+DEFAULT_CONFIG = os.path.join(ROOT, 'example-bhavya-lang-config.json')
+PHASES = ('lex', 'parse', 'interpret', 'compile', 'python', 'vm')
+# Benchmarks faster than this in the baseline are reported but never counted
+# as regressions, since timer noise alone can double them
+MIN_COMPARED_SECONDS = 0.001
+
+# Synthetic programs: each takes the interpreter module and a size, and
+# returns source that prints a single short line
+def straight_line(lang, size):
+    # size assignments of arithmetic over 16 variables, with no control flow
+    # Variable names are letters only
+    i = lang.TYPE_PREFIX_INTEGER
+    names = [f"V{chr(ord('A') + index)}" for index in range(16)]
+    lines = [f"{name} = {i} {index}" for index, name in enumerate(names)]
+    for index in range(size):
+        target, source, other = names[index % 16], names[(index + 15) % 16], names[(index + 5) % 16]
+        lines.append(f"{target} = {source} * {i} 3 + {i} {index % 100} - {source} * {i} 2 + ({other} - {other})")
+    lines.append(f"{lang.COMMAND_PREFIX}PRINT(VA, VP)")
+    return '\n'.join(lines)
+
+def nested_if(lang, size):
+    # A loop of size iterations around IF statements nested 32 deep
+    p, i = lang.COMMAND_PREFIX, lang.TYPE_PREFIX_INTEGER
+    depth = 32
+    lines = [f"N = {i} {size}", f"HITS = {i} 0", f"{p}WHILE N:"]
+    for level in range(depth):
+        indent = '    ' * (level + 1)
+        lines.append(f"{indent}{p}IF N - {i} {level + 1}:")
+    lines.append('    ' * (depth + 1) + f"HITS = HITS + {i} 1")
+    for level in reversed(range(depth)):
+        indent = '    ' * (level + 1)
+        lines += [f"{indent}{p}ELSE:", f"{indent}    HITS = HITS - {i} 1", f"{indent}{lang.BLOCK_END}"]
+    lines += [f"    N = N - {i} 1", lang.BLOCK_END, f"{p}PRINT(HITS)"]
+    return '\n'.join(lines)
+
+def string_concat(lang, size):
+    # Builds a string of 10 * size characters one piece at a time
+    p, i, s = lang.COMMAND_PREFIX, lang.TYPE_PREFIX_INTEGER, lang.TYPE_PREFIX_STRING
+    return '\n'.join([
+        f'TEXT = {s} ""',
+        f"N = {i} {size}",
+        f"{p}WHILE N:",
+        f'    TEXT = TEXT + {s} "ABCDEFGHIJ"',
+        f"    N = N - {i} 1",
+        lang.BLOCK_END,
+        f'{p}PRINT({s} "BUILT", N)',
+    ])
+
+SHAPES = {
+    'straight_line': (straight_line, 20000),
+    'nested_if': (nested_if, 2000),
+    'tight_loop': (make_loop_program, 100000),
+    'string_concat': (string_concat, 20000),
+}
+
+def best_of(repeat, function):
+    # Minimum and median seconds over repeat calls of function(), each of
+    # which returns the seconds it measured. Like timeit, every call starts
+    # from a collected heap and runs with the collector off.
+    samples = []
+    for _ in range(repeat):
+        gc.collect()
+        gc.disable()
+        try:
+            samples.append(function())
+        finally:
+            gc.enable()
+    samples.sort()
+    return samples[0], statistics.median(samples)
+
+def time_phases(lang, code, phases, repeat):
+    # Seconds for each phase of running code: lexing, parsing, and
+    # executing the parsed program in each mode
+    results = {}
+
+    def timed(function, *args):
+        start = time.perf_counter()
+        function(*args)
+        return time.perf_counter() - start
+
+    tokens = lang.lexer(code)
+    program = lang.parse(tokens)
+    if 'lex' in phases:
+        results['lex'] = best_of(repeat, lambda: timed(lang.lexer, code))
+    if 'parse' in phases:
+        results['parse'] = best_of(repeat, lambda: timed(lang.parse, tokens))
+    for mode in ('interpret', 'compile', 'python', 'vm'):
+        if mode not in phases:
+            continue
+        prepared = program
+        if mode == 'python':
+            prepared = lang.compile_python(code)
+        elif mode == 'vm':
+            prepared = lang.compile_bytecode(program)
+        def execute():
+            output = lang.Output(io.StringIO())
+            return timed(lang.execute, prepared, mode, None, None, output)
+        results[mode] = best_of(repeat, execute)
+    return results
+
+def time_generator(config_file, repeat):
+    # Seconds for langmaker.generate_language() to write a whole language
+    # into an empty directory
+    sys.path.insert(0, ROOT)
+    import langmaker
+    def generate():
+        with tempfile.TemporaryDirectory() as directory:
+            shutil.copy(config_file, directory)
+            cwd = os.getcwd()
+            os.chdir(directory)
+            try:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    start = time.perf_counter()
+                    langmaker.generate_language(os.path.basename(config_file))
+                    return time.perf_counter() - start
+            finally:
+                os.chdir(cwd)
+    return best_of(repeat, generate)
+
+def run_suite(args):
+    lang = load_interpreter(args.interpreter)
+    phases = args.phases.split(',')
+    results = {}
+    for name in args.shapes.split(','):
+        make, default_size = SHAPES[name]
+        size = max(1, int(default_size * args.scale))
+        code = make(lang, size)
+        for phase, (best, median) in time_phases(lang, code, phases, args.repeat).items():
+            results[f'{name}.{phase}'] = {'seconds': best, 'median': median, 'size': size}
+            print(f"{name + '.' + phase:>26} {size:>8} {best * 1000:>10.2f} {median * 1000:>10.2f}", flush=True)
+    if not args.no_generator:
+        best, median = time_generator(args.config, args.repeat)
+        results['generator.generate_language'] = {'seconds': best, 'median': median, 'size': 1}
+        print(f"{'generator.generate_language':>26} {1:>8} {best * 1000:>10.2f} {median * 1000:>10.2f}")
+    return {
+        'environment': {
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'machine': platform.machine(),
+            'system': platform.system(),
+            'cpus': os.cpu_count(),
+        },
+        'settings': {'scale': args.scale, 'repeat': args.repeat},
+        'results': results,
+    }
+
+def compare(report, baseline, threshold):
+    # Prints each benchmark's best time relative to the baseline and returns
+    # the names of those slower than it by more than threshold
+    if baseline['environment'] != report['environment']:
+        print(f"warning: the baseline was recorded on {baseline['environment']}")
+    print(f"{'benchmark':>26} {'baseline ms':>12} {'now ms':>10} {'change':>8}")
+    regressions = []
+    for name, result in report['results'].items():
+        before = baseline['results'].get(name)
+        if before is None or before['size'] != result['size']:
+            print(f"{name:>26} {'-':>12} {result['seconds'] * 1000:>10.2f} {'new':>8}")
+            continue
+        change = result['seconds'] / before['seconds'] - 1
+        # Both the best and the median run have to be slower, so that one
+        # unlucky sample on a busy machine doesn't count
+        median_change = result['median'] / before['median'] - 1
+        if before['seconds'] < MIN_COMPARED_SECONDS:
+            flag = '  (too short)'
+        else:
+            flag = '  REGRESSION' if min(change, median_change) > threshold else ''
+        print(f"{name:>26} {before['seconds'] * 1000:>12.2f} {result['seconds'] * 1000:>10.2f} "
+              f"{change:>+7.1%}{flag}")
+        if flag == '  REGRESSION':
+            regressions.append(name)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Time the lexer, parser, execution modes and generator on synthetic programs, "
+                    "and compare the results with a stored baseline")
+    parser.add_argument('--interpreter', default=DEFAULT_INTERPRETER, help="Path to a generated interpreter module")
+    parser.add_argument('--config', default=DEFAULT_CONFIG, help="Language config to time the generator with")
+    parser.add_argument('--shapes', default=','.join(SHAPES), help="Comma-separated program shapes")
+    parser.add_argument('--phases', default=','.join(PHASES), help="Comma-separated phases to time")
+    parser.add_argument('--scale', type=float, default=1.0, help="Multiplier for every program's size")
+    parser.add_argument('--repeat', type=int, default=5, help="Runs of each benchmark; the fastest counts")
+    parser.add_argument('--no-generator', action='store_true', help="Don't time generate_language()")
+    parser.add_argument('--json', metavar='FILE', help="Write the results to FILE as JSON")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help="Baseline results to compare with")
+    parser.add_argument('--save-baseline', action='store_true', help="Store these results as the baseline")
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help="Slowdown over the baseline counted as a regression (default: 0.2, i.e. 20%%)")
+    args = parser.parse_args()
+
+    print(f"{'benchmark':>26} {'size':>8} {'best ms':>10} {'median ms':>10}")
+    report = run_suite(args)
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(report, file, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as file:
+            json.dump(report, file, indent=2)
+            file.write('\n')
+        print(f"Saved the baseline to {args.baseline}")
+    elif os.path.exists(args.baseline):
+        print()
+        regressions = compare(report, json.load(open(args.baseline)), args.threshold)
+        if regressions:
+            raise SystemExit(f"{len(regressions)} benchmarks regressed by more than {args.threshold:.0%}: "
+                             f"{', '.join(regressions)}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+import argparse
+import io
+import os
+import tempfile
+import time
+
+from bench_engines import DEFAULT_INTERPRETER, load_interpreter
+from bench_suite import SHAPES
+
+def best_time(lang, program, mode, repeat):
+    # Seconds of the fastest of repeat runs of a prepared program, and what
+    # it printed
+    best = None
+    for _ in range(repeat):
+        stream = io.StringIO()
+        output = lang.Output(stream)
+        start = time.perf_counter()
+        lang.execute(program, mode, output=output)
+        elapsed = time.perf_counter() - start
+        output.flush()
+        best = elapsed if best is None else min(best, elapsed)
+    return best, stream.getvalue()
+
+def best_load(function, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the bytecode VM with the tree-walking interpreter")
+    parser.add_argument('--interpreter', default=DEFAULT_INTERPRETER, help="Path to a generated interpreter module")
+    parser.add_argument('--shapes', default=','.join(SHAPES), help="Comma-separated program shapes")
+    parser.add_argument('--scale', type=float, default=1.0, help="Multiplier for every program's size")
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    lang = load_interpreter(args.interpreter)
+    print(f"{'shape':>14} {'tree (s)':>9} {'plain vm (s)':>13} {'vm (s)':>8} {'speedup':>8} {'code ints':>14}")
+    for name in args.shapes.split(','):
+        make, default_size = SHAPES[name]
+        code = make(lang, max(1, int(default_size * args.scale)))
+        tree = lang.parse(lang.lexer(code))
+        plain = lang.compile_bytecode(tree, superinstructions=False)
+        fused = lang.compile_bytecode(tree)
+        tree_time, tree_output = best_time(lang, tree, 'interpret', args.repeat)
+        plain_time, plain_output = best_time(lang, plain, 'vm', args.repeat)
+        fused_time, fused_output = best_time(lang, fused, 'vm', args.repeat)
+        if not tree_output == plain_output == fused_output:
+            raise SystemExit(f"The VM and the interpreter printed different output for {name}")
+        print(f"{name:>14} {tree_time:>9.3f} {plain_time:>13.3f} {fused_time:>8.3f} "
+              f"{tree_time / fused_time:>7.1f}x {f'{len(plain.code)} -> {len(fused.code)}':>14}")
+
+    # Starting a program from its source against from a saved bytecode file
+    make, default_size = SHAPES['straight_line']
+    code = make(lang, max(1, int(default_size * args.scale)))
+    with tempfile.TemporaryDirectory() as directory:
+        path = lang.prepare(code, 'vm').save(os.path.join(directory, 'program' + lang.BYTECODE_EXTENSION))
+        source_time = best_load(lambda: lang.prepare(code, 'vm'), args.repeat)
+        file_time = best_load(lambda: lang.Bytecode.load(path), args.repeat)
+        size = os.path.getsize(path)
+    print()
+    print(f"{'load':>14} {'source (s)':>11} {'bytecode file (s)':>18} {'source bytes':>13} {'file bytes':>11}")
+    print(f"{'straight_line':>14} {source_time:>11.4f} {file_time:>18.4f} {len(code):>13} {size:>11}")
+
+if __name__ == "__main__":
+    main()
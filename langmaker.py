@@ -1,95 +1,668 @@
+import argparse
+import codecs
+import concurrent.futures
+import glob
+import hashlib
+import inspect
+import io
 import json
+import operator
 import os
+import py_compile
 import stat
 import sys
+import tempfile
+import textwrap
+import time
+import zipfile
+from array import array
 
-def generate_language(config_file):
-    print(f"Loading configuration from {config_file}")
-    # Load configuration
+LANGS_DIR = 'langs'
+# Records the config and generator that each language in LANGS_DIR was last
+# generated from, so that unchanged languages can be skipped
+MANIFEST_FILE = os.path.join(LANGS_DIR, '.langmaker-manifest.json')
+
+def load_config(config_file):
     with open(config_file, 'r') as f:
-        config = json.load(f)
+        return json.load(f)
+
+def generate_language(config_file, verbose=True):
+    log = print if verbose else (lambda *args: None)
+    log(f"Loading configuration from {config_file}")
+    # Load configuration
+    config = load_config(config_file)
 
     lang_name = config['language_name']
     file_extension = config['file_extension']
     command_name = config['command_name']
 
-    print(f"Generating {lang_name} language")
+    log(f"Generating {lang_name} language")
 
     # Create main languages directory if it doesn't exist
-    langs_dir = 'langs'
-    os.makedirs(langs_dir, exist_ok=True)
-    print(f"Created/confirmed 'langs' directory")
+    os.makedirs(LANGS_DIR, exist_ok=True)
+    log(f"Created/confirmed '{LANGS_DIR}' directory")
 
     # Create language-specific directory
-    lang_dir = os.path.join(langs_dir, lang_name.lower())
+    lang_dir = os.path.join(LANGS_DIR, lang_name.lower())
     os.makedirs(lang_dir, exist_ok=True)
-    print(f"Created/confirmed '{lang_name}' directory")
+    log(f"Created/confirmed '{lang_name}' directory")
 
     # Create lib directory
     lib_dir = os.path.join(lang_dir, 'lib')
     os.makedirs(lib_dir, exist_ok=True)
-    print(f"Created/confirmed 'lib' directory")
+    log("Created/confirmed 'lib' directory")
 
     # Generate interpreter
-    print("Generating interpreter...")
+    log("Generating interpreter...")
     generate_interpreter(lib_dir, config)
-    print("Interpreter generated successfully")
+    log("Interpreter generated successfully")
 
     # Generate README
-    print("Generating README...")
+    log("Generating README...")
     generate_readme(lang_dir, config)
-    print("README generated successfully")
+    log("README generated successfully")
 
     # Generate example programs
-    print("Generating example programs...")
+    log("Generating example programs...")
     generate_examples(lang_dir, config)
-    print("Example programs generated successfully")
+    log("Example programs generated successfully")
+
+    # Generate daemon client
+    log("Generating daemon client...")
+    generate_client(lib_dir, config)
+    log("Daemon client generated successfully")
 
     # Generate shell script
-    print("Generating shell script...")
-    generate_shell_script(lang_dir, command_name, lang_name)
-    print("Shell script generated successfully")
+    log("Generating shell script...")
+    generate_shell_script(lang_dir, command_name, lang_name, config.get('isolated', False))
+    log("Shell script generated successfully")
 
-    print(f"\n{lang_name} language has been successfully generated!")
-    print(f"You can find it in the '{langs_dir}/{lang_name}' directory.")
-    print(f"To run a {lang_name} program, use: ./{command_name} <filename>{file_extension}")
-    # Load configuration
-    with open(config_file, 'r') as f:
-        config = json.load(f)
+    # Generate zipapp
+    if config.get('zipapp', False):
+        log("Generating zipapp...")
+        generate_zipapp(lang_dir, lib_dir, lang_name)
+        log("Zipapp generated successfully")
 
-    lang_name = config['language_name']
-    file_extension = config['file_extension']
-    command_name = config['command_name']
+    log(f"\n{lang_name} language has been successfully generated!")
+    log(f"You can find it in the '{lang_dir}' directory.")
+    log(f"To run a {lang_name} program, use: ./{command_name} <filename>{file_extension}")
+    return lang_dir
 
-    # Create main languages directory if it doesn't exist
-    langs_dir = 'langs'
-    os.makedirs(langs_dir, exist_ok=True)
+def write_file(path, content, newline=None, executable=False):
+    # Writes to a temporary file next to path and then renames it over path,
+    # so that a program reading path, or a run that is interrupted, never
+    # sees a half-written file
+    umask = os.umask(0)
+    os.umask(umask)
+    mode = 0o666 & ~umask
+    if executable:
+        mode |= stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', prefix=f".{os.path.basename(path)}.")
+    try:
+        with os.fdopen(fd, 'wb') if isinstance(content, bytes) else os.fdopen(fd, 'w', newline=newline) as f:
+            f.write(content)
+        os.chmod(temp_path, mode)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
 
-    # Create language-specific directory
-    lang_dir = os.path.join(langs_dir, lang_name)
-    os.makedirs(lang_dir, exist_ok=True)
+# Generating many languages
+def generator_version():
+    # A hash of this file, so that any change to the generator counts as a
+    # new version and regenerates every language
+    with open(os.path.abspath(__file__), 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
 
-    # Create lib directory
-    lib_dir = os.path.join(lang_dir, 'lib')
-    os.makedirs(lib_dir, exist_ok=True)
+def config_hash(config):
+    return hashlib.sha256(json.dumps(config, sort_keys=True).encode()).hexdigest()
 
-    # Generate interpreter
-    generate_interpreter(lib_dir, config)
+def find_configs(paths):
+    # Each path is a config, a directory whose *.json files are all configs,
+    # or a manifest: a JSON list of config paths relative to the manifest.
+    # Returns the config paths in order, without repeats.
+    config_files = []
+    for path in paths:
+        if os.path.isdir(path):
+            config_files += sorted(glob.glob(os.path.join(path, '*.json')))
+            continue
+        with open(path, 'r') as f:
+            listed = json.load(f)
+        if isinstance(listed, list):
+            config_files += [os.path.join(os.path.dirname(path), entry) for entry in listed]
+        else:
+            config_files.append(path)
+    # The same config may be reached through more than one path
+    unique = {}
+    for config_file in config_files:
+        unique.setdefault(os.path.normpath(config_file), config_file)
+    return list(unique.values())
 
-    # Generate README
-    generate_readme(lang_dir, config)
+def load_manifest():
+    try:
+        with open(MANIFEST_FILE, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
 
-    # Generate example programs
-    generate_examples(lang_dir, config)
+def generated(pending, jobs, verbose):
+    # Generates each (name, config_file, entry) in pending, in a pool of jobs
+    # processes when there is more than one, and yields each one with the
+    # exception it raised, or None, as it finishes
+    if jobs == 1 or len(pending) == 1:
+        for item in pending:
+            try:
+                generate_language(item[1], verbose)
+            except Exception as e:
+                yield item, e
+            else:
+                yield item, None
+        return
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = {pool.submit(generate_language, item[1], False): item for item in pending}
+        for future in concurrent.futures.as_completed(futures):
+            yield futures[future], future.exception()
 
-    # Generate shell script
-    generate_shell_script(lang_dir, command_name, lang_name)
+def generate_languages(config_files, jobs=None, force=False):
+    # Generates the language of each config, skipping those whose config and
+    # generator are the same as when the manifest recorded them, unless force
+    # is set. Returns the number of configs that failed.
+    version = generator_version()
+    manifest = load_manifest()
+    failed = 0
+    pending = []
+    sources = {}
+    for config_file in config_files:
+        try:
+            config = load_config(config_file)
+            name = config['language_name'].lower()
+        except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+            print(f"{config_file}: not a language config: {e!r}")
+            failed += 1
+            continue
+        if name in sources:
+            print(f"{config_file}: {config['language_name']} is also generated by {sources[name]}")
+            failed += 1
+            continue
+        sources[name] = config_file
+        entry = {'config_file': config_file, 'config_hash': config_hash(config), 'generator': version}
+        recorded = manifest.get(name, {})
+        interpreter = os.path.join(LANGS_DIR, name, 'lib', f"{name}.py")
+        if (not force and os.path.exists(interpreter) and recorded.get('config_hash') == entry['config_hash']
+                and recorded.get('generator') == version):
+            print(f"{config['language_name']} is up to date")
+            continue
+        pending.append((name, config_file, entry))
+
+    verbose = len(config_files) == 1
+    for (name, config_file, entry), error in generated(pending, jobs, verbose):
+        if error is not None:
+            print(f"{config_file}: generation failed: {error!r}")
+            failed += 1
+            continue
+        manifest[name] = entry
+        # Saved after every language, so an interrupted run keeps its progress
+        write_file(MANIFEST_FILE, json.dumps(manifest, indent=2, sort_keys=True) + '\n')
+        if not verbose:
+            print(f"Generated {os.path.join(LANGS_DIR, name)} from {config_file}")
+    return failed
+
+# Native functions
+# Builtins shared by every generated language, registered as command_prefix
+# + name. Each one is copied into the generated interpreter by its source,
+# so it must be self-contained: it is called with the interpreter followed
+# by the values of its arguments and may only use the modules the
+# interpreter imports at the top. Modules that most programs never need,
+# like socket, are imported inside the functions that use them, so that
+# the interpreter starts without them. See register_function() in the
+# generated interpreter for what arity, exact and pure mean.
+NATIVE_FUNCTIONS = {}
+NATIVE_SUPPORT = []
+# Placeholders for the config values native functions use; every generated
+# interpreter defines its own
+COMMAND_PREFIX = ''
+ENFORCE_UPPERCASE_CODE = False
+
+def native_function(name, arity=None, exact=False, pure=False):
+    def register(function):
+        NATIVE_FUNCTIONS[name] = (function, arity, exact, pure)
+        return function
+    return register
+
+def native_support(definition):
+    # Classes and helpers used by native functions; they are copied into the
+    # generated interpreter, ahead of the functions, in the same way
+    NATIVE_SUPPORT.append(definition)
+    return definition
+
+@native_support
+class Connection:
+    # An accepted connection. Data is received straight into one reusable
+    # buffer per connection and decoded from a view of it, so RECVLINE can
+    # return a single line and keep whatever followed it for the next read.
+    # Decoding is incremental, so a character split across two reads comes
+    # through whole.
+    BUFFER_SIZE = 16384
+    MAX_LINE = 1024 * 1024
+    __slots__ = ('socket', 'buffer', 'view', 'start', 'end', 'decoder')
+
+    def __init__(self, sock):
+        self.socket = sock
+        self.buffer = self.view = self.decoder = None
+        self.start = self.end = 0
+
+    def __repr__(self):
+        return repr(self.socket)
+
+    def fileno(self):
+        return self.socket.fileno()
+
+    def send(self, data):
+        return self.socket.send(data)
+
+    def sendall(self, data):
+        self.socket.sendall(data)
+
+    def shutdown(self, how):
+        self.socket.shutdown(how)
+
+    def close(self):
+        if self.view is not None:
+            self.view.release()
+        self.buffer = self.view = None
+        self.start = self.end = 0
+        self.socket.close()
+
+    def fill(self):
+        # Receives more data after what is buffered; False at end of stream
+        if self.buffer is None:
+            self.buffer = bytearray(self.BUFFER_SIZE)
+            self.view = memoryview(self.buffer)
+        elif self.start == self.end:
+            self.start = self.end = 0
+        elif self.end == len(self.buffer):
+            pending = self.end - self.start
+            if self.start:
+                self.view[:pending] = self.view[self.start:self.end]
+                self.start, self.end = 0, pending
+            else:
+                self.view.release()
+                self.buffer.extend(bytes(len(self.buffer)))
+                self.view = memoryview(self.buffer)
+        received = self.socket.recv_into(self.view[self.end:])
+        self.end += received
+        return received > 0
+
+    def decode(self, end, final=False):
+        # The buffered bytes up to end as text, holding back the start of a
+        # character whose other bytes have not arrived yet
+        if self.decoder is None:
+            self.decoder = codecs.getincrementaldecoder('utf-8')('replace')
+        text = self.decoder.decode(self.view[self.start:end], final)
+        self.start = end
+        return text
+
+    def recv(self, size):
+        # Up to size bytes, reading from the socket only if none are
+        # buffered, or '' once the peer has closed. Bytes that only start a
+        # character are not returned alone; the next read completes it.
+        while True:
+            if self.start == self.end and not self.fill():
+                return self.decode(self.end, final=True)
+            text = self.decode(min(self.end, self.start + size))
+            if text:
+                return text
+
+    def recvline(self):
+        # The next line including its newline, a partial line at end of
+        # stream or after MAX_LINE bytes, or '' once the peer has closed
+        searched = self.start
+        while True:
+            newline = self.buffer.find(b'\n', searched, self.end) if self.buffer is not None else -1
+            if newline >= 0:
+                end = newline + 1
+                break
+            if self.end - self.start >= self.MAX_LINE:
+                end = self.start + self.MAX_LINE
+                break
+            searched = self.end - self.start
+            if not self.fill():
+                return self.decode(self.end, final=True)
+            searched += self.start
+        return self.decode(end)
+
+@native_function('PRINT')
+def native_print(interpreter, *values):
+    interpreter.output.write(' '.join(map(str, values)) + '\n')
+
+@native_function('SHOUT', arity=1, exact=True, pure=True)
+def native_shout(interpreter, value):
+    return str(value).upper()
+
+@native_function('SOCKET', arity=1)
+def native_socket(interpreter, socket_name):
+    import socket
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    interpreter.sockets[socket_name] = server
+    return socket_name
+
+@native_function('BIND', arity=2)
+def native_bind(interpreter, socket_name, port):
+    interpreter.sockets[socket_name].bind(('', port))
+
+@native_function('LISTEN', arity=2)
+def native_listen(interpreter, socket_name, backlog):
+    listener = interpreter.sockets[socket_name]
+    listener.listen(backlog)
+    # A signal that arrives just before accept() blocks does not interrupt
+    # it, so ACCEPT wakes up every second to let its handler run
+    listener.settimeout(1.0)
+
+@native_function('ACCEPT', arity=1)
+def native_accept(interpreter, socket_name):
+    # Output printed before waiting for a client should not wait with it
+    interpreter.output.flush()
+    import socket
+    listener = interpreter.sockets[socket_name]
+    counters = interpreter.counters
+    started = time.perf_counter() if counters is not None else 0.0
+    while True:
+        try:
+            conn, _ = listener.accept()
+        except socket.timeout:
+            continue
+        if counters is not None:
+            counters.accepted(time.perf_counter() - started)
+        return Connection(conn)
+
+@native_function('SEND', arity=2)
+def native_send(interpreter, conn, data):
+    sent = conn.send(str(data).encode())
+    if interpreter.counters is not None:
+        interpreter.counters.bytes_sent += sent
+
+@native_function('SENDALL', arity=2)
+def native_sendall(interpreter, conn, data):
+    data = str(data).encode()
+    conn.sendall(data)
+    if interpreter.counters is not None:
+        interpreter.counters.bytes_sent += len(data)
+
+@native_function('RECV', arity=2)
+def native_recv(interpreter, conn, size):
+    # A size below 1 would return '', which means the peer has closed
+    size = int(size)
+    if size < 1:
+        raise ValueError(f"{COMMAND_PREFIX}RECV needs a size of at least 1, not {size}")
+    return conn.recv(size)
+
+@native_function('RECVLINE', arity=1)
+def native_recvline(interpreter, conn):
+    return conn.recvline()
+
+@native_function('CLOSE', arity=1)
+def native_close(interpreter, target):
+    # Closes a connection, or a listening socket given its name
+    if isinstance(target, str):
+        target = interpreter.sockets.pop(target)
+    target.close()
+
+@native_support
+class NumericArray:
+    # A one-dimensional array of numbers: the value of array literals and of
+    # the array builtins. Arithmetic between an array and a number, or two
+    # arrays of the same length, works element by element and makes a new
+    # array; nothing changes an array once it is made. Elements are 64-bit
+    # integers, or 64-bit floats if any of them is a float. They are held in
+    # a NumPy array when NumPy is installed and in an array.array otherwise.
+    # NumPy is imported when the first array is made, so programs without
+    # arrays never load it. Integer arithmetic that overflows 64 bits wraps
+    # around with NumPy and fails without it.
+    __slots__ = ('data',)
+    # The numpy module, or False without it; None until the first array
+    numpy = None
+    REDUCTIONS = {'sum': sum, 'min': min, 'max': max}
+
+    def __init__(self, data):
+        self.data = data
+
+    @classmethod
+    def backend(cls):
+        if cls.numpy is None:
+            try:
+                import numpy
+            except ImportError:
+                numpy = False
+            cls.numpy = numpy
+        return cls.numpy
+
+    @classmethod
+    def of(cls, values):
+        # An array of values, which must all be numbers
+        values = list(values)
+        floating = False
+        for value in values:
+            if isinstance(value, float):
+                floating = True
+            elif not isinstance(value, int):
+                raise TypeError(f"Array elements must be numbers, not {type(value).__name__}")
+        numpy = cls.backend()
+        if numpy:
+            return cls(numpy.array(values, dtype=numpy.float64 if floating else numpy.int64))
+        return cls(array('d' if floating else 'q', values))
+
+    @classmethod
+    def parse(cls, text):
+        # An array of the numbers in text, separated by commas or whitespace;
+        # as in source code, numbers without a decimal point are integers
+        values = []
+        for item in text.replace(',', ' ').split():
+            try:
+                values.append(int(item))
+            except ValueError:
+                values.append(float(item))
+        return cls.of(values)
+
+    @classmethod
+    def range(cls, *bounds):
+        # The integers of range(*bounds)
+        bounds = range(*bounds)
+        numpy = cls.backend()
+        if numpy:
+            return cls(numpy.arange(bounds.start, bounds.stop, bounds.step, dtype=numpy.int64))
+        return cls(array('q', bounds))
+
+    def __len__(self):
+        return len(self.data)
+
+    def __str__(self):
+        return '[' + ', '.join(map(str, self.data.tolist())) + ']'
+
+    __repr__ = __str__
+
+    def __getitem__(self, index):
+        # Only slices, which copy, so that arrays never share elements
+        if not isinstance(index, slice):
+            raise TypeError("Arrays can only be sliced")
+        data = self.data[index]
+        return type(self)(data.copy() if self.numpy else data)
+
+    def elementwise(self, other, op, reflected):
+        # self op other, or other op self when reflected
+        data = self.data
+        if isinstance(other, NumericArray):
+            if len(other.data) != len(data):
+                raise ValueError(f"Arrays have different lengths: {len(data)} and {len(other.data)}")
+            other = other.data
+        elif not isinstance(other, (int, float)):
+            return NotImplemented
+        left, right = (other, data) if reflected else (data, other)
+        numpy = self.numpy
+        if op is operator.truediv:
+            # NumPy divides by zero without raising, and Python raises
+            # different messages for integers and floats
+            if isinstance(right, (int, float)):
+                zero = right == 0
+            else:
+                zero = not numpy.all(right) if numpy else 0 in right
+            if zero:
+                raise ZeroDivisionError("division by zero")
+        if numpy:
+            # Python float arithmetic overflows to inf and nan without warnings
+            with numpy.errstate(all='ignore'):
+                return type(self)(op(left, right))
+        floating = op is operator.truediv or any(
+            side.typecode == 'd' if isinstance(side, array) else isinstance(side, float) for side in (left, right)
+        )
+        if not isinstance(left, array):
+            left = [left] * len(data)
+        if not isinstance(right, array):
+            right = [right] * len(data)
+        return type(self)(array('d' if floating else 'q', map(op, left, right)))
+
+    def __add__(self, other):
+        return self.elementwise(other, operator.add, False)
+
+    def __radd__(self, other):
+        return self.elementwise(other, operator.add, True)
+
+    def __sub__(self, other):
+        return self.elementwise(other, operator.sub, False)
+
+    def __rsub__(self, other):
+        return self.elementwise(other, operator.sub, True)
+
+    def __mul__(self, other):
+        return self.elementwise(other, operator.mul, False)
+
+    def __rmul__(self, other):
+        return self.elementwise(other, operator.mul, True)
+
+    def __truediv__(self, other):
+        return self.elementwise(other, operator.truediv, False)
+
+    def __rtruediv__(self, other):
+        return self.elementwise(other, operator.truediv, True)
+
+    def reduce(self, name):
+        # The sum, min, max or mean of the elements, as a plain number
+        data = self.data
+        if name != 'sum' and not len(data):
+            raise ValueError(f"Cannot take the {name} of an empty array")
+        if self.numpy:
+            return getattr(data, name)().item()
+        if name == 'mean':
+            return sum(data) / len(data)
+        return self.REDUCTIONS[name](data)
+
+@native_support
+def numeric_array(value, function):
+    # value, which the builtin function needs to be an array
+    if not isinstance(value, NumericArray):
+        raise TypeError(f"{COMMAND_PREFIX}{function} expects an array, not {type(value).__name__}")
+    return value
+
+@native_function('ARRAYOF')
+def native_arrayof(interpreter, *values):
+    return NumericArray.of(values)
+
+@native_function('RANGE')
+def native_range(interpreter, *bounds):
+    # RANGE(STOP), RANGE(START, STOP) or RANGE(START, STOP, STEP), as in Python
+    return NumericArray.range(*bounds)
+
+@native_function('LOADARRAY', arity=1, exact=True)
+def native_loadarray(interpreter, path):
+    # Reads numbers separated by commas or whitespace. Programs that must be
+    # upper case can only name upper-case files, so a missing path is looked
+    # up again ignoring case.
+    if interpreter.working_directory:
+        path = os.path.join(interpreter.working_directory, path)
+    if ENFORCE_UPPERCASE_CODE and not os.path.exists(path):
+        directory, name = os.path.split(path)
+        matches = [entry for entry in os.listdir(directory or '.') if entry.upper() == name.upper()]
+        if len(matches) == 1:
+            path = os.path.join(directory, matches[0])
+    with open(path) as file:
+        return NumericArray.parse(file.read())
+
+@native_function('SLICE', arity=3, exact=True, pure=True)
+def native_slice(interpreter, values, start, stop):
+    # Elements start to stop of an array, or characters of a string, with
+    # Python's rules for negative and out-of-range indexes
+    if not isinstance(values, str):
+        numeric_array(values, 'SLICE')
+    return values[start:stop]
+
+@native_function('LENGTH', arity=1, exact=True, pure=True)
+def native_length(interpreter, values):
+    return len(values)
+
+@native_function('SUM', arity=1, exact=True, pure=True)
+def native_sum(interpreter, values):
+    return numeric_array(values, 'SUM').reduce('sum')
+
+@native_function('MIN', arity=1, exact=True, pure=True)
+def native_min(interpreter, values):
+    return numeric_array(values, 'MIN').reduce('min')
+
+@native_function('MAX', arity=1, exact=True, pure=True)
+def native_max(interpreter, values):
+    return numeric_array(values, 'MAX').reduce('max')
+
+@native_function('MEAN', arity=1, exact=True, pure=True)
+def native_mean(interpreter, values):
+    return numeric_array(values, 'MEAN').reduce('mean')
+
+def native_functions_source():
+    # Source that defines and registers NATIVE_FUNCTIONS in a generated interpreter
+    parts = []
+    for definition in NATIVE_SUPPORT:
+        source = textwrap.dedent(inspect.getsource(definition))
+        parts.append(source[source.index('def ' if inspect.isfunction(definition) else 'class '):])
+    for name, (function, arity, exact, pure) in NATIVE_FUNCTIONS.items():
+        source = textwrap.dedent(inspect.getsource(function))
+        source = source[source.index('def '):]
+        options = [function.__name__]
+        if arity is not None:
+            options.append(f'arity={arity}')
+        if exact:
+            options.append('exact=True')
+        if pure:
+            options.append('pure=True')
+        parts.append(f"{source}\nregister_function(f'{{COMMAND_PREFIX}}{name}', {', '.join(options)})\n")
+    return '\n'.join(parts)
+
+def array_type_prefix(config):
+    # Configs written before arrays existed have no array prefix
+    return config['type_prefixes'].get('array', f"{config['command_prefix']}ARRAY")
 
 def generate_interpreter(lib_dir, config):
+    native_functions = native_functions_source()
     interpreter_code = f"""
+# Modules that only some features need, such as socket, multiprocessing and
+# json, are imported where they are used, so that programs that don't use
+# those features start faster
+import argparse
+import atexit
+import bisect
+import codecs
+import contextlib
+import copy
+import hashlib
+import io
+import marshal
+import mmap
+import operator
+import os
+import re
+import signal
 import sys
-import json
-import socket
+import threading
+import time
+import weakref
+from array import array
 
 class {config['language_name']}SyntaxError(Exception):
     pass
@@ -104,237 +677,935 @@ ENFORCE_UPPERCASE_CODE = {config['enforce_uppercase_code']}
 TYPE_PREFIX_INTEGER = "{config['type_prefixes']['integer']}"
 TYPE_PREFIX_FLOAT = "{config['type_prefixes']['float']}"
 TYPE_PREFIX_STRING = "{config['type_prefixes']['string']}"
+TYPE_PREFIX_ARRAY = "{array_type_prefix(config)}"
 TRUE_VALUE = "{config['true_value']}"
 FALSE_VALUE = "{config['false_value']}"
 BLOCK_END = "{config['block_end']}"
 
+# Keywords recognised by the parser
+IF_KEYWORD = f"{{COMMAND_PREFIX}}IF"
+ELSE_KEYWORD = f"{{COMMAND_PREFIX}}ELSE"
+WHILE_KEYWORD = f"{{COMMAND_PREFIX}}WHILE"
+
 # Lexer
+# Words, single-character operators and strings (unterminated ones run to
+# the end of the line); everything else on a line separates tokens.
+TOKEN_PATTERN = re.compile(r'[^\\s"+\\-*/()=:,]+|[+\\-*/()=:,]|"[^"]*"?')
+
+class Tokens(list):
+    # The token texts produced by lexer(). Only lines are tracked, and per
+    # line rather than per token: line_numbers holds each line that produced
+    # tokens and line_ends the token count up to the end of that line, so
+    # lexing does no per-token bookkeeping beyond the regex scan itself.
+    def __init__(self, texts=(), line_numbers=None, line_ends=None):
+        list.__init__(self, texts)
+        self.line_numbers = array('I') if line_numbers is None else line_numbers
+        self.line_ends = array('I') if line_ends is None else line_ends
+
+    def line(self, index):
+        return self.line_numbers[bisect.bisect_right(self.line_ends, index)]
+
+    def to_data(self):
+        return list(self), self.line_numbers.tobytes(), self.line_ends.tobytes()
+
+    @classmethod
+    def from_data(cls, data):
+        texts, line_numbers, line_ends = data
+        tokens = cls(texts)
+        tokens.line_numbers.frombytes(line_numbers)
+        tokens.line_ends.frombytes(line_ends)
+        return tokens
+
+def strip_comment(line, line_number, comment_start=None):
+    if comment_start is None:
+        comment_start = line.find(COMMENT_PREFIX)
+        if comment_start < 0:
+            return line
+    if ENFORCE_UPPERCASE_COMMENTS and any(c.islower() for c in line[comment_start:]):
+        raise {config['language_name']}SyntaxError(f"Syntax Error on line {{line_number}}: Comments must be in all caps")
+    return line[:comment_start].rstrip()
+
 def lexer(code):
-    tokens = []
-    lines = code.split('\\n')
-    for line_number, line in enumerate(lines, 1):
-        if COMMENT_PREFIX in line:
-            comment_start = line.index(COMMENT_PREFIX)
-            if ENFORCE_UPPERCASE_COMMENTS and any(c.islower() for c in line[comment_start:]):
-                raise {config['language_name']}SyntaxError(f"Syntax Error on line {{line_number}}: Comments must be in all caps")
-            line = line[:comment_start].strip()
-        if not line:
-            continue
-        line_tokens = []
-        current = ''
-        in_string = False
-        for char in line:
-            if char == '"' and not in_string:
-                if current:
-                    line_tokens.append(current)
-                    current = ''
-                in_string = True
-                current += char
-            elif char == '"' and in_string:
-                current += char
-                line_tokens.append(current)
-                current = ''
-                in_string = False
-            elif in_string:
-                current += char
-            elif char.isspace():
-                if current:
-                    line_tokens.append(current)
-                    current = ''
-            elif char in '+-*/()=:,':
-                if current:
-                    line_tokens.append(current)
-                    current = ''
-                line_tokens.append(char)
-            else:
-                current += char
-        if current:
-            line_tokens.append(current)
-        tokens.extend(line_tokens)
+    tokens = Tokens()
+    line_numbers = tokens.line_numbers
+    line_ends = tokens.line_ends
+    findall = TOKEN_PATTERN.findall
+    for line_number, line in enumerate(code.split('\\n'), 1):
+        comment_start = line.find(COMMENT_PREFIX)
+        if comment_start >= 0:
+            line = strip_comment(line, line_number, comment_start)
+        line_tokens = findall(line)
+        if line_tokens:
+            tokens += line_tokens
+            line_numbers.append(line_number)
+            line_ends.append(len(tokens))
     return tokens
 
+# Output
+# Characters of program output collected before they are written
+OUTPUT_BUFFER_SIZE = 64 * 1024
+
+class Output:
+    # Where PRINT writes. Text is collected and written to the stream in one
+    # call once buffer_size characters are waiting, at every newline if the
+    # stream is a terminal (or line_buffered is set), on flush() and at
+    # exit. A buffer_size of 0 writes everything straight through, and is
+    # the default for write-through streams such as sys.stdout under
+    # python -u or PYTHONUNBUFFERED. The stream can be any text file, such
+    # as an io.StringIO to capture output.
+    instances = weakref.WeakSet()
+
+    def __init__(self, stream=None, buffer_size=None, line_buffered=None):
+        self.stream = sys.stdout if stream is None else stream
+        if buffer_size is None:
+            buffer_size = 0 if getattr(self.stream, 'write_through', False) else OUTPUT_BUFFER_SIZE
+        self.buffer_size = buffer_size
+        if line_buffered is None:
+            isatty = getattr(self.stream, 'isatty', None)
+            line_buffered = bool(isatty and isatty())
+        self.line_buffered = line_buffered
+        self.pending = []
+        self.size = 0
+        self.flushed_at = time.monotonic()
+        self.lock = threading.Lock()
+        Output.instances.add(self)
+
+    def write(self, text):
+        with self.lock:
+            self.pending.append(text)
+            self.size += len(text)
+            if self.size >= self.buffer_size or (self.line_buffered and '\\n' in text):
+                self.drain()
+
+    def flush(self):
+        with self.lock:
+            self.drain()
+
+    def flush_stale(self, max_age):
+        # Flushes text that has been waiting for at least max_age seconds
+        if self.pending and time.monotonic() - self.flushed_at >= max_age:
+            self.flush()
+
+    def drain(self):
+        if self.pending:
+            text = ''.join(self.pending)
+            self.pending.clear()
+            self.size = 0
+            self.stream.write(text)
+        self.stream.flush()
+        self.flushed_at = time.monotonic()
+
+    @classmethod
+    def flush_all(cls):
+        # Before forking and exiting, so no output is lost or written twice
+        for output in list(cls.instances):
+            with contextlib.suppress(OSError, ValueError):
+                output.flush()
+
+atexit.register(Output.flush_all)
+
+# Native functions
+class NativeFunction:
+    __slots__ = ('name', 'function', 'arity', 'exact', 'pure')
+
+    def __init__(self, name, function, arity=None, exact=False, pure=False):
+        self.name = name
+        self.function = function
+        self.arity = arity
+        self.exact = exact
+        self.pure = pure
+
+    def arity_error(self):
+        count = 'one argument' if self.arity == 1 else f'{{self.arity}} arguments'
+        return ValueError(f"{{self.name}} function expects exactly {{count}}")
+
+# Full function name -> NativeFunction, for every function programs can call
+FUNCTIONS = {{}}
+_functions_signature = None
+
+def register_function(name, function, arity=None, exact=False, pure=False):
+    # Makes a Python function callable from programs as name (builtins
+    # include COMMAND_PREFIX). It is called with the interpreter followed by
+    # the values of the first arity arguments, or of all of them when arity
+    # is None; a call with fewer fails when it runs. With exact, a call with
+    # any other number of arguments fails before evaluating them. A pure
+    # function ignores the interpreter and has no side effects, so the
+    # optimizer may call it ahead of time on literal arguments.
+    global _functions_signature
+    if ENFORCE_UPPERCASE_CODE:
+        name = name.upper()
+    FUNCTIONS[name] = NativeFunction(name, function, arity, exact, pure)
+    _functions_signature = None
+
+def functions_signature():
+    # Identifies the registered functions for the compiled-program caches
+    global _functions_signature
+    if _functions_signature is None:
+        _functions_signature = repr(sorted(
+            (name, native.arity, native.exact, native.pure) for name, native in FUNCTIONS.items()
+        ))
+    return _functions_signature
+
+# Builtins, generated from NATIVE_FUNCTIONS in langmaker.py
+{native_functions}
 # Parser
+# Nodes use __slots__ rather than a per-instance __dict__, which roughly
+# halves their size; parsed programs can hold millions of them.
 class AST:
-    pass
+    __slots__ = ()
 
 class Number(AST):
+    __slots__ = ('value',)
+
     def __init__(self, value):
         self.value = value
 
 class String(AST):
+    __slots__ = ('value',)
+
     def __init__(self, value):
         self.value = value
 
 class BooleanLiteral(AST):
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+class ArrayLiteral(AST):
+    # value is a NumericArray, which is never modified, so the node can
+    # share it with every evaluation
+    __slots__ = ('value',)
+
     def __init__(self, value):
         self.value = value
 
 class BinOp(AST):
+    __slots__ = ('left', 'op', 'right', 'quick', 'warmup')
+
     def __init__(self, left, op, right):
         self.left = left
         self.op = op
         self.right = right
+        # The interpreter's specialized evaluator for this node, and the
+        # generic executions left before it is built (see quicken())
+        self.quick = None
+        self.warmup = QUICKEN_WARMUP
 
 class Variable(AST):
+    __slots__ = ('name', 'slot')
+
     def __init__(self, name):
         self.name = name
 
 class Assignment(AST):
+    __slots__ = ('name', 'value', 'slot', 'appended')
+
     def __init__(self, name, value):
         self.name = name
         self.value = value
+        # (A, B, ...) when this is NAME = NAME + A + B ..., which the
+        # interpreters run without copying a long string (see concatenate())
+        self.appended = appended_values(name, value)
+
+def appended_values(name, value):
+    appended = []
+    while isinstance(value, BinOp) and value.op == '+':
+        appended.append(value.right)
+        value = value.left
+    if not appended or not isinstance(value, Variable) or value.name != name:
+        return None
+    appended.reverse()
+    return tuple(appended)
+
+def appended_names(statements, names):
+    # Adds the names that statements append to, at any depth, to names
+    for node in statements:
+        if isinstance(node, Assignment) and node.appended is not None:
+            names.add(node.name)
+        elif isinstance(node, IfStatement):
+            appended_names(node.if_body, names)
+            appended_names(node.else_body or [], names)
+        elif isinstance(node, WhileLoop):
+            appended_names(node.body, names)
+
+def assigned_names(statements, names):
+    # Adds the names that statements assign, at any depth, to names
+    for node in statements:
+        if isinstance(node, Assignment):
+            names.add(node.name)
+        elif isinstance(node, IfStatement):
+            assigned_names(node.if_body, names)
+            assigned_names(node.else_body or [], names)
+        elif isinstance(node, WhileLoop):
+            assigned_names(node.body, names)
+
+def read_names(nodes, names):
+    # Adds the variables that nodes, statements or expressions, read at any
+    # depth to names
+    for node in nodes:
+        if isinstance(node, Variable):
+            names.add(node.name)
+        elif isinstance(node, BinOp):
+            read_names((node.left, node.right), names)
+        elif isinstance(node, FunctionCall):
+            read_names(node.args, names)
+        elif isinstance(node, IfStatement):
+            read_names([node.condition] + node.if_body + (node.else_body or []), names)
+        elif isinstance(node, WhileLoop):
+            read_names([node.condition] + node.body, names)
+        elif isinstance(getattr(node, 'value', None), AST):
+            # Assignments, and the wrappers around an expression
+            read_names((node.value,), names)
 
 class FunctionCall(AST):
+    __slots__ = ('name', 'args')
+
     def __init__(self, name, args):
         self.name = name
         self.args = args
 
 class IfStatement(AST):
+    __slots__ = ('condition', 'if_body', 'else_body')
+
     def __init__(self, condition, if_body, else_body=None):
         self.condition = condition
         self.if_body = if_body
         self.else_body = else_body
 
 class WhileLoop(AST):
-    def __init__(self, condition, body):
+    __slots__ = ('condition', 'body', 'invariants')
+
+    def __init__(self, condition, body, invariants=()):
         self.condition = condition
         self.body = body
+        # Invariant nodes in the loop whose cached values are reset
+        # every time the loop starts
+        self.invariants = invariants
+
+class Invariant(AST):
+    # Wraps an expression that cannot change while a loop runs (built by
+    # the optimizer). It is evaluated where it appears, the first time it
+    # is needed in each run of the loop, and the value is reused after that.
+    __slots__ = ('value', 'slot')
+
+    def __init__(self, value):
+        self.value = value
+
+def statement_parser(tokens, lines=None, line_of=None):
+    # Returns parse_next(start), which parses the top-level statement that
+    # begins at tokens[start] and returns it with the position after it,
+    # and position(), the cursor where parsing last stopped (or failed).
+    # Tokens are consumed by advancing a cursor instead of popping from the
+    # front of the list, which keeps parsing linear in the program length.
+    # Given a lines dict, every statement is mapped to line_of(index of its
+    # first token); nodes themselves carry no positions.
+    pos = 0
+    end = len(tokens)
+    # Leaf nodes are never modified, so every occurrence of the same literal
+    # or variable shares one node; programs repeat them constantly.
+    leaves = {{}}
+
+    def leaf(key, node_type, value):
+        node = leaves.get(key)
+        if node is None:
+            node = leaves[key] = node_type(value)
+        return node
+
+    def advance():
+        nonlocal pos
+        token = tokens[pos]
+        pos += 1
+        return token
 
-def parse(tokens):
     def parse_expression():
         result = parse_term()
-        while tokens and tokens[0] in '+-':
-            op = tokens.pop(0)
+        while pos < end and tokens[pos] in '+-':
+            op = advance()
             right = parse_term()
             result = BinOp(result, op, right)
         return result
 
     def parse_term():
         result = parse_factor()
-        while tokens and tokens[0] in '*/':
-            op = tokens.pop(0)
+        while pos < end and tokens[pos] in '*/':
+            op = advance()
             right = parse_factor()
             result = BinOp(result, op, right)
         return result
 
     def parse_factor():
-        if not tokens:
+        if pos >= end:
             raise {config['language_name']}SyntaxError("Unexpected end of input")
-        if tokens[0] == '(':
-            tokens.pop(0)  # Remove '('
+        token = tokens[pos]
+        if token == '(':
+            advance()  # Remove '('
             result = parse_expression()
-            if not tokens or tokens.pop(0) != ')':
+            if pos >= end or advance() != ')':
                 raise {config['language_name']}SyntaxError("Expected closing parenthesis")
             return result
-        elif tokens[0].startswith(COMMAND_PREFIX) or tokens[0] in [TYPE_PREFIX_INTEGER, TYPE_PREFIX_FLOAT, TYPE_PREFIX_STRING]:
+        elif token.startswith(COMMAND_PREFIX) or token in [TYPE_PREFIX_INTEGER, TYPE_PREFIX_FLOAT, TYPE_PREFIX_STRING,
+                                                           TYPE_PREFIX_ARRAY]:
             return parse_command()
-        elif tokens[0] in [TRUE_VALUE, FALSE_VALUE]:
-            return BooleanLiteral(tokens.pop(0) == TRUE_VALUE)
-        elif tokens[0].startswith('"') and tokens[0].endswith('"'):
-            return String(tokens.pop(0)[1:-1])  # Remove quotes
-        elif tokens[0].isalpha():
+        elif token in [TRUE_VALUE, FALSE_VALUE]:
+            return leaf(token, BooleanLiteral, advance() == TRUE_VALUE)
+        elif token.startswith('"') and token.endswith('"'):
+            return leaf(token, String, advance()[1:-1])  # Remove quotes
+        elif token.isalpha():
             return parse_variable_or_function()
         else:
+            # Bare numbers are integers unless they need to be floats
             try:
-                return Number(float(tokens.pop(0)))
+                value = advance()
+                try:
+                    return leaf(token, Number, int(value))
+                except ValueError:
+                    return leaf(token, Number, float(value))
             except ValueError:
-                raise {config['language_name']}SyntaxError(f"Unexpected token: {{tokens[0]}}")
+                raise {config['language_name']}SyntaxError(f"Unexpected token: {{tokens[pos]}}")
 
     def parse_function_call(name):
+        if name not in FUNCTIONS:
+            raise {config['language_name']}SyntaxError(f"Unknown function: {{name}}")
         args = []
-        if tokens and tokens[0] == '(':
-            tokens.pop(0)  # Remove '('
-            while tokens and tokens[0] != ')':
+        if pos < end and tokens[pos] == '(':
+            advance()  # Remove '('
+            while pos < end and tokens[pos] != ')':
                 args.append(parse_expression())
-                if tokens and tokens[0] == ',':
-                    tokens.pop(0)
-            if not tokens or tokens.pop(0) != ')':
+                if pos < end and tokens[pos] == ',':
+                    advance()
+            if pos >= end or advance() != ')':
                 raise {config['language_name']}SyntaxError(f"Expected closing parenthesis in function call to {{name}}")
         return FunctionCall(name, args)
 
     def parse_command():
-        token = tokens.pop(0)
-        if token in [TYPE_PREFIX_INTEGER, TYPE_PREFIX_FLOAT, TYPE_PREFIX_STRING]:
-            if not tokens:
+        token = advance()
+        if token in [TYPE_PREFIX_INTEGER, TYPE_PREFIX_FLOAT, TYPE_PREFIX_STRING, TYPE_PREFIX_ARRAY]:
+            if pos >= end:
                 raise {config['language_name']}SyntaxError(f"Expected value after {{token}}")
-            value = tokens.pop(0)
+            value = advance()
             if token == TYPE_PREFIX_INTEGER:
-                return Number(int(value))
+                return leaf((token, value), Number, int(value))
             elif token == TYPE_PREFIX_FLOAT:
-                return Number(float(value))
+                return leaf((token, value), Number, float(value))
+            elif token == TYPE_PREFIX_ARRAY:
+                try:
+                    return leaf((token, value), ArrayLiteral, NumericArray.parse(value.strip('"')))
+                except (ValueError, TypeError, OverflowError):
+                    raise {config['language_name']}SyntaxError(f"Invalid {{TYPE_PREFIX_ARRAY}} literal: {{value}}")
             else:  # TYPE_PREFIX_STRING
-                return String(value.strip('"'))
+                return leaf((token, value), String, value.strip('"'))
         elif token.startswith(COMMAND_PREFIX):
             return parse_function_call(token)
         else:
             raise {config['language_name']}SyntaxError(f"Unknown command: {{token}}")
 
     def parse_variable_or_function():
-        name = tokens.pop(0)
-        if tokens and tokens[0] == '(':
+        name = advance()
+        if pos < end and tokens[pos] == '(':
             return parse_function_call(name)
-        return Variable(name)
+        return leaf(name, Variable, name)
 
     def parse_if_statement():
-        tokens.pop(0)  # Remove IF
+        advance()  # Remove IF
         condition = parse_expression()
-        if not tokens or tokens.pop(0) != ':':
+        if pos >= end or advance() != ':':
             raise {config['language_name']}SyntaxError("Expected ':' after if condition")
         if_body = []
-        while tokens and tokens[0] != f"{{COMMAND_PREFIX}}ELSE" and tokens[0] != BLOCK_END:
+        while pos < end and tokens[pos] != ELSE_KEYWORD and tokens[pos] != BLOCK_END:
             if_body.append(parse_statement())
         else_body = None
-        if tokens and tokens[0] == f"{{COMMAND_PREFIX}}ELSE":
-            tokens.pop(0)  # Remove ELSE
-            if not tokens or tokens.pop(0) != ':':
+        if pos < end and tokens[pos] == ELSE_KEYWORD:
+            advance()  # Remove ELSE
+            if pos >= end or advance() != ':':
                 raise {config['language_name']}SyntaxError("Expected ':' after else")
             else_body = []
-            while tokens and tokens[0] != BLOCK_END:
+            while pos < end and tokens[pos] != BLOCK_END:
                 else_body.append(parse_statement())
-        if not tokens or tokens.pop(0) != BLOCK_END:
+        if pos >= end or advance() != BLOCK_END:
             raise {config['language_name']}SyntaxError(f"Expected '{{BLOCK_END}}' at the end of if statement")
         return IfStatement(condition, if_body, else_body)
 
     def parse_while_loop():
-        tokens.pop(0)  # Remove WHILE
+        advance()  # Remove WHILE
         condition = parse_expression()
-        if not tokens or tokens.pop(0) != ':':
+        if pos >= end or advance() != ':':
             raise {config['language_name']}SyntaxError("Expected ':' after while condition")
         body = []
-        while tokens and tokens[0] != BLOCK_END:
+        while pos < end and tokens[pos] != BLOCK_END:
             body.append(parse_statement())
-        if not tokens or tokens.pop(0) != BLOCK_END:
+        if pos >= end or advance() != BLOCK_END:
             raise {config['language_name']}SyntaxError(f"Expected '{{BLOCK_END}}' at the end of while loop")
         return WhileLoop(condition, body)
 
     def parse_statement():
-        if not tokens:
+        if pos >= end:
             raise {config['language_name']}SyntaxError("Unexpected end of input")
-        if len(tokens) >= 3 and tokens[1] == '=':
-            name = tokens.pop(0)
-            tokens.pop(0)  # Remove '='
+        if end - pos >= 3 and tokens[pos + 1] == '=':
+            name = advance()
+            advance()  # Remove '='
             value = parse_expression()
             return Assignment(name, value)
-        elif tokens[0].startswith(COMMAND_PREFIX):
-            if tokens[0] == f"{{COMMAND_PREFIX}}IF":
+        elif tokens[pos].startswith(COMMAND_PREFIX):
+            if tokens[pos] == IF_KEYWORD:
                 return parse_if_statement()
-            elif tokens[0] == f"{{COMMAND_PREFIX}}WHILE":
+            elif tokens[pos] == WHILE_KEYWORD:
                 return parse_while_loop()
             else:
                 return parse_command()
         else:
             return parse_expression()
 
+    if lines is not None:
+        parse_unrecorded = parse_statement
+
+        def parse_statement():
+            start = pos
+            statement = parse_unrecorded()
+            # Shared leaves are not statements of their own
+            if not isinstance(statement, (Number, String, BooleanLiteral, ArrayLiteral, Variable)):
+                lines[statement] = line_of(start)
+            return statement
+
+    def parse_next(start):
+        nonlocal pos
+        pos = start
+        return parse_statement(), pos
+
+    def position():
+        return pos
+
+    return parse_next, position
+
+def parse(tokens, lines=None):
+    # Fills lines, if given, with the source line of every statement
+    line_of = tokens.line if lines is not None else None
+    tokens = list(tokens)  # indexing an exact list is faster than a Tokens
+    parse_next, _ = statement_parser(tokens, lines, line_of)
     statements = []
-    while tokens:
-        statements.append(parse_statement())
+    pos = 0
+    end = len(tokens)
+    while pos < end:
+        statement, pos = parse_next(pos)
+        statements.append(statement)
     return statements
 
+# Optimizer
+OPT_LEVELS = (0, 1, 2)
+# Folding never builds a string longer than this; longer ones are built at run time
+FOLD_MAX_STRING = 4096
+LITERALS = (Number, String, BooleanLiteral, ArrayLiteral)
+
+class Optimizer:
+    # Rewrites a parsed program into an equivalent one that does less work.
+    # Level 1 folds constant expressions, calls pure functions such as SHOUT
+    # on literal arguments and drops branches and loops whose condition is a
+    # constant. Level 2 also
+    # wraps loop-invariant expressions in Invariant nodes. Nodes are rebuilt
+    # rather than modified, since the parser shares leaf nodes; given the
+    # parser's lines dict, rebuilt statements keep their source line.
+    def __init__(self, level=1, lines=None):
+        if level not in OPT_LEVELS:
+            raise ValueError(f"Unknown optimization level: {{level}}")
+        self.level = level
+        self.lines = lines
+
+    def optimize(self, statements):
+        if self.level == 0:
+            return statements
+        statements = self.block(statements)
+        if self.level >= 2:
+            statements = self.hoist_block(statements)
+        return statements
+
+    def block(self, statements):
+        result = []
+        for statement in statements:
+            replacement = self.statement(statement)
+            if self.lines is not None:
+                self.keep_line(statement, replacement)
+            result.extend(replacement)
+        return result
+
+    def keep_line(self, node, replacement):
+        # Statements spliced in from a dropped branch keep their own line
+        line = self.lines.get(node)
+        if line is not None:
+            for statement in replacement:
+                self.lines.setdefault(statement, line)
+
+    def statement(self, node):
+        # Returns the list of statements that replaces node
+        if isinstance(node, Assignment):
+            value = self.expression(node.value)
+            return [node if value is node.value else Assignment(node.name, value)]
+        elif isinstance(node, IfStatement):
+            condition = self.expression(node.condition)
+            if isinstance(condition, LITERALS):
+                return self.block(node.if_body if condition.value else node.else_body or [])
+            else_body = self.block(node.else_body) if node.else_body else node.else_body
+            return [IfStatement(condition, self.block(node.if_body), else_body)]
+        elif isinstance(node, WhileLoop):
+            condition = self.expression(node.condition)
+            if isinstance(condition, LITERALS) and not condition.value:
+                return []
+            return [WhileLoop(condition, self.block(node.body))]
+        node = self.expression(node)
+        if isinstance(node, LITERALS):
+            return []
+        return [node]
+
+    def expression(self, node):
+        if isinstance(node, BinOp):
+            left = self.expression(node.left)
+            right = self.expression(node.right)
+            if isinstance(left, LITERALS) and isinstance(right, LITERALS):
+                folded = self.fold(left.value, node.op, right.value)
+                if folded is not None:
+                    return folded
+            if left is node.left and right is node.right:
+                return node
+            return BinOp(left, node.op, right)
+        elif isinstance(node, FunctionCall):
+            args = [self.expression(arg) for arg in node.args]
+            native = FUNCTIONS.get(node.name)
+            if native is not None and native.pure and all(isinstance(arg, LITERALS) for arg in args):
+                folded = self.call(native, [arg.value for arg in args])
+                if folded is not None:
+                    return folded
+            return FunctionCall(node.name, args)
+        return node
+
+    def call(self, native, values):
+        # Returns a literal node for a pure function call, or None when the
+        # call would fail or its result is not a literal value
+        if native.arity is not None:
+            if len(values) < native.arity or (native.exact and len(values) != native.arity):
+                return None
+            values = values[:native.arity]
+        try:
+            value = native.function(None, *values)
+        except Exception:
+            return None
+        return self.literal(value)
+
+    def literal(self, value):
+        if isinstance(value, bool):
+            return BooleanLiteral(value)
+        elif isinstance(value, (int, float)):
+            return Number(value)
+        elif isinstance(value, str) and len(value) <= FOLD_MAX_STRING:
+            return String(value)
+        return None
+
+    def fold(self, left, op, right):
+        # Returns a literal node for left op right, or None when the
+        # operation fails (the error is left to happen at run time) or
+        # would build an oversized string.
+        if op == '*':
+            for text, count in ((left, right), (right, left)):
+                if isinstance(text, str) and isinstance(count, int) and len(text) * count > FOLD_MAX_STRING:
+                    return None
+        try:
+            if op == '+':
+                value = left + right
+            elif op == '-':
+                value = left - right
+            elif op == '*':
+                value = left * right
+            else:
+                value = left / right
+        except Exception:
+            return None
+        return self.literal(value)
+
+    def hoist_block(self, statements):
+        # Outer loops are handled first, so an expression that is
+        # invariant in several nested loops is cached by the outermost one.
+        result = []
+        for statement in statements:
+            node = statement
+            if isinstance(node, WhileLoop):
+                assigned = set()
+                assigned_names(node.body, assigned)
+                invariants = []
+                condition = self.wrap(node.condition, assigned, invariants)
+                body = [self.rewrite(statement, assigned, invariants) for statement in node.body]
+                node = WhileLoop(condition, self.hoist_block(body), tuple(invariants))
+            elif isinstance(node, IfStatement):
+                else_body = self.hoist_block(node.else_body) if node.else_body else node.else_body
+                node = IfStatement(node.condition, self.hoist_block(node.if_body), else_body)
+            if self.lines is not None:
+                self.keep_line(statement, [node])
+            result.append(node)
+        return result
+
+    def rewrite(self, node, assigned, invariants):
+        # Wraps the invariant expressions of a statement inside a loop
+        if isinstance(node, Assignment):
+            result = Assignment(node.name, self.wrap(node.value, assigned, invariants))
+        elif isinstance(node, IfStatement):
+            condition = self.wrap(node.condition, assigned, invariants)
+            if_body = [self.rewrite(statement, assigned, invariants) for statement in node.if_body]
+            else_body = node.else_body
+            if else_body:
+                else_body = [self.rewrite(statement, assigned, invariants) for statement in else_body]
+            result = IfStatement(condition, if_body, else_body)
+        elif isinstance(node, WhileLoop):
+            condition = self.wrap(node.condition, assigned, invariants)
+            body = [self.rewrite(statement, assigned, invariants) for statement in node.body]
+            result = WhileLoop(condition, body, node.invariants)
+        else:
+            result = self.wrap(node, assigned, invariants)
+        if self.lines is not None:
+            self.keep_line(node, [result])
+        return result
+
+    def wrap(self, node, assigned, invariants):
+        # Wraps the largest invariant BinOps in node; only operators are
+        # worth caching, and function calls may have side effects.
+        if isinstance(node, BinOp):
+            if self.is_invariant(node, assigned):
+                invariant = Invariant(node)
+                invariants.append(invariant)
+                return invariant
+            left = self.wrap(node.left, assigned, invariants)
+            right = self.wrap(node.right, assigned, invariants)
+            if left is node.left and right is node.right:
+                return node
+            return BinOp(left, node.op, right)
+        elif isinstance(node, FunctionCall):
+            return FunctionCall(node.name, [self.wrap(arg, assigned, invariants) for arg in node.args])
+        return node
+
+    def is_invariant(self, node, assigned):
+        if isinstance(node, BinOp):
+            return self.is_invariant(node.left, assigned) and self.is_invariant(node.right, assigned)
+        elif isinstance(node, Variable):
+            return node.name not in assigned
+        return isinstance(node, LITERALS + (Invariant,))
+
+def optimize(statements, level=1, lines=None):
+    return Optimizer(level, lines).optimize(statements)
+
 # Interpreter
+# Value of a variable slot that has not been assigned yet
+UNDEFINED = object()
+
+# Strings
+# NAME = NAME + VALUE copies the string in NAME, so building a long string a
+# piece at a time takes quadratic time. Once it has ROPE_MIN_LENGTH
+# characters, such assignments store a Rope instead, and the first read of
+# the variable joins it back into a string, so programs never see one.
+ROPE_MIN_LENGTH = 1024
+
+class Rope:
+    # The text prefix + piece, where prefix is a string or another Rope.
+    # Ropes never change the text they hold, so the frames copied for
+    # connection handlers can share them. str() joins the pieces and keeps
+    # the result in place of them.
+    __slots__ = ('parts',)
+
+    def __init__(self, prefix, piece):
+        self.parts = (prefix, piece)
+
+    def __str__(self):
+        prefix, piece = self.parts
+        if not piece and type(prefix) is str:
+            return prefix
+        pieces = []
+        node = self
+        while type(node) is Rope:
+            prefix, piece = node.parts
+            pieces.append(piece)
+            node = prefix
+        pieces.append(node)
+        pieces.reverse()
+        text = ''.join(pieces)
+        # A single assignment, so another thread never sees half of it
+        self.parts = (text, '')
+        return text
+
+def concatenate(left, right):
+    # left + right, for a piece appended by NAME = NAME + A + B ...
+    if type(right) is str and (type(left) is Rope or type(left) is str and len(left) >= ROPE_MIN_LENGTH):
+        return Rope(left, right)
+    if type(left) is Rope:
+        left = str(left)
+    return left + right
+
+# Quickening
+# visit_BinOp() evaluates each BinOp generically for its first
+# QUICKEN_WARMUP executions and then replaces it with a closure specialized
+# for its operands; one whose guard fails goes back to the generic path for
+# QUICKEN_RETRY executions before it is specialized again
+QUICKEN_WARMUP = 2
+QUICKEN_RETRY = 64
+BINARY_OPERATORS = {{'+': operator.add, '-': operator.sub, '*': operator.mul, '/': operator.truediv}}
+# Types that specialized BinOps guard variables on
+QUICK_TYPES = (int, float, str)
+
+def quicken(node, left, right):
+    # Returns node.quick: a function of the interpreter that evaluates node
+    # without dispatching on its operands through visit(), or None. When the
+    # operands are variables and constants, it is specialized for the types
+    # of the values left and right just seen: int + int, float * float,
+    # str + str and so on. It checks that each variable still holds its type,
+    # which also catches unassigned ones, and deoptimizes when one doesn't.
+    # Other operands may have side effects and must not be evaluated twice,
+    # so a BinOp with any of them is only specialized on its operands' kinds.
+    op = BINARY_OPERATORS[node.op]
+    left_node, right_node = node.left, node.right
+    left_type, right_type = type(left), type(right)
+    if isinstance(left_node, Variable) and isinstance(right_node, LITERALS):
+        if left_type not in QUICK_TYPES:
+            return None
+        slot, constant = left_node.slot, right_node.value
+        def quick(interpreter):
+            value = interpreter.frame[slot]
+            if type(value) is left_type:
+                return op(value, constant)
+            return deoptimize(interpreter, node)
+    elif isinstance(left_node, LITERALS) and isinstance(right_node, Variable):
+        if right_type not in QUICK_TYPES:
+            return None
+        constant, slot = left_node.value, right_node.slot
+        def quick(interpreter):
+            value = interpreter.frame[slot]
+            if type(value) is right_type:
+                return op(constant, value)
+            return deoptimize(interpreter, node)
+    elif isinstance(left_node, Variable) and isinstance(right_node, Variable):
+        if left_type not in QUICK_TYPES or right_type not in QUICK_TYPES:
+            return None
+        left_slot, right_slot = left_node.slot, right_node.slot
+        def quick(interpreter):
+            frame = interpreter.frame
+            left, right = frame[left_slot], frame[right_slot]
+            if type(left) is left_type and type(right) is right_type:
+                return op(left, right)
+            return deoptimize(interpreter, node)
+    else:
+        evaluate_left, evaluate_right = operand_evaluator(left_node), operand_evaluator(right_node)
+        def quick(interpreter):
+            return op(evaluate_left(interpreter), evaluate_right(interpreter))
+    return quick
+
+def operand_evaluator(node):
+    # A function of the interpreter that evaluates an operand of a quickened
+    # BinOp the way visit() would
+    if isinstance(node, LITERALS):
+        value = node.value
+        return lambda interpreter: value
+    elif isinstance(node, Variable):
+        slot = node.slot
+        message = f"Variable '{{node.name}}' is not defined"
+        def load(interpreter):
+            value = interpreter.frame[slot]
+            if value is UNDEFINED:
+                raise NameError(message)
+            if type(value) is Rope:
+                value = interpreter.frame[slot] = str(value)
+            return value
+        return load
+    elif isinstance(node, BinOp):
+        return lambda interpreter: interpreter.visit_BinOp(node)
+    return lambda interpreter: interpreter.visit(node)
+
+def deoptimize(interpreter, node):
+    # Called by a specialized BinOp whose guard failed, before it has
+    # evaluated anything: drops the specialization and evaluates it
+    # generically
+    node.quick = None
+    node.warmup = QUICKEN_RETRY
+    return interpreter.visit_BinOp(node)
+
 class Interpreter:
-    def __init__(self):
-        self.variables = {{}}
+    # Variables live in a flat frame list. resolve() gives every Variable and
+    # Assignment node the index of its slot, so lookups index the frame
+    # instead of hashing the variable name; slots maps names to indexes.
+    # With a ConnectionServer or PreforkServer, server loops hand
+    # connections to it.
+    def __init__(self, server=None, output=None):
+        self.slots = {{}}
+        self.frame = []
         self.sockets = {{}}
+        self.server = server
+        self.output = Output() if output is None else output
+        # Directory that builtins resolve relative file names against, when
+        # it is not the process's own, as for programs run by the daemon
+        self.working_directory = None
+        # The running thread's Counters when the program is metered
+        self.counters = None
+
+    def handler_scope(self, frame):
+        # An interpreter of the same kind for one connection handler: it
+        # shares the slot layout and sockets, but has its own copy of the
+        # variables
+        scope = copy.copy(self)
+        scope.server = None
+        scope.frame = frame
+        return scope
+
+    def compiler(self):
+        # The closure compiler for programs run by this interpreter
+        return Compiler(self)
+
+    @property
+    def variables(self):
+        # Name -> value view of the assigned variables, for debugging. The
+        # python and vm modes keep variables in their own frames and hand
+        # them over through bind_variables()
+        frame = self.frame
+        return {{name: str(frame[slot]) if type(frame[slot]) is Rope else frame[slot]
+                for name, slot in self.slots.items() if frame[slot] is not UNDEFINED}}
+
+    def bind_variables(self, names, frame):
+        # Makes the variables view read frame, whose slots are named by names
+        # (a None name is a slot with no variable)
+        self.slots = {{name: slot for slot, name in enumerate(names) if name is not None}}
+        self.frame = frame
+
+    def slot(self, name):
+        if name not in self.slots:
+            self.slots[name] = len(self.frame)
+            self.frame.append(UNDEFINED)
+        return self.slots[name]
+
+    def temporary(self):
+        # A frame slot that is not tied to a variable name
+        self.frame.append(UNDEFINED)
+        return len(self.frame) - 1
+
+    def resolve(self, node):
+        # Binds the variables of a statement (or list of statements) to slots
+        # in this interpreter's frame; run before visiting the nodes
+        if isinstance(node, list):
+            for statement in node:
+                self.resolve(statement)
+        elif isinstance(node, (Variable, Assignment)):
+            node.slot = self.slot(node.name)
+            if isinstance(node, Assignment):
+                self.resolve(node.value)
+        elif isinstance(node, BinOp):
+            # A specialization is only valid for the slots it was built with
+            node.quick = None
+            node.warmup = QUICKEN_WARMUP
+            self.resolve(node.left)
+            self.resolve(node.right)
+        elif isinstance(node, FunctionCall):
+            self.resolve(node.args)
+        elif isinstance(node, IfStatement):
+            self.resolve(node.condition)
+            self.resolve(node.if_body)
+            if node.else_body:
+                self.resolve(node.else_body)
+        elif isinstance(node, WhileLoop):
+            self.resolve(node.condition)
+            self.resolve(node.body)
+        elif isinstance(node, Invariant):
+            node.slot = self.temporary()
+            self.resolve(node.value)
 
     def visit(self, node):
         method_name = f'visit_{{type(node).__name__}}'
@@ -350,59 +1621,63 @@ class Interpreter:
     def visit_BooleanLiteral(self, node):
         return node.value
 
+    def visit_ArrayLiteral(self, node):
+        return node.value
+
     def visit_BinOp(self, node):
+        quick = node.quick
+        if quick is not None:
+            return quick(self)
         left = self.visit(node.left)
         right = self.visit(node.right)
-        if node.op == '+':
-            return left + right
-        elif node.op == '-':
-            return left - right
-        elif node.op == '*':
-            return left * right
-        elif node.op == '/':
-            return left / right
+        if node.warmup:
+            node.warmup -= 1
+            if not node.warmup:
+                node.quick = quicken(node, left, right)
+        return BINARY_OPERATORS[node.op](left, right)
 
     def visit_Variable(self, node):
-        if node.name not in self.variables:
+        value = self.frame[node.slot]
+        if value is UNDEFINED:
             raise NameError(f"Variable '{{node.name}}' is not defined")
-        return self.variables[node.name]
+        if type(value) is Rope:
+            value = self.frame[node.slot] = str(value)
+        return value
 
     def visit_Assignment(self, node):
-        value = self.visit(node.value)
-        self.variables[node.name] = value
+        if node.appended is not None:
+            return self.append(node)
+        value = self.frame[node.slot] = self.visit(node.value)
+        return value
+
+    def append(self, node):
+        # NAME = NAME + A + B ...: the same additions in the same order, but
+        # strings are extended by concatenate()
+        frame = self.frame
+        value = frame[node.slot]
+        if value is UNDEFINED:
+            raise NameError(f"Variable '{{node.name}}' is not defined")
+        for piece in node.appended:
+            value = concatenate(value, self.visit(piece))
+        frame[node.slot] = value
         return value
 
     def visit_FunctionCall(self, node):
-        if node.name == f'{{COMMAND_PREFIX}}PRINT':
-            args = [str(self.visit(arg)) for arg in node.args]
-            print(*args)
-        elif node.name == f'{{COMMAND_PREFIX}}SHOUT':
-            if len(node.args) != 1:
-                raise ValueError(f"{{COMMAND_PREFIX}}SHOUT function expects exactly one argument")
-            arg = self.visit(node.args[0])
-            return str(arg).upper()
-        elif node.name == f'{{COMMAND_PREFIX}}SOCKET':
-            socket_name = self.visit(node.args[0])
-            self.sockets[socket_name] = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            return socket_name
-        elif node.name == f'{{COMMAND_PREFIX}}BIND':
-            socket_name = self.visit(node.args[0])
-            port = self.visit(node.args[1])
-            self.sockets[socket_name].bind(('', port))
-        elif node.name == f'{{COMMAND_PREFIX}}LISTEN':
-            socket_name = self.visit(node.args[0])
-            backlog = self.visit(node.args[1])
-            self.sockets[socket_name].listen(backlog)
-        elif node.name == f'{{COMMAND_PREFIX}}ACCEPT':
-            socket_name = self.visit(node.args[0])
-            conn, _ = self.sockets[socket_name].accept()
-            return conn
-        elif node.name == f'{{COMMAND_PREFIX}}SEND':
-            conn = self.visit(node.args[0])
-            data = str(self.visit(node.args[1])).encode()
-            conn.send(data)
-        else:
+        native = FUNCTIONS.get(node.name)
+        if native is None:
             raise ValueError(f"Unknown function: {{node.name}}")
+        function = native.function
+        args = node.args
+        arity = native.arity
+        if arity is None:
+            return function(self, *[self.visit(arg) for arg in args])
+        if native.exact and len(args) != arity:
+            raise native.arity_error()
+        if arity == 1:
+            return function(self, self.visit(args[0]))
+        elif arity == 2:
+            return function(self, self.visit(args[0]), self.visit(args[1]))
+        return function(self, *[self.visit(args[index]) for index in range(arity)])
 
     def visit_IfStatement(self, node):
         if self.visit(node.condition):
@@ -413,94 +1688,2876 @@ class Interpreter:
                 self.visit(statement)
 
     def visit_WhileLoop(self, node):
+        for invariant in node.invariants:
+            self.frame[invariant.slot] = UNDEFINED
+        if self.server is not None:
+            accept = accept_position(node)
+            if accept is not None:
+                return self.serve(node, accept)
         while self.visit(node.condition):
             for statement in node.body:
                 self.visit(statement)
 
-def run(code):
-    if ENFORCE_UPPERCASE_CODE:
-        code = code.upper()
-    try:
-        tokens = lexer(code)
-        ast = parse(tokens)
-        interpreter = Interpreter()
-        for statement in ast:
-            interpreter.visit(statement)
-    except {config['language_name']}SyntaxError as e:
-        print(f"{{COMMAND_PREFIX}}PY ERROR: {{str(e).upper()}}")
-        sys.exit(1)
+    def serve(self, node, accept):
+        # Runs the loop up to and including its ACCEPT, and leaves the rest
+        # of the body to the server, once for every connection
+        check_server_loop(node, accept)
+        server = self.server
+        before = node.body[:accept + 1]
+        handler = node.body[accept + 1:]
+        connection = node.body[accept].slot
+        def run_handler(frame):
+            scope = self.handler_scope(frame)
+            for statement in handler:
+                scope.visit(statement)
+        def accept_loop():
+            while not server.stopping and self.visit(node.condition):
+                for statement in before:
+                    self.visit(statement)
+                server.submit(self.frame[connection], run_handler, list(self.frame))
+        server.serve(accept_loop)
 
-def run_file(filename):
-    if not filename.endswith(FILE_EXTENSION):
-        raise ValueError(f"Only {{FILE_EXTENSION}} files can be run")
-    with open(filename, 'r') as file:
-        code = file.read()
-    return run(code)
+    def visit_Invariant(self, node):
+        value = self.frame[node.slot]
+        if value is UNDEFINED:
+            value = self.frame[node.slot] = self.visit(node.value)
+        return value
 
-if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print(f"Usage: python {{LANGUAGE_NAME.lower()}}.py <filename{{FILE_EXTENSION}}>")
-        sys.exit(1)
-    
-    try:
-        run_file(sys.argv[1])
-    except Exception as e:
-        print(f"ERROR: {{str(e).upper()}}")
-        sys.exit(1)
-"""
-    with open(os.path.join(lib_dir, f"{config['language_name'].lower()}.py"), 'w') as f:
-        f.write(interpreter_code)
+# Closure compiler
+class Compiler:
+    # Turns each AST node into a Python closure once, resolving operators,
+    # builtins and variable slots ahead of time, so loops re-run the
+    # prebuilt closures instead of dispatching through Interpreter.visit.
+    def __init__(self, interpreter):
+        self.interpreter = interpreter
+        # Invariant node -> frame slot holding its cached value
+        self.temporaries = {{}}
+        # Names the program appends to, the only variables that can hold a Rope
+        self.appended = set()
 
-def generate_readme(lang_dir, config):
-    readme_content = f"""
-# {config['language_name']} Programming Language
+    def compile(self, node):
+        method_name = f'compile_{{type(node).__name__}}'
+        method = getattr(self, method_name)
+        return method(node)
 
-{config['language_name']} is a custom programming language created to honor friendship.
+    def compile_program(self, statements):
+        # Compiles top-level statements, noting which variables they append to
+        # first so that loads of every other variable skip the Rope check
+        appended_names(statements, self.appended)
+        return self.compile_block(statements)
 
-## Features
+    def compile_block(self, statements):
+        compiled = tuple(self.compile(statement) for statement in statements)
+        if len(compiled) == 1:
+            return compiled[0]
+        def block():
+            for statement in compiled:
+                statement()
+        return block
 
-- File extension: {config['file_extension']}
-- Comment prefix: {config['comment_prefix']}
-- Command prefix: {config['command_prefix']}
-- {'Case-insensitive' if not config['case_sensitive'] else 'Case-sensitive'}
-- {'Enforces uppercase comments' if config['enforce_uppercase_comments'] else 'Allows any case for comments'}
-- {'Enforces uppercase code' if config['enforce_uppercase_code'] else 'Allows any case for code'}
-- True value: {config['true_value']}
-- False value: {config['false_value']}
+    def compile_Number(self, node):
+        value = node.value
+        return lambda: value
 
-## Running {config['language_name']} Programs
+    def compile_String(self, node):
+        value = node.value
+        return lambda: value
 
-Use the `{config['command_name']}` command followed by your {config['language_name']} file:
+    def compile_BooleanLiteral(self, node):
+        value = node.value
+        return lambda: value
 
-```
-./{config['command_name']} your_program{config['file_extension']}
-```
+    def compile_ArrayLiteral(self, node):
+        value = node.value
+        return lambda: value
 
-## Examples
+    def compile_BinOp(self, node):
+        left = self.compile(node.left)
+        op = node.op
+        if isinstance(node.right, LITERALS):
+            constant = node.right.value
+            if op == '+':
+                return lambda: left() + constant
+            elif op == '-':
+                return lambda: left() - constant
+            elif op == '*':
+                return lambda: left() * constant
+            else:
+                return lambda: left() / constant
+        right = self.compile(node.right)
+        if op == '+':
+            return lambda: left() + right()
+        elif op == '-':
+            return lambda: left() - right()
+        elif op == '*':
+            return lambda: left() * right()
+        else:
+            return lambda: left() / right()
 
-Check out the example programs in this directory:
-- `string_manipulation{config['file_extension']}`
-- `arithmetic{config['file_extension']}`
-- `server{config['file_extension']}`
-- `boolean_logic{config['file_extension']}`
+    def compile_Variable(self, node):
+        frame = self.interpreter.frame
+        slot = self.interpreter.slot(node.name)
+        message = f"Variable '{{node.name}}' is not defined"
+        if node.name not in self.appended:
+            def load():
+                value = frame[slot]
+                if value is UNDEFINED:
+                    raise NameError(message)
+                return value
+            return load
+        def load():
+            value = frame[slot]
+            if value is UNDEFINED:
+                raise NameError(message)
+            if type(value) is Rope:
+                value = frame[slot] = str(value)
+            return value
+        return load
 
-Enjoy coding in {config['language_name']}!
-"""
-    with open(os.path.join(lang_dir, 'README.md'), 'w') as f:
-        f.write(readme_content)
+    def compile_Assignment(self, node):
+        if node.appended is not None:
+            return self.compile_append(node)
+        frame = self.interpreter.frame
+        value = self.compile(node.value)
+        slot = self.interpreter.slot(node.name)
+        def store():
+            result = frame[slot] = value()
+            return result
+        return store
 
-def generate_examples(lang_dir, config):
-    # String manipulation example
-    string_example = f"""
-{config['comment_prefix']} String manipulation example
+    def compile_append(self, node):
+        # See Interpreter.append()
+        frame = self.interpreter.frame
+        pieces = tuple(self.compile(piece) for piece in node.appended)
+        slot = self.interpreter.slot(node.name)
+        message = f"Variable '{{node.name}}' is not defined"
+        def append():
+            value = frame[slot]
+            if value is UNDEFINED:
+                raise NameError(message)
+            for piece in pieces:
+                value = concatenate(value, piece())
+            frame[slot] = value
+            return value
+        return append
 
-NAME = {config['type_prefixes']['string']} "FRIEND"
+    def compile_FunctionCall(self, node):
+        native = FUNCTIONS.get(node.name)
+        if native is None:
+            message = f"Unknown function: {{node.name}}"
+            def unknown():
+                raise ValueError(message)
+            return unknown
+        if native.exact and len(node.args) != native.arity:
+            error = native.arity_error()
+            def call():
+                raise error
+            return call
+        function = native.function
+        interpreter = self.interpreter
+        if native.arity is None:
+            args = tuple(self.compile(arg) for arg in node.args)
+        else:
+            args = tuple(self.compile_argument(node, index) for index in range(native.arity))
+        if not args:
+            return lambda: function(interpreter)
+        elif len(args) == 1:
+            first = args[0]
+            return lambda: function(interpreter, first())
+        elif len(args) == 2:
+            first, second = args
+            return lambda: function(interpreter, first(), second())
+        return lambda: function(interpreter, *[arg() for arg in args])
+
+    def compile_argument(self, node, index):
+        # Mirrors the interpreter, which only fails on a missing argument
+        # when the call is actually executed.
+        if index < len(node.args):
+            return self.compile(node.args[index])
+        def missing():
+            raise IndexError("list index out of range")
+        return missing
+
+    def compile_IfStatement(self, node):
+        condition = self.compile(node.condition)
+        if_body = self.compile_block(node.if_body)
+        if not node.else_body:
+            def branch():
+                if condition():
+                    if_body()
+            return branch
+        else_body = self.compile_block(node.else_body)
+        def branch():
+            if condition():
+                if_body()
+            else:
+                else_body()
+        return branch
+
+    def compile_WhileLoop(self, node):
+        frame = self.interpreter.frame
+        resets = tuple(self.temporary(invariant) for invariant in node.invariants)
+        if self.interpreter.server is not None:
+            accept = accept_position(node)
+            if accept is not None:
+                return self.compile_server(node, accept, resets)
+        condition = self.compile(node.condition)
+        body = tuple(self.compile(statement) for statement in node.body)
+        if len(body) == 1:
+            statement = body[0]
+            def loop():
+                for slot in resets:
+                    frame[slot] = UNDEFINED
+                while condition():
+                    statement()
+            return loop
+        def loop():
+            for slot in resets:
+                frame[slot] = UNDEFINED
+            while condition():
+                for statement in body:
+                    statement()
+        return loop
+
+    def compile_server(self, node, accept, resets):
+        # The loop up to its ACCEPT runs here; every handler thread compiles
+        # the rest of the body once, against a frame of its own, and copies
+        # the loop's variables into that frame for each connection.
+        interpreter = self.interpreter
+        server = interpreter.server
+        frame = interpreter.frame
+        condition = self.compile(node.condition)
+        before = tuple(self.compile(statement) for statement in node.body[:accept + 1])
+        handler = node.body[accept + 1:]
+        connection = interpreter.slot(node.body[accept].name)
+        temporaries = self.temporaries
+        appended = self.appended
+        local = threading.local()
+        def run_handler(snapshot):
+            if not hasattr(local, 'body'):
+                local.scope = interpreter.handler_scope(list(snapshot))
+                local.scope.slots = dict(interpreter.slots)
+                compiler = local.scope.compiler()
+                compiler.temporaries = dict(temporaries)
+                compiler.appended = appended
+                local.body = compiler.compile_block(handler)
+            scope_frame = local.scope.frame
+            scope_frame[:len(snapshot)] = snapshot
+            scope_frame[len(snapshot):] = [UNDEFINED] * (len(scope_frame) - len(snapshot))
+            local.body()
+        def accept_loop():
+            while not server.stopping and condition():
+                for statement in before:
+                    statement()
+                server.submit(frame[connection], run_handler, list(frame))
+        def loop():
+            check_server_loop(node, accept)
+            for slot in resets:
+                frame[slot] = UNDEFINED
+            server.serve(accept_loop)
+        return loop
+
+    def temporary(self, invariant):
+        slot = self.temporaries[invariant] = self.interpreter.temporary()
+        return slot
+
+    def compile_Invariant(self, node):
+        frame = self.interpreter.frame
+        slot = self.temporaries[node]
+        value = self.compile(node.value)
+        def load():
+            result = frame[slot]
+            if result is UNDEFINED:
+                result = frame[slot] = value()
+            return result
+        return load
+
+# Python transpiler
+class Transpiler:
+    # Translates the AST into the source of a Python function so that
+    # CPython's own bytecode loop runs the program. Variables become locals;
+    # a read is only checked against UNDEFINED when the variable is not
+    # definitely assigned on every path leading to it. Variables that the
+    # program appends to may hold a Rope, so only their reads check for one.
+    PRECEDENCE = {{'+': 1, '-': 1, '*': 2, '/': 2}}
+
+    def __init__(self):
+        self.names = {{}}
+        self.constants = {{}}
+        # Invariant node -> local holding its cached value
+        self.temporaries = {{}}
+        self.lines = []
+        # One set per enclosing block of the variables it definitely assigns
+        self.assigned = [set()]
+        # Variables assigned by NAME = NAME + A + B ...
+        self.appended = set()
+
+    def local(self, name):
+        if name not in self.names:
+            self.names[name] = f'v{{len(self.names)}}'
+        return self.names[name]
+
+    def constant(self, value):
+        # Arrays are kept as lists, which marshal can store in the program
+        # cache, and made into arrays again by run_python()
+        if isinstance(value, NumericArray):
+            name = f'_a{{len(self.constants)}}'
+            self.constants[name] = value.data.tolist()
+            return name
+        if isinstance(value, float) and (value != value or value in (float('inf'), float('-inf'))):
+            name = f'_c{{len(self.constants)}}'
+            self.constants[name] = value
+            return name
+        return repr(value)
+
+    def is_assigned(self, name):
+        return any(name in scope for scope in self.assigned)
+
+    def transpile(self, statements):
+        self.lines = []
+        self.assigned = [set()]
+        self.appended = set()
+        appended_names(statements, self.appended)
+        self.emit_block(statements, 2)
+        header = ['def __program__():']
+        if self.names:
+            header.append('    ' + ' = '.join(self.names.values()) + ' = _UNDEFINED')
+        header.append('    try:')
+        # Hands the variables to run_python(), even when the program fails
+        variables = ', '.join(f'{{name!r}}: {{local}}' for name, local in self.names.items())
+        footer = ['    finally:', f'        _variables.update({{{{{{variables}}}}}})', '    return None']
+        return '\\n'.join(header + self.lines + footer) + '\\n'
+
+    def emit(self, indent, line):
+        self.lines.append('    ' * indent + line)
+
+    def emit_block(self, statements, indent):
+        if not statements:
+            self.emit(indent, 'pass')
+        for statement in statements:
+            self.emit_statement(statement, indent)
+
+    def emit_branch(self, statements, indent):
+        # Emits a block that may not run and returns what it assigned
+        self.assigned.append(set())
+        self.emit_block(statements, indent)
+        return self.assigned.pop()
+
+    def emit_statement(self, node, indent):
+        if isinstance(node, Assignment):
+            if node.appended is not None:
+                value = self.load(node.name)
+                for piece in node.appended:
+                    value = f'_concatenate({{value}}, {{self.expression(piece)}})'
+            else:
+                value = self.expression(node.value)
+            self.emit(indent, f'{{self.local(node.name)}} = {{value}}')
+            self.assigned[-1].add(node.name)
+        elif isinstance(node, IfStatement):
+            self.emit(indent, f'if {{self.expression(node.condition)}}:')
+            after_if = self.emit_branch(node.if_body, indent + 1)
+            if node.else_body:
+                self.emit(indent, 'else:')
+                after_else = self.emit_branch(node.else_body, indent + 1)
+                self.assigned[-1].update(after_if & after_else)
+        elif isinstance(node, WhileLoop):
+            for invariant in node.invariants:
+                local = self.temporaries[invariant] = f'h{{len(self.temporaries)}}'
+                self.emit(indent, f'{{local}} = _UNDEFINED')
+            self.emit(indent, f'while {{self.expression(node.condition)}}:')
+            self.emit_branch(node.body, indent + 1)
+        else:
+            self.emit(indent, self.expression(node))
+
+    def expression(self, node):
+        if isinstance(node, LITERALS):
+            return self.constant(node.value)
+        elif isinstance(node, Variable):
+            value = self.load(node.name)
+            if node.name in self.appended:
+                return f'({{value}} if type({{value}}) is not _Rope else str({{value}}))'
+            return value
+        elif isinstance(node, BinOp):
+            precedence = self.PRECEDENCE[node.op]
+            left = self.expression(node.left)
+            right = self.expression(node.right)
+            if isinstance(node.left, BinOp) and self.PRECEDENCE[node.left.op] < precedence:
+                left = f'({{left}})'
+            if isinstance(node.right, BinOp) and self.PRECEDENCE[node.right.op] <= precedence:
+                right = f'({{right}})'
+            return f'{{left}} {{node.op}} {{right}}'
+        elif isinstance(node, FunctionCall):
+            return self.call(node)
+        elif isinstance(node, Invariant):
+            local = self.temporaries[node]
+            return f'({{local}} if {{local}} is not _UNDEFINED else ({{local}} := {{self.expression(node.value)}}))'
+        else:
+            raise TypeError(f"Cannot transpile {{type(node).__name__}}")
+
+    def load(self, name):
+        # The variable's value, which may be a Rope
+        local = self.local(name)
+        if self.is_assigned(name):
+            return local
+        return f'({{local}} if {{local}} is not _UNDEFINED else _undefined({{name!r}}))'
+
+    def call(self, node):
+        native = FUNCTIONS.get(node.name)
+        if native is None:
+            return f'_unknown({{node.name!r}})'
+        arity = native.arity
+        if native.exact and len(node.args) != arity:
+            return f'_arity({{node.name!r}})'
+        args = node.args if arity is None else node.args[:arity]
+        values = [self.expression(arg) for arg in args]
+        if arity is not None and len(values) < arity:
+            # The interpreter fails on the first missing argument only
+            # after evaluating the ones before it.
+            values.append('_missing()')
+        return f"{{python_helper(node.name)}}({{', '.join(['_interpreter'] + values)}})"
+
+def python_helper(name):
+    # Name of the runtime global holding the native function name
+    return f'_f_{{name}}' if name.isidentifier() else f'_f_{{name.encode().hex()}}'
+
+def python_runtime(interpreter):
+    def _undefined(name):
+        raise NameError(f"Variable '{{name}}' is not defined")
+
+    def _unknown(name):
+        raise ValueError(f"Unknown function: {{name}}")
+
+    def _arity(name):
+        raise FUNCTIONS[name].arity_error()
+
+    def _missing():
+        raise IndexError("list index out of range")
+
+    namespace = {{name: value for name, value in locals().items() if name.startswith('_')}}
+    namespace['_UNDEFINED'] = UNDEFINED
+    namespace['_Rope'] = Rope
+    namespace['_concatenate'] = concatenate
+    namespace['_interpreter'] = interpreter
+    for name, native in FUNCTIONS.items():
+        namespace[python_helper(name)] = native.function
+    return namespace
+
+PYTHON_CODE_CACHE_SIZE = 128
+_python_code_cache = {{}}
+
+def compile_python(code, ast=None, opt_level=0):
+    # Returns (code object, constants) for an upper-cased program, reusing
+    # the result of an earlier compilation of the same source.
+    key = (code, opt_level, functions_signature())
+    cached = _python_code_cache.pop(key, None)
+    if cached is None:
+        if ast is None:
+            ast = parse(lexer(code))
+        ast = optimize(ast, opt_level)
+        transpiler = Transpiler()
+        source = transpiler.transpile(ast)
+        cached = (compile(source, f'<{{LANGUAGE_NAME.lower()}}>', 'exec'), transpiler.constants)
+        if len(_python_code_cache) >= PYTHON_CODE_CACHE_SIZE:
+            del _python_code_cache[next(iter(_python_code_cache))]
+    _python_code_cache[key] = cached
+    return cached
+
+def run_python(code_object, constants, interpreter):
+    namespace = python_runtime(interpreter)
+    for name, value in constants.items():
+        namespace[name] = NumericArray.of(value) if name.startswith('_a') else value
+    variables = namespace['_variables'] = {{}}
+    exec(code_object, namespace)
+    try:
+        namespace['__program__']()
+    finally:
+        interpreter.bind_variables(list(variables), list(variables.values()))
+
+# Bytecode VM
+# compile_bytecode() flattens a program into an array of ints, each opcode
+# followed by its operands, and run_bytecode() runs that array in a single
+# dispatch loop over a value stack. IF and WHILE become jumps. The opcodes
+# after HALT are superinstructions: peephole() fuses common sequences into
+# them, so that a loop takes fewer trips through the dispatch loop.
+# Name and operand kinds of each opcode; a 'target' is a code position
+OPCODES = (
+    ('LOAD_CONST', ('constant',)),
+    ('LOAD_VAR', ('slot',)),
+    # Loads a variable the program appends to, joining a Rope
+    ('LOAD_ROPE', ('slot',)),
+    # Loads the variable at the start of NAME = NAME + A + B ..., which
+    # CONCAT extends and STORE stores back
+    ('LOAD_APPEND', ('slot',)),
+    ('STORE', ('slot',)),
+    ('POP', ()),
+    ('ADD', ()),
+    ('SUB', ()),
+    ('MUL', ()),
+    ('DIV', ()),
+    ('CONCAT', ()),
+    ('CALL', ('function', 'count')),
+    ('UNKNOWN', ('function',)),
+    ('ARITY', ('function',)),
+    ('MISSING', ()),
+    ('JUMP', ('target',)),
+    ('JUMP_IF_FALSE', ('target',)),
+    ('JUMP_IF_TRUE', ('target',)),
+    # Pushes a loop invariant's cached value and jumps past the code that
+    # computes it, or falls through to that code when there is none yet
+    ('LOAD_CACHED', ('slot', 'target')),
+    ('CACHE', ('slot',)),
+    ('RESET', ('slot',)),
+    ('HALT', ()),
+    ('ADD_CONST', ('constant',)),
+    ('SUB_CONST', ('constant',)),
+    ('MUL_CONST', ('constant',)),
+    ('DIV_CONST', ('constant',)),
+    ('VAR_ADD_CONST', ('slot', 'constant')),
+    ('VAR_SUB_CONST', ('slot', 'constant')),
+    ('VAR_MUL_CONST', ('slot', 'constant')),
+    ('ADD_VAR_CONST_STORE', ('slot', 'constant', 'slot')),
+    ('SUB_VAR_CONST_STORE', ('slot', 'constant', 'slot')),
+    ('ADD_VAR_VAR_STORE', ('slot', 'slot', 'slot')),
+    ('JUMP_IF_VAR_FALSE', ('slot', 'target')),
+    ('JUMP_IF_VAR_TRUE', ('slot', 'target')),
+)
+(OP_LOAD_CONST, OP_LOAD_VAR, OP_LOAD_ROPE, OP_LOAD_APPEND, OP_STORE, OP_POP, OP_ADD, OP_SUB, OP_MUL, OP_DIV,
+ OP_CONCAT, OP_CALL, OP_UNKNOWN, OP_ARITY, OP_MISSING, OP_JUMP, OP_JUMP_IF_FALSE, OP_JUMP_IF_TRUE, OP_LOAD_CACHED,
+ OP_CACHE, OP_RESET, OP_HALT, OP_ADD_CONST, OP_SUB_CONST, OP_MUL_CONST, OP_DIV_CONST, OP_VAR_ADD_CONST,
+ OP_VAR_SUB_CONST, OP_VAR_MUL_CONST, OP_ADD_VAR_CONST_STORE, OP_SUB_VAR_CONST_STORE, OP_ADD_VAR_VAR_STORE,
+ OP_JUMP_IF_VAR_FALSE, OP_JUMP_IF_VAR_TRUE) = range(len(OPCODES))
+BINARY_OPCODES = {{'+': OP_ADD, '-': OP_SUB, '*': OP_MUL, '/': OP_DIV}}
+# Instructions in the list compile_bytecode() builds are tuples of an opcode
+# and its operands, with a label number for each target; a LABEL tuple
+# marks the position of a label
+LABEL = -1
+# Fused by peephole(): a run of instructions, as (opcode, operand index)
+# pairs for the operands the superinstruction takes, and its opcode
+SUPERINSTRUCTIONS = (
+    ((OP_LOAD_CONST, OP_ADD), ((0, 1),), OP_ADD_CONST),
+    ((OP_LOAD_CONST, OP_SUB), ((0, 1),), OP_SUB_CONST),
+    ((OP_LOAD_CONST, OP_MUL), ((0, 1),), OP_MUL_CONST),
+    ((OP_LOAD_CONST, OP_DIV), ((0, 1),), OP_DIV_CONST),
+    ((OP_LOAD_VAR, OP_ADD_CONST), ((0, 1), (1, 1)), OP_VAR_ADD_CONST),
+    ((OP_LOAD_VAR, OP_SUB_CONST), ((0, 1), (1, 1)), OP_VAR_SUB_CONST),
+    ((OP_LOAD_VAR, OP_MUL_CONST), ((0, 1), (1, 1)), OP_VAR_MUL_CONST),
+    ((OP_VAR_ADD_CONST, OP_STORE), ((0, 1), (0, 2), (1, 1)), OP_ADD_VAR_CONST_STORE),
+    ((OP_VAR_SUB_CONST, OP_STORE), ((0, 1), (0, 2), (1, 1)), OP_SUB_VAR_CONST_STORE),
+    ((OP_LOAD_VAR, OP_LOAD_VAR, OP_ADD, OP_STORE), ((0, 1), (1, 1), (3, 1)), OP_ADD_VAR_VAR_STORE),
+    ((OP_LOAD_VAR, OP_JUMP_IF_FALSE), ((0, 1), (1, 1)), OP_JUMP_IF_VAR_FALSE),
+    ((OP_LOAD_VAR, OP_JUMP_IF_TRUE), ((0, 1), (1, 1)), OP_JUMP_IF_VAR_TRUE),
+)
+BYTECODE_EXTENSION = FILE_EXTENSION + 'c'
+BYTECODE_MAGIC = b'LMKB\\x01\\x00\\x00\\x00'
+
+class Bytecode:
+    # A program compiled for the VM: the code array and the pools its
+    # operands index. names has the variable in each frame slot, or None
+    # for a slot holding a loop invariant.
+    __slots__ = ('code', 'constants', 'names', 'functions')
+
+    def __init__(self, code, constants, names, functions):
+        self.code = code
+        self.constants = constants
+        self.names = names
+        self.functions = functions
+
+    def to_data(self):
+        # Arrays are kept as lists, which marshal can store
+        constants = tuple(value.data.tolist() if isinstance(value, NumericArray) else value
+                          for value in self.constants)
+        return (self.code.tobytes(), constants, self.names, self.functions)
+
+    @staticmethod
+    def from_data(data, code=None):
+        code_bytes, constants, names, functions = data
+        if code is None:
+            code = array('i')
+            code.frombytes(code_bytes)
+        constants = tuple(NumericArray.of(value) if type(value) is list else value for value in constants)
+        return Bytecode(code, constants, names, functions)
+
+    @staticmethod
+    def key():
+        # Identifies the interpreter builds that can run a bytecode file
+        digest = hashlib.sha256(interpreter_fingerprint())
+        digest.update(sys.byteorder.encode())
+        digest.update(functions_signature().encode())
+        return digest.digest()
+
+    def save(self, path):
+        # A bytecode file holds BYTECODE_MAGIC, key(), the number of ints in
+        # the code, the code itself and then the marshalled pools; the code
+        # starts at a multiple of 4 bytes, so load() can use it in place
+        code = self.code.tobytes()
+        pools = marshal.dumps(self.to_data()[1:])
+        header = BYTECODE_MAGIC + Bytecode.key() + len(self.code).to_bytes(4, 'little')
+        # Replaced rather than rewritten, since running programs may have the
+        # old file mapped
+        temp_path = f'{{path}}.{{os.getpid()}}.tmp'
+        try:
+            with open(temp_path, 'wb') as file:
+                file.write(header + code + pools)
+            os.replace(temp_path, path)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.unlink(temp_path)
+            raise
+        return path
+
+    @staticmethod
+    def load(path):
+        # Maps a file written by save() into memory; the code is a view of
+        # the mapping rather than a copy, and only the pools are unmarshalled
+        with open(path, 'rb') as file:
+            try:
+                mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                mapped = b''
+        view = memoryview(mapped)
+        key = Bytecode.key()
+        start = len(BYTECODE_MAGIC) + len(key) + 4
+        if len(view) < start or view[:len(BYTECODE_MAGIC)] != BYTECODE_MAGIC:
+            raise ValueError(f"{{path}} is not a {{LANGUAGE_NAME}} bytecode file")
+        if view[len(BYTECODE_MAGIC):start - 4] != key:
+            raise ValueError(f"{{path}} was compiled by a different interpreter; compile it again")
+        end = start + int.from_bytes(view[start - 4:start], 'little') * array('i').itemsize
+        try:
+            pools = marshal.loads(view[end:])
+        except (EOFError, ValueError, TypeError):
+            raise ValueError(f"{{path}} is not a {{LANGUAGE_NAME}} bytecode file") from None
+        return Bytecode.from_data((None,) + pools, view[start:end].cast('i'))
+
+class BytecodeCompiler:
+    # Emits the instructions of a program, with jumps to labels, and fills
+    # the pools they index; see Compiler for the closure compiler
+    def __init__(self):
+        self.instructions = []
+        self.constants = []
+        # Key of each constant -> its index in constants
+        self.constant_indexes = {{}}
+        self.names = []
+        self.slots = {{}}
+        self.functions = []
+        # Invariant node -> frame slot holding its cached value
+        self.temporaries = {{}}
+        # Names the program appends to, the only variables that can hold a Rope
+        self.appended = set()
+        self.labels = 0
+
+    def emit(self, *instruction):
+        self.instructions.append(instruction)
+
+    def label(self):
+        self.labels += 1
+        return self.labels
+
+    def place(self, label):
+        self.instructions.append((LABEL, label))
+
+    def constant(self, value):
+        # Equal constants share an entry, except arrays, which are not
+        # hashable; floats are keyed by repr() to keep 0.0 and -0.0 apart
+        if isinstance(value, NumericArray):
+            key = index = None
+        else:
+            key = (float, repr(value)) if type(value) is float else (type(value), value)
+            index = self.constant_indexes.get(key)
+        if index is None:
+            index = len(self.constants)
+            self.constants.append(value)
+            if key is not None:
+                self.constant_indexes[key] = index
+        return index
+
+    def slot(self, name):
+        if name not in self.slots:
+            self.slots[name] = len(self.names)
+            self.names.append(name)
+        return self.slots[name]
+
+    def function(self, name):
+        if name not in self.functions:
+            self.functions.append(name)
+        return self.functions.index(name)
+
+    def compile_program(self, statements):
+        appended_names(statements, self.appended)
+        self.compile_block(statements)
+        self.emit(OP_HALT)
+
+    def compile_block(self, statements):
+        for statement in statements:
+            self.compile_statement(statement)
+
+    def compile_statement(self, node):
+        if isinstance(node, Assignment):
+            slot = self.slot(node.name)
+            if node.appended is not None:
+                # See Interpreter.append()
+                self.emit(OP_LOAD_APPEND, slot)
+                for piece in node.appended:
+                    self.compile_expression(piece)
+                    self.emit(OP_CONCAT)
+            else:
+                self.compile_expression(node.value)
+            self.emit(OP_STORE, slot)
+        elif isinstance(node, IfStatement):
+            otherwise = self.label()
+            self.compile_expression(node.condition)
+            self.emit(OP_JUMP_IF_FALSE, otherwise)
+            self.compile_block(node.if_body)
+            if node.else_body:
+                end = self.label()
+                self.emit(OP_JUMP, end)
+                self.place(otherwise)
+                self.compile_block(node.else_body)
+                self.place(end)
+            else:
+                self.place(otherwise)
+        elif isinstance(node, WhileLoop):
+            # The condition is tested at the bottom, so each iteration takes
+            # one jump
+            for invariant in node.invariants:
+                slot = self.temporaries[invariant] = len(self.names)
+                self.names.append(None)
+                self.emit(OP_RESET, slot)
+            body, condition = self.label(), self.label()
+            self.emit(OP_JUMP, condition)
+            self.place(body)
+            self.compile_block(node.body)
+            self.place(condition)
+            self.compile_expression(node.condition)
+            self.emit(OP_JUMP_IF_TRUE, body)
+        else:
+            self.compile_expression(node)
+            self.emit(OP_POP)
+
+    def compile_expression(self, node):
+        if isinstance(node, LITERALS):
+            self.emit(OP_LOAD_CONST, self.constant(node.value))
+        elif isinstance(node, Variable):
+            self.emit(OP_LOAD_ROPE if node.name in self.appended else OP_LOAD_VAR, self.slot(node.name))
+        elif isinstance(node, BinOp):
+            self.compile_expression(node.left)
+            self.compile_expression(node.right)
+            self.emit(BINARY_OPCODES[node.op])
+        elif isinstance(node, FunctionCall):
+            self.compile_call(node)
+        elif isinstance(node, Invariant):
+            end = self.label()
+            slot = self.temporaries[node]
+            self.emit(OP_LOAD_CACHED, slot, end)
+            self.compile_expression(node.value)
+            self.emit(OP_CACHE, slot)
+            self.place(end)
+        else:
+            raise TypeError(f"Cannot compile {{type(node).__name__}} to bytecode")
+
+    def compile_call(self, node):
+        native = FUNCTIONS.get(node.name)
+        function = self.function(node.name)
+        if native is None:
+            self.emit(OP_UNKNOWN, function)
+            return
+        arity = native.arity
+        if native.exact and len(node.args) != arity:
+            self.emit(OP_ARITY, function)
+            return
+        args = node.args if arity is None else node.args[:arity]
+        for arg in args:
+            self.compile_expression(arg)
+        if arity is not None and len(args) < arity:
+            # The interpreter fails on the first missing argument only
+            # after evaluating the ones before it.
+            self.emit(OP_MISSING)
+        self.emit(OP_CALL, function, len(args))
+
+def peephole(instructions):
+    # Replaces runs of instructions listed in SUPERINSTRUCTIONS. Only the
+    # end of the output is matched, after every instruction added to it,
+    # so a fused instruction can be fused again; a label between two
+    # instructions keeps them apart, since a jump may land on the second.
+    rules = {{}}
+    for opcodes, operands, superinstruction in SUPERINSTRUCTIONS:
+        rules.setdefault(opcodes[-1], []).append((list(opcodes), operands, superinstruction))
+    result = []
+    # The opcode of each instruction in result
+    opcodes_out = []
+    for instruction in instructions:
+        result.append(instruction)
+        opcodes_out.append(instruction[0])
+        candidates = rules.get(instruction[0])
+        while candidates:
+            for opcodes, operands, superinstruction in candidates:
+                count = len(opcodes)
+                if opcodes_out[-count:] == opcodes:
+                    run = result[-count:]
+                    del result[-count:], opcodes_out[-count:]
+                    result.append((superinstruction,) + tuple(run[index][operand] for index, operand in operands))
+                    opcodes_out.append(superinstruction)
+                    candidates = rules.get(superinstruction)
+                    break
+            else:
+                candidates = None
+    return result
+
+def assemble(instructions):
+    # Lays instructions out in an array, replacing labels with the code
+    # positions they mark
+    positions = {{}}
+    position = 0
+    for instruction in instructions:
+        if instruction[0] == LABEL:
+            positions[instruction[1]] = position
+        else:
+            position += len(instruction)
+    code = array('i')
+    for instruction in instructions:
+        opcode = instruction[0]
+        if opcode == LABEL:
+            continue
+        code.append(opcode)
+        for kind, operand in zip(OPCODES[opcode][1], instruction[1:]):
+            code.append(positions[operand] if kind == 'target' else operand)
+    return code
+
+def compile_bytecode(statements, superinstructions=True):
+    compiler = BytecodeCompiler()
+    compiler.compile_program(statements)
+    instructions = compiler.instructions
+    if superinstructions:
+        instructions = peephole(instructions)
+    return Bytecode(assemble(instructions), tuple(compiler.constants), tuple(compiler.names),
+                    tuple(compiler.functions))
+
+def disassemble(program):
+    # One line per instruction: its position, name and operands, with the
+    # constant, variable or function each operand stands for
+    code = program.code
+    lines = []
+    position = 0
+    while position < len(code):
+        name, kinds = OPCODES[code[position]]
+        operands = []
+        for offset, kind in enumerate(kinds, 1):
+            operand = code[position + offset]
+            if kind == 'constant':
+                operands.append(f'{{operand}} ({{program.constants[operand]!r}})')
+            elif kind == 'slot':
+                slot_name = program.names[operand]
+                operands.append(f"{{operand}} ({{'<invariant>' if slot_name is None else slot_name}})")
+            elif kind == 'function':
+                operands.append(f'{{operand}} ({{program.functions[operand]}})')
+            else:
+                operands.append(str(operand))
+        lines.append(f"{{position:>6}} {{name:<20}} {{', '.join(operands)}}".rstrip())
+        position += 1 + len(kinds)
+    return '\\n'.join(lines)
+
+def run_bytecode(program, interpreter):
+    # The dispatch loop. Opcodes are tested in the order of how often loops
+    # run them, since every test costs time on every instruction. The code
+    # is copied into a list, as indexing an array makes a new int each time.
+    code = program.code.tolist()
+    constants = program.constants
+    names = program.names
+    functions = tuple(FUNCTIONS[name].function if name in FUNCTIONS else None for name in program.functions)
+    frame = [UNDEFINED] * len(names)
+    interpreter.bind_variables(names, frame)
+    stack = []
+    push = stack.append
+    pop = stack.pop
+    pc = 0
+    while True:
+        op = code[pc]
+        if op == OP_LOAD_VAR:
+            value = frame[code[pc + 1]]
+            if value is UNDEFINED:
+                raise NameError(f"Variable '{{names[code[pc + 1]]}}' is not defined")
+            push(value)
+            pc += 2
+        elif op == OP_STORE:
+            frame[code[pc + 1]] = pop()
+            pc += 2
+        elif op == OP_VAR_SUB_CONST:
+            value = frame[code[pc + 1]]
+            if value is UNDEFINED:
+                raise NameError(f"Variable '{{names[code[pc + 1]]}}' is not defined")
+            push(value - constants[code[pc + 2]])
+            pc += 3
+        elif op == OP_JUMP_IF_FALSE:
+            pc = pc + 2 if pop() else code[pc + 1]
+        elif op == OP_JUMP:
+            pc = code[pc + 1]
+        elif op == OP_SUB_VAR_CONST_STORE:
+            value = frame[code[pc + 1]]
+            if value is UNDEFINED:
+                raise NameError(f"Variable '{{names[code[pc + 1]]}}' is not defined")
+            frame[code[pc + 3]] = value - constants[code[pc + 2]]
+            pc += 4
+        elif op == OP_JUMP_IF_VAR_TRUE:
+            value = frame[code[pc + 1]]
+            if value is UNDEFINED:
+                raise NameError(f"Variable '{{names[code[pc + 1]]}}' is not defined")
+            pc = code[pc + 2] if value else pc + 3
+        elif op == OP_VAR_MUL_CONST:
+            value = frame[code[pc + 1]]
+            if value is UNDEFINED:
+                raise NameError(f"Variable '{{names[code[pc + 1]]}}' is not defined")
+            push(value * constants[code[pc + 2]])
+            pc += 3
+        elif op == OP_SUB:
+            right = pop()
+            stack[-1] = stack[-1] - right
+            pc += 1
+        elif op == OP_ADD:
+            right = pop()
+            stack[-1] = stack[-1] + right
+            pc += 1
+        elif op == OP_LOAD_CONST:
+            push(constants[code[pc + 1]])
+            pc += 2
+        elif op == OP_ADD_VAR_CONST_STORE:
+            value = frame[code[pc + 1]]
+            if value is UNDEFINED:
+                raise NameError(f"Variable '{{names[code[pc + 1]]}}' is not defined")
+            frame[code[pc + 3]] = value + constants[code[pc + 2]]
+            pc += 4
+        elif op == OP_ADD_VAR_VAR_STORE:
+            left = frame[code[pc + 1]]
+            if left is UNDEFINED:
+                raise NameError(f"Variable '{{names[code[pc + 1]]}}' is not defined")
+            right = frame[code[pc + 2]]
+            if right is UNDEFINED:
+                raise NameError(f"Variable '{{names[code[pc + 2]]}}' is not defined")
+            frame[code[pc + 3]] = left + right
+            pc += 4
+        elif op == OP_VAR_ADD_CONST:
+            value = frame[code[pc + 1]]
+            if value is UNDEFINED:
+                raise NameError(f"Variable '{{names[code[pc + 1]]}}' is not defined")
+            push(value + constants[code[pc + 2]])
+            pc += 3
+        elif op == OP_ADD_CONST:
+            stack[-1] = stack[-1] + constants[code[pc + 1]]
+            pc += 2
+        elif op == OP_SUB_CONST:
+            stack[-1] = stack[-1] - constants[code[pc + 1]]
+            pc += 2
+        elif op == OP_MUL_CONST:
+            stack[-1] = stack[-1] * constants[code[pc + 1]]
+            pc += 2
+        elif op == OP_MUL:
+            right = pop()
+            stack[-1] = stack[-1] * right
+            pc += 1
+        elif op == OP_CONCAT:
+            right = pop()
+            stack[-1] = concatenate(stack[-1], right)
+            pc += 1
+        elif op == OP_LOAD_APPEND:
+            value = frame[code[pc + 1]]
+            if value is UNDEFINED:
+                raise NameError(f"Variable '{{names[code[pc + 1]]}}' is not defined")
+            push(value)
+            pc += 2
+        elif op == OP_JUMP_IF_VAR_FALSE:
+            value = frame[code[pc + 1]]
+            if value is UNDEFINED:
+                raise NameError(f"Variable '{{names[code[pc + 1]]}}' is not defined")
+            pc = pc + 3 if value else code[pc + 2]
+        elif op == OP_JUMP_IF_TRUE:
+            pc = code[pc + 1] if pop() else pc + 2
+        elif op == OP_CALL:
+            count = code[pc + 2]
+            if count:
+                args = stack[-count:]
+                del stack[-count:]
+                push(functions[code[pc + 1]](interpreter, *args))
+            else:
+                push(functions[code[pc + 1]](interpreter))
+            pc += 3
+        elif op == OP_POP:
+            pop()
+            pc += 1
+        elif op == OP_DIV_CONST:
+            stack[-1] = stack[-1] / constants[code[pc + 1]]
+            pc += 2
+        elif op == OP_DIV:
+            right = pop()
+            stack[-1] = stack[-1] / right
+            pc += 1
+        elif op == OP_LOAD_ROPE:
+            value = frame[code[pc + 1]]
+            if value is UNDEFINED:
+                raise NameError(f"Variable '{{names[code[pc + 1]]}}' is not defined")
+            if type(value) is Rope:
+                value = frame[code[pc + 1]] = str(value)
+            push(value)
+            pc += 2
+        elif op == OP_LOAD_CACHED:
+            value = frame[code[pc + 1]]
+            if value is UNDEFINED:
+                pc += 3
+            else:
+                push(value)
+                pc = code[pc + 2]
+        elif op == OP_CACHE:
+            frame[code[pc + 1]] = stack[-1]
+            pc += 2
+        elif op == OP_RESET:
+            frame[code[pc + 1]] = UNDEFINED
+            pc += 2
+        elif op == OP_HALT:
+            return
+        elif op == OP_UNKNOWN:
+            raise ValueError(f"Unknown function: {{program.functions[code[pc + 1]]}}")
+        elif op == OP_ARITY:
+            raise FUNCTIONS[program.functions[code[pc + 1]]].arity_error()
+        elif op == OP_MISSING:
+            raise IndexError("list index out of range")
+        else:
+            raise ValueError(f"Invalid opcode {{op}} at {{pc}}")
+
+EXECUTION_MODES = ('interpret', 'compile', 'python', 'vm')
+
+# Profiler
+# Rows of each table in a profile report
+PROFILE_REPORT_ROWS = 30
+
+class Profiler:
+    # Counts and times the statements of a program by source line, and the
+    # calls to each builtin, for --profile. Only ProfilingInterpreter and
+    # ProfilingCompiler call into it, so unprofiled programs pay nothing.
+    #
+    # Every timed call is a frame: a source line or a builtin name. Time is
+    # charged to the path of frames that was running, which gives both the
+    # self time of each frame and a collapsed-stack profile; a builtin's
+    # time includes evaluating its arguments, minus any calls among them.
+    def __init__(self, name='main', clock=time.perf_counter):
+        self.name = name
+        self.clock = clock
+        # Statement -> source line, filled by parse() and optimize()
+        self.lines = {{}}
+        self.source = []
+        self.counts = {{}}
+        # Frame -> seconds from entering to leaving it, counted once for
+        # frames that call themselves
+        self.totals = {{}}
+        # Tuple of frames -> seconds spent in the last one
+        self.stacks = {{}}
+        self.path = []
+        # Seconds spent in the calls made by each running frame
+        self.children = []
+
+    def load(self, code):
+        self.lines.clear()
+        self.source = code.split('\\n')
+
+    def call(self, frame, function, *args):
+        path = self.path
+        children = self.children
+        path.append(frame)
+        children.append(0.0)
+        start = self.clock()
+        try:
+            return function(*args)
+        finally:
+            elapsed = self.clock() - start
+            stack = tuple(path)
+            path.pop()
+            self.stacks[stack] = self.stacks.get(stack, 0.0) + elapsed - children.pop()
+            if children:
+                children[-1] += elapsed
+            self.counts[frame] = self.counts.get(frame, 0) + 1
+            if frame not in path:
+                self.totals[frame] = self.totals.get(frame, 0.0) + elapsed
+
+    def self_times(self):
+        times = {{}}
+        for stack, seconds in self.stacks.items():
+            times[stack[-1]] = times.get(stack[-1], 0.0) + seconds
+        return times
+
+    def label(self, frame):
+        # Lines are numbers and builtins are names
+        if isinstance(frame, str):
+            return frame
+        text = self.source[frame - 1].strip() if frame <= len(self.source) else ''
+        return f"LINE {{frame}}: {{text}}" if text else f"LINE {{frame}}"
+
+    def report(self, file=None):
+        # Writes the busiest lines and builtins, by self time
+        file = sys.stderr if file is None else file
+        self_times = self.self_times()
+        elapsed = sum(self_times.values())
+        print(f"PROFILE OF {{self.name}}: {{elapsed * 1000:.3f}} MS IN STATEMENTS AND BUILTINS", file=file)
+        for kind, title in ((int, 'LINE'), (str, 'BUILTIN')):
+            frames = sorted((frame for frame in self.counts if isinstance(frame, kind)),
+                            key=lambda frame: self_times.get(frame, 0.0), reverse=True)
+            if not frames:
+                continue
+            print(f"{{title:>12}} {{'COUNT':>10}} {{'TOTAL MS':>11}} {{'SELF MS':>11}} {{'SELF %':>7}}", file=file)
+            for frame in frames[:PROFILE_REPORT_ROWS]:
+                seconds = self_times.get(frame, 0.0)
+                share = seconds / elapsed * 100 if elapsed else 0.0
+                text = f"  {{self.label(frame)}}" if kind is int else ''
+                print(f"{{frame:>12}} {{self.counts[frame]:>10}} {{self.totals[frame] * 1000:>11.3f}} "
+                      f"{{seconds * 1000:>11.3f}} {{share:>6.1f}}%{{text}}", file=file)
+            if len(frames) > PROFILE_REPORT_ROWS:
+                print(f"{{'...':>12}} {{len(frames) - PROFILE_REPORT_ROWS}} MORE", file=file)
+
+    def write_stacks(self, file):
+        # One 'frame;frame;frame microseconds' line per path, the collapsed
+        # stack format read by flamegraph.pl, speedscope and similar tools
+        root = self.name.replace(';', ',')
+        for stack, seconds in sorted(self.stacks.items(), key=lambda item: item[0]):
+            microseconds = round(seconds * 1e6)
+            if microseconds > 0:
+                frames = ';'.join(self.label(frame).replace(';', ',') for frame in stack)
+                file.write(f"{{root}};{{frames}} {{microseconds}}\\n")
+
+class ProfilingInterpreter(Interpreter):
+    def __init__(self, profiler, server=None, output=None):
+        super().__init__(server, output)
+        self.profiler = profiler
+
+    def visit(self, node):
+        line = self.profiler.lines.get(node)
+        if line is None:
+            return Interpreter.visit(self, node)
+        return self.profiler.call(line, Interpreter.visit, self, node)
+
+    def visit_FunctionCall(self, node):
+        return self.profiler.call(node.name, Interpreter.visit_FunctionCall, self, node)
+
+    def compiler(self):
+        return ProfilingCompiler(self)
+
+class ProfilingCompiler(Compiler):
+    # Compiles for a ProfilingInterpreter, wrapping the closure of every
+    # statement and builtin call in a profiled call
+    def compile(self, node):
+        compiled = Compiler.compile(self, node)
+        profiler = self.interpreter.profiler
+        line = profiler.lines.get(node)
+        if line is None:
+            return compiled
+        call = profiler.call
+        return lambda: call(line, compiled)
+
+    def compile_FunctionCall(self, node):
+        compiled = Compiler.compile_FunctionCall(self, node)
+        name = node.name
+        call = self.interpreter.profiler.call
+        return lambda: call(name, compiled)
+
+# Metrics
+# Upper bounds, in seconds, of the accept latency histogram buckets
+ACCEPT_BUCKETS = (0.0001, 0.001, 0.01, 0.1, 1.0, 10.0)
+# Seconds between metrics snapshots written by --metrics-file
+METRICS_INTERVAL = 10.0
+# Seconds between a prefork worker's updates of its shared counters
+METRICS_PUBLISH_INTERVAL = 1.0
+# Totals that are plain counts or sums; builtin calls and histogram buckets
+# are added as 'builtin_calls:NAME' and 'accept_bucket:INDEX'
+METRICS_TOTALS = ('statements', 'loop_iterations', 'bytes_sent', 'connections_accepted', 'accept_seconds',
+                  'lex_seconds', 'parse_seconds', 'programs_prepared')
+
+class Counters:
+    # One thread's share of a Metrics. Only that thread updates it, so the
+    # hot paths count without locking; Metrics adds the threads up.
+    __slots__ = METRICS_TOTALS + ('builtin_calls', 'accept_buckets')
+
+    def __init__(self):
+        self.builtin_calls = {{}}
+        self.accept_buckets = [0] * (len(ACCEPT_BUCKETS) + 1)
+        self.reset()
+
+    def reset(self):
+        # In place, since compiled closures hold on to builtin_calls
+        for name in METRICS_TOTALS:
+            setattr(self, name, 0)
+        self.builtin_calls.clear()
+        self.accept_buckets[:] = [0] * len(self.accept_buckets)
+
+    def accepted(self, seconds):
+        self.connections_accepted += 1
+        self.accept_seconds += seconds
+        self.accept_buckets[bisect.bisect_left(ACCEPT_BUCKETS, seconds)] += 1
+
+    def add_to(self, totals):
+        for name in METRICS_TOTALS:
+            totals[name] = totals.get(name, 0) + getattr(self, name)
+        for name, count in list(self.builtin_calls.items()):
+            key = f'builtin_calls:{{name}}'
+            totals[key] = totals.get(key, 0) + count
+        for index, count in enumerate(self.accept_buckets):
+            key = f'accept_bucket:{{index}}'
+            totals[key] = totals.get(key, 0) + count
+
+class Metrics:
+    # Counts what metered programs do: statements run, loop iterations,
+    # builtin calls by name, bytes sent, connections accepted and how long
+    # ACCEPT waited for each, and the time spent lexing and parsing.
+    # MeteredInterpreter and MeteredCompiler count the hot paths; socket
+    # builtins and prepare() count through an interpreter's counters, which
+    # are None unless it is metered.
+    #
+    # A PreforkServer makes its workers publish their totals to a row each
+    # of shared memory (share() and worker()), so the master, which exports
+    # the metrics, reports the whole server.
+    def __init__(self):
+        self.started = time.time()
+        # Statement -> source line, filled by prepare(); metered
+        # interpreters count the nodes it contains
+        self.lines = {{}}
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.threads = []
+        self.layout = None
+        self.rows = None
+        self.row = None
+        self.base = None
+
+    def counters(self):
+        # The calling thread's Counters
+        counters = getattr(self.local, 'counters', None)
+        if counters is None:
+            counters = self.local.counters = Counters()
+            with self.lock:
+                self.threads.append(counters)
+        return counters
+
+    def totals(self):
+        # Flat name -> value totals of this process, plus those published
+        # by its workers
+        totals = {{}}
+        with self.lock:
+            threads = list(self.threads)
+        for counters in threads:
+            counters.add_to(totals)
+        if self.rows is not None and self.row is None:
+            width = len(self.layout)
+            for start in range(0, len(self.rows), width):
+                for name, value in zip(self.layout, self.rows[start:start + width]):
+                    totals[name] = totals.get(name, 0) + value
+        return totals
+
+    def share(self, workers):
+        # Called in the master before forking workers; builtins registered
+        # after this are not counted across processes
+        self.layout = list(METRICS_TOTALS)
+        self.layout += [f'builtin_calls:{{name}}' for name in FUNCTIONS]
+        self.layout += [f'accept_bucket:{{index}}' for index in range(len(ACCEPT_BUCKETS) + 1)]
+        self.rows = memoryview(mmap.mmap(-1, 8 * len(self.layout) * workers)).cast('d')
+
+    def worker(self, index):
+        # Called in a freshly forked worker. Its counts start from zero, and
+        # are published on top of what an earlier worker in the same place
+        # published, so the server's totals never go down.
+        self.lock = threading.Lock()
+        for counters in self.threads:
+            counters.reset()
+        width = len(self.layout)
+        self.row = self.rows[index * width:(index + 1) * width]
+        self.base = list(self.row)
+        threading.Thread(target=self.publish_periodically, daemon=True).start()
+
+    def publish(self):
+        if self.row is None:
+            return
+        totals = self.totals()
+        for index, name in enumerate(self.layout):
+            self.row[index] = self.base[index] + totals.get(name, 0)
+
+    def publish_periodically(self):
+        signal.pthread_sigmask(signal.SIG_BLOCK, {{signal.SIGINT, signal.SIGTERM}})
+        while True:
+            time.sleep(METRICS_PUBLISH_INTERVAL)
+            self.publish()
+
+    def snapshot(self):
+        # The totals as a JSON-compatible dict
+        totals = self.totals()
+        snapshot = {{'time': round(time.time(), 3), 'uptime_seconds': round(time.time() - self.started, 3)}}
+        # Totals published by workers are floats
+        for name in METRICS_TOTALS:
+            value = totals.get(name, 0)
+            snapshot[name] = value if name.endswith('_seconds') else int(value)
+        snapshot['builtin_calls'] = {{key.partition(':')[2]: int(count) for key, count in totals.items()
+                                     if key.startswith('builtin_calls:') and count}}
+        buckets = {{}}
+        cumulative = 0
+        for index, bound in enumerate(ACCEPT_BUCKETS + ('+Inf',)):
+            cumulative += int(totals.get(f'accept_bucket:{{index}}', 0))
+            buckets[str(bound)] = cumulative
+        snapshot['accept_seconds_buckets'] = buckets
+        return snapshot
+
+    def prometheus(self):
+        # The totals in the Prometheus text exposition format
+        snapshot = self.snapshot()
+        prefix = LANGUAGE_NAME.lower()
+        lines = []
+        def metric(name, kind, help_text, samples):
+            lines.append(f'# HELP {{prefix}}_{{name}} {{help_text}}')
+            lines.append(f'# TYPE {{prefix}}_{{name}} {{kind}}')
+            for suffix, labels, value in samples:
+                lines.append(f'{{prefix}}_{{name}}{{suffix}}{{labels}} {{value}}')
+        metric('statements_total', 'counter', "Statements executed.", [('', '', snapshot['statements'])])
+        metric('loop_iterations_total', 'counter', "Loop iterations run.",
+               [('', '', snapshot['loop_iterations'])])
+        metric('builtin_calls_total', 'counter', "Builtin function calls.",
+               [('', f'{{{{builtin="{{name}}"}}}}', count) for name, count in sorted(snapshot['builtin_calls'].items())])
+        metric('sent_bytes_total', 'counter', "Bytes sent by SEND and SENDALL.", [('', '', snapshot['bytes_sent'])])
+        metric('accept_wait_seconds', 'histogram', "Seconds ACCEPT waited for each connection.",
+               [('_bucket', f'{{{{le="{{bound}}"}}}}', count) for bound, count in snapshot['accept_seconds_buckets'].items()]
+               + [('_sum', '', snapshot['accept_seconds']), ('_count', '', snapshot['connections_accepted'])])
+        metric('lex_seconds_total', 'counter', "Seconds spent lexing programs.", [('', '', snapshot['lex_seconds'])])
+        metric('parse_seconds_total', 'counter', "Seconds spent parsing and optimizing programs.",
+               [('', '', snapshot['parse_seconds'])])
+        metric('programs_prepared_total', 'counter', "Programs lexed or loaded from the cache, and parsed.",
+               [('', '', snapshot['programs_prepared'])])
+        metric('start_time_seconds', 'gauge', "Unix time the metrics started.", [('', '', self.started)])
+        return '\\n'.join(lines) + '\\n'
+
+    def write_periodically(self, path, interval=METRICS_INTERVAL):
+        # Appends a JSON snapshot to path every interval seconds, and a last
+        # one when the process exits
+        import json
+        def write():
+            with open(path, 'a') as file:
+                file.write(json.dumps(self.snapshot()) + '\\n')
+        def loop():
+            signal.pthread_sigmask(signal.SIG_BLOCK, {{signal.SIGINT, signal.SIGTERM}})
+            while True:
+                time.sleep(interval)
+                write()
+        threading.Thread(target=loop, daemon=True).start()
+        atexit.register(write)
+
+    def serve(self, port, host='127.0.0.1'):
+        # Serves the Prometheus text at http://host:port/metrics from a
+        # background thread; only processes exporting metrics import the
+        # HTTP server
+        import http.server
+        metrics = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.prometheus().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = http.server.ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        def loop():
+            signal.pthread_sigmask(signal.SIG_BLOCK, {{signal.SIGINT, signal.SIGTERM}})
+            server.serve_forever()
+        threading.Thread(target=loop, daemon=True).start()
+        return server
+
+class CountedCondition(AST):
+    # The condition of a loop run by a metered interpreter, which counts
+    # each time it lets the loop body run
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+class MeteredInterpreter(Interpreter):
+    def __init__(self, metrics, server=None, output=None):
+        super().__init__(server, output)
+        self.metrics = metrics
+        self.statements = metrics.lines
+        self.counters = metrics.counters()
+
+    def handler_scope(self, frame):
+        # Handlers run on their own threads, which count separately
+        scope = super().handler_scope(frame)
+        scope.counters = self.metrics.counters()
+        return scope
+
+    def compiler(self):
+        return MeteredCompiler(self)
+
+    def visit(self, node):
+        if node in self.statements:
+            self.counters.statements += 1
+        return getattr(self, f'visit_{{type(node).__name__}}')(node)
+
+    def visit_FunctionCall(self, node):
+        calls = self.counters.builtin_calls
+        calls[node.name] = calls.get(node.name, 0) + 1
+        return Interpreter.visit_FunctionCall(self, node)
+
+    def visit_WhileLoop(self, node):
+        return Interpreter.visit_WhileLoop(self, WhileLoop(CountedCondition(node.condition), node.body,
+                                                           node.invariants))
+
+    def visit_CountedCondition(self, node):
+        value = self.visit(node.value)
+        if value:
+            self.counters.loop_iterations += 1
+        return value
+
+class MeteredCompiler(Compiler):
+    def compile(self, node):
+        compiled = Compiler.compile(self, node)
+        if node not in self.interpreter.statements:
+            return compiled
+        counters = self.interpreter.counters
+        def counted():
+            counters.statements += 1
+            return compiled()
+        return counted
+
+    def compile_FunctionCall(self, node):
+        compiled = Compiler.compile_FunctionCall(self, node)
+        name = node.name
+        calls = self.interpreter.counters.builtin_calls
+        def counted():
+            calls[name] = calls.get(name, 0) + 1
+            return compiled()
+        return counted
+
+    def compile_WhileLoop(self, node):
+        return Compiler.compile_WhileLoop(self, WhileLoop(CountedCondition(node.condition), node.body,
+                                                          node.invariants))
+
+    def compile_CountedCondition(self, node):
+        condition = self.compile(node.value)
+        counters = self.interpreter.counters
+        def counted():
+            value = condition()
+            if value:
+                counters.loop_iterations += 1
+            return value
+        return counted
+
+# Concurrent servers
+class ServerShutdown(Exception):
+    pass
+
+def accept_position(loop):
+    # Index of the `NAME = ACCEPT(...)` statement that makes a loop a
+    # server loop, or None
+    for index, statement in enumerate(loop.body):
+        if (isinstance(statement, Assignment) and isinstance(statement.value, FunctionCall)
+                and statement.value.name == f'{{COMMAND_PREFIX}}ACCEPT'):
+            return index
+    return None
+
+def check_server_loop(loop, accept):
+    # Handlers assign to their own copy of the variables, so a handler that
+    # assigns what the loop's condition or the statements up to its ACCEPT
+    # read (such as a count of connections left) would never stop the loop
+    assigned = set()
+    assigned_names(loop.body[accept + 1:], assigned)
+    read = set()
+    read_names([loop.condition] + loop.body[:accept + 1], read)
+    shared = sorted(assigned & read)
+    if shared:
+        raise ValueError(f"Concurrent server loops cannot assign variables the loop reads after "
+                         f"{{COMMAND_PREFIX}}ACCEPT: {{', '.join(shared)}}")
+
+class ConnectionServer:
+    # Runs the handler of a server loop (the statements after its ACCEPT)
+    # for each accepted connection on a bounded pool of threads, and closes
+    # the connection when the handler finishes. Each handler sees a copy of
+    # the variables as they were when its connection was accepted, and its
+    # own assignments stay private to it; check_server_loop() refuses loops
+    # that depend on them.
+    #
+    # At most max_workers handlers run at once and max_pending more
+    # connections wait for a thread; beyond that the loop stops accepting
+    # until one finishes, leaving new clients in the listen backlog. SIGINT
+    # or SIGTERM ends the loop: handlers get shutdown_timeout seconds to
+    # finish before their connections are shut down, and the program then
+    # continues after the loop.
+    def __init__(self, max_workers=64, max_pending=1024, shutdown_timeout=10.0):
+        self.max_workers = max_workers
+        self.shutdown_timeout = shutdown_timeout
+        self.capacity = threading.BoundedSemaphore(max_workers + max_pending)
+        self.connections = set()
+        self.idle = threading.Condition()
+        self.executor = None
+        self.stopping = False
+
+    def submit(self, connection, handler, *args):
+        self.capacity.acquire()
+        with self.idle:
+            self.connections.add(connection)
+        try:
+            self.executor.submit(self.handle, connection, handler, args)
+        except BaseException:
+            self.finish(connection)
+            raise
+
+    def handle(self, connection, handler, args):
+        try:
+            handler(*args)
+        except Exception as e:
+            print(f"ERROR: {{str(e).upper()}}", file=sys.stderr)
+        finally:
+            self.finish(connection)
+
+    def finish(self, connection):
+        close = getattr(connection, 'close', None)
+        if close is not None:
+            close()
+        with self.idle:
+            if connection in self.connections:
+                self.connections.discard(connection)
+                self.capacity.release()
+            if not self.connections:
+                self.idle.notify_all()
+
+    def serve(self, accept_loop):
+        with self.serving():
+            accept_loop()
+
+    @contextlib.contextmanager
+    def serving(self):
+        if self.executor is not None:
+            raise ValueError("Server loops cannot be nested")
+        self.stopping = False
+        from concurrent.futures import ThreadPoolExecutor
+        # Handler threads block SIGINT and SIGTERM so that the kernel delivers
+        # them to the main thread and interrupts its accept()
+        self.executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix=f'{{LANGUAGE_NAME.lower()}}-handler',
+                                           initializer=signal.pthread_sigmask,
+                                           initargs=(signal.SIG_BLOCK, {{signal.SIGINT, signal.SIGTERM}}))
+        previous = None
+        if threading.current_thread() is threading.main_thread():
+            previous = signal.signal(signal.SIGTERM, self.request_shutdown)
+        try:
+            yield
+        except (KeyboardInterrupt, ServerShutdown):
+            pass
+        finally:
+            self.stopping = True
+            if previous is not None:
+                signal.signal(signal.SIGTERM, previous)
+            self.shutdown()
+
+    def request_shutdown(self, signum, frame):
+        raise ServerShutdown()
+
+    def shutdown(self):
+        # Waits for running and queued handlers, then shuts down the
+        # connections of any still going after shutdown_timeout
+        with self.idle:
+            self.idle.wait_for(lambda: not self.connections, self.shutdown_timeout)
+            stuck = list(self.connections)
+        import socket
+        for connection in stuck:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except (AttributeError, OSError):
+                pass
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        for connection in stuck:
+            self.finish(connection)
+        self.executor = None
+
+# Seconds a worker that crashed within its first second waits to restart
+PREFORK_RESTART_DELAY = 1.0
+
+class PreforkServer:
+    # Runs a server loop in `workers` forked processes. The program runs up
+    # to the loop once, in the master, so the workers inherit its parsed code
+    # and its bound listening socket and all accept connections from it.
+    # Each worker hands its connections to `inner` (a ConnectionServer) or,
+    # without one, handles them one at a time; either way a handler starts
+    # from a copy of the variables and its connection is closed afterwards.
+    # Each worker also runs the loop on its own copy of the variables, so
+    # check_server_loop() applies here too.
+    #
+    # The master restarts workers that crash, reports how many connections
+    # each has handled every report_interval seconds (if set) and when the
+    # loop ends, and on SIGINT or SIGTERM stops the workers, giving them
+    # shutdown_timeout seconds, before the program continues after the loop.
+    # Workers publish their share of a Metrics to the master.
+    def __init__(self, workers, inner=None, shutdown_timeout=10.0, report_interval=0, metrics=None):
+        if not hasattr(os, 'fork'):
+            raise ValueError("Worker processes need os.fork")
+        if workers < 1:
+            raise ValueError("There must be at least one worker")
+        self.workers = workers
+        self.inner = inner
+        self.shutdown_timeout = shutdown_timeout
+        self.report_interval = report_interval
+        # Connection counts, written by each worker and read by the master
+        self.counts = memoryview(mmap.mmap(-1, 8 * workers)).cast('Q')
+        self.pids = [None] * workers
+        self.started = [0.0] * workers
+        self.restarts = [0] * workers
+        self.reported_counts = [0] * workers
+        self.reported_at = 0.0
+        self.index = None
+        self.busy = False
+        self.stop_requested = False
+        self.metrics = metrics
+        if metrics is not None:
+            metrics.share(workers)
+
+    @property
+    def stopping(self):
+        if self.inner is not None:
+            return self.inner.stopping
+        return self.stop_requested
+
+    def submit(self, connection, handler, *args):
+        self.counts[self.index] += 1
+        if self.inner is not None:
+            return self.inner.submit(connection, handler, *args)
+        self.busy = True
+        try:
+            handler(*args)
+        except Exception as e:
+            print(f"ERROR: {{str(e).upper()}}", file=sys.stderr)
+        finally:
+            self.busy = False
+            close = getattr(connection, 'close', None)
+            if close is not None:
+                close()
+
+    def request_shutdown(self, signum, frame):
+        # A worker finishes the connection it is handling before stopping
+        self.stop_requested = True
+        if not self.busy:
+            raise ServerShutdown()
+
+    def serve(self, accept_loop):
+        if self.index is not None or any(self.pids):
+            raise ValueError("Server loops cannot be nested")
+        self.stop_requested = False
+        self.reported_counts = [0] * self.workers
+        self.reported_at = time.monotonic()
+        running = {{}}
+        for index in range(self.workers):
+            running[self.spawn(index, accept_loop)] = index
+        previous = signal.signal(signal.SIGTERM, self.request_shutdown)
+        previous_alarm = signal.signal(signal.SIGALRM, self.report_alarm)
+        if self.report_interval:
+            signal.setitimer(signal.ITIMER_REAL, self.report_interval, self.report_interval)
+        try:
+            while running:
+                pid, status = os.waitpid(-1, 0)
+                index = running.pop(pid, None)
+                if index is None:
+                    continue
+                code = os.waitstatus_to_exitcode(status)
+                if code == 0:
+                    # Its pid stays in self.pids for the final report
+                    continue
+                print(f"WORKER {{index + 1}} (PID {{pid}}) EXITED WITH STATUS {{code}}, RESTARTING", file=sys.stderr)
+                if time.monotonic() - self.started[index] < 1.0:
+                    time.sleep(PREFORK_RESTART_DELAY)
+                self.restarts[index] += 1
+                running[self.spawn(index, accept_loop)] = index
+        except (KeyboardInterrupt, ServerShutdown):
+            pass
+        finally:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, previous_alarm)
+            signal.signal(signal.SIGTERM, previous)
+            self.stop(running)
+            self.report()
+            self.pids = [None] * self.workers
+
+    def spawn(self, index, accept_loop):
+        Output.flush_all()
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid:
+            self.pids[index] = pid
+            self.started[index] = time.monotonic()
+            return pid
+        status = 0
+        try:
+            # The master decides when workers stop, and tells them with SIGTERM
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            signal.signal(signal.SIGTERM, self.request_shutdown)
+            signal.signal(signal.SIGALRM, signal.SIG_DFL)
+            self.index = index
+            if self.metrics is not None:
+                self.metrics.worker(index)
+            if self.inner is not None:
+                self.inner.serve(accept_loop)
+            else:
+                accept_loop()
+        except ServerShutdown:
+            pass
+        except BaseException as e:
+            print(f"ERROR: {{str(e).upper()}}")
+            status = 1
+        finally:
+            try:
+                if self.metrics is not None:
+                    self.metrics.publish()
+                Output.flush_all()
+                sys.stdout.flush()
+                sys.stderr.flush()
+            finally:
+                os._exit(status)
+
+    def stop(self, running):
+        # Asks the workers still running to stop, and kills those that have
+        # not exited shortly after shutdown_timeout
+        for pid in running:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        deadline = time.monotonic() + self.shutdown_timeout + 1.0
+        while running:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if pid:
+                running.pop(pid, None)
+            elif time.monotonic() < deadline:
+                time.sleep(0.05)
+            else:
+                for pid in running:
+                    os.kill(pid, signal.SIGKILL)
+                    os.waitpid(pid, 0)
+                running.clear()
+
+    def report_alarm(self, signum, frame):
+        self.report()
+
+    def report(self):
+        # Connections handled by each worker, in total and per second since
+        # the last report
+        now = time.monotonic()
+        elapsed = max(now - self.reported_at, 1e-9)
+        counts = list(self.counts)
+        for index, count in enumerate(counts):
+            rate = (count - self.reported_counts[index]) / elapsed
+            print(f"WORKER {{index + 1}} (PID {{self.pids[index]}}): {{count}} CONNECTIONS, {{rate:.1f}}/S, "
+                  f"{{self.restarts[index]}} RESTARTS", file=sys.stderr)
+        rate = (sum(counts) - sum(self.reported_counts)) / elapsed
+        print(f"ALL WORKERS: {{sum(counts)}} CONNECTIONS, {{rate:.1f}}/S", file=sys.stderr)
+        self.reported_counts = counts
+        self.reported_at = now
+
+# Compiled-program cache
+CACHE_MAGIC = b'LMKC\\x01'
+CACHE_SUFFIX = '.cache'
+CACHE_MAX_BYTES = 32 * 1024 * 1024
+# A cache directory's size is checked again once a process has written this
+# fraction of its max_bytes to it, rather than after every entry
+CACHE_EVICT_FRACTION = 16
+LANGUAGE_CONFIG = (
+    LANGUAGE_NAME, FILE_EXTENSION, COMMAND_PREFIX, COMMENT_PREFIX,
+    ENFORCE_UPPERCASE_COMMENTS, ENFORCE_UPPERCASE_CODE,
+    TYPE_PREFIX_INTEGER, TYPE_PREFIX_FLOAT, TYPE_PREFIX_STRING, TYPE_PREFIX_ARRAY,
+    TRUE_VALUE, FALSE_VALUE, BLOCK_END,
+)
+_interpreter_fingerprint = None
+
+def interpreter_fingerprint():
+    # Identifies this interpreter build: its own source, the language
+    # constants and the Python version (marshal data is version specific).
+    global _interpreter_fingerprint
+    if _interpreter_fingerprint is None:
+        digest = hashlib.sha256()
+        digest.update(sys.implementation.cache_tag.encode())
+        digest.update(repr(LANGUAGE_CONFIG).encode())
+        try:
+            # Through the loader, which also reads from inside a zipapp
+            digest.update(__loader__.get_data(__file__))
+        except (NameError, AttributeError, OSError):
+            pass
+        _interpreter_fingerprint = digest.digest()
+    return _interpreter_fingerprint
+
+class ProgramCache:
+    # Stores prepared programs on disk, in the spirit of __pycache__: the
+    # lexed token stream for the tree-walking modes, the marshalled code
+    # object for 'python' mode and the bytecode for 'vm' mode. Entries are
+    # named by a hash of the source, the execution mode and the interpreter
+    # fingerprint, so a changed program or interpreter simply misses.
+    # Entries are written atomically and the directory is kept under
+    # max_bytes by evicting the least recently used entries.
+    # Bytes written to each directory since this process last checked it
+    unchecked_bytes = {{}}
+
+    def __init__(self, directory, max_bytes=CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def for_file(filename):
+        directory = os.path.dirname(os.path.abspath(filename))
+        return ProgramCache(os.path.join(directory, f'__{{LANGUAGE_NAME.lower()}}cache__'))
+
+    def key(self, code, mode):
+        digest = hashlib.sha256(interpreter_fingerprint())
+        digest.update(mode.encode())
+        digest.update(functions_signature().encode())
+        digest.update(code.encode())
+        return digest.digest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key.hex()[:32] + CACHE_SUFFIX)
+
+    def load(self, code, mode):
+        key = self.key(code, mode)
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as file:
+                data = file.read()
+            if not data.startswith(CACHE_MAGIC + key):
+                return None
+            program = marshal.loads(data[len(CACHE_MAGIC) + len(key):])
+            os.utime(path)
+        except (OSError, EOFError, ValueError, TypeError):
+            return None
+        return program
+
+    def store(self, code, mode, program):
+        key = self.key(code, mode)
+        payload = marshal.dumps(program)
+        try:
+            import tempfile
+            os.makedirs(self.directory, exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+            try:
+                with os.fdopen(fd, 'wb') as file:
+                    file.write(CACHE_MAGIC + key + payload)
+                os.replace(temp_path, self.path(key))
+            except BaseException:
+                os.unlink(temp_path)
+                raise
+            unchecked = ProgramCache.unchecked_bytes.get(self.directory)
+            if unchecked is None or unchecked >= self.max_bytes // CACHE_EVICT_FRACTION:
+                self.evict()
+                unchecked = 0
+            ProgramCache.unchecked_bytes[self.directory] = unchecked + len(payload)
+        except OSError:
+            pass
+
+    def entries(self):
+        try:
+            with os.scandir(self.directory) as scan:
+                return [entry for entry in scan if entry.name.endswith(CACHE_SUFFIX) and entry.is_file()]
+        except OSError:
+            return []
+
+    def evict(self):
+        entries = [(entry.stat().st_mtime, entry.stat().st_size, entry.path) for entry in self.entries()]
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            total -= size
+
+    def clear(self):
+        for entry in self.entries():
+            try:
+                os.unlink(entry.path)
+            except OSError:
+                pass
+
+def prepare(code, mode, cache=None, opt_level=0, lines=None, counters=None):
+    # Turns source into what execute() runs for the given mode, reusing a
+    # cached token stream, code object or bytecode when a cache is given. A
+    # lines dict is filled with the source line of every statement, and
+    # Counters get the time spent lexing and parsing.
+    if mode == 'python':
+        # Code objects depend on the optimization level; tokens do not
+        variant = f'{{mode}}-O{{opt_level}}' if opt_level else mode
+        cached = cache.load(code, variant) if cache is not None else None
+        if cached is None:
+            cached = compile_python(code.upper() if ENFORCE_UPPERCASE_CODE else code, opt_level=opt_level)
+            if cache is not None:
+                cache.store(code, variant, cached)
+        return cached
+    if mode == 'vm':
+        # Bytecode is cached as Bytecode.to_data(), one entry per level too
+        variant = f'{{mode}}-O{{opt_level}}' if opt_level else mode
+        cached = cache.load(code, variant) if cache is not None else None
+        if cached is not None:
+            return Bytecode.from_data(cached)
+        program = compile_bytecode(optimize(parse(lexer(code.upper() if ENFORCE_UPPERCASE_CODE else code)), opt_level))
+        if cache is not None:
+            cache.store(code, variant, program.to_data())
+        return program
+    started = time.perf_counter() if counters is not None else 0.0
+    cached = cache.load(code, mode) if cache is not None else None
+    if cached is None:
+        tokens = lexer(code.upper() if ENFORCE_UPPERCASE_CODE else code)
+        if cache is not None:
+            cache.store(code, mode, tokens.to_data())
+    else:
+        tokens = Tokens.from_data(cached)
+    if counters is None:
+        return optimize(parse(tokens, lines), opt_level, lines)
+    lexed = time.perf_counter()
+    program = optimize(parse(tokens, lines), opt_level, lines)
+    counters.lex_seconds += lexed - started
+    counters.parse_seconds += time.perf_counter() - lexed
+    counters.programs_prepared += 1
+    return program
+
+def execute(program, mode, interpreter=None, server=None, output=None):
+    if interpreter is None:
+        interpreter = Interpreter(server, output)
+    if mode == 'python':
+        code_object, constants = program
+        run_python(code_object, constants, interpreter)
+    elif mode == 'vm':
+        run_bytecode(program, interpreter)
+    elif mode == 'compile':
+        interpreter.compiler().compile_program(program)()
+    else:
+        interpreter.resolve(program)
+        for statement in program:
+            interpreter.visit(statement)
+    return interpreter
+
+def run(code, mode='interpret', cache=None, opt_level=0, server=None, output=None, profiler=None, metrics=None):
+    if mode not in EXECUTION_MODES:
+        raise ValueError(f"Unknown execution mode: {{mode}}")
+    if server is not None and mode in ('python', 'vm'):
+        raise ValueError(f"Concurrent servers are not supported in '{{mode}}' mode")
+    if profiler is not None:
+        if mode in ('python', 'vm'):
+            raise ValueError(f"Profiling is not supported in '{{mode}}' mode")
+        if server is not None:
+            raise ValueError("Concurrent servers cannot be profiled")
+        if metrics is not None:
+            raise ValueError("Profiled programs cannot be metered")
+        profiler.load(code)
+    if metrics is not None and mode in ('python', 'vm'):
+        raise ValueError(f"Metrics are not supported in '{{mode}}' mode")
+    if output is None:
+        output = Output()
+    try:
+        interpreter = lines = counters = None
+        if profiler is not None:
+            interpreter = ProfilingInterpreter(profiler, server, output)
+            lines = profiler.lines
+        elif metrics is not None:
+            interpreter = MeteredInterpreter(metrics, server, output)
+            lines = metrics.lines
+            counters = interpreter.counters
+        program = prepare(code, mode, cache, opt_level, lines, counters)
+        execute(program, mode, interpreter, server, output)
+    except {config['language_name']}SyntaxError as e:
+        output.write(f"{{COMMAND_PREFIX}}PY ERROR: {{str(e).upper()}}\\n")
+        sys.exit(1)
+    finally:
+        output.flush()
+
+# Streaming
+# Tokens to keep buffered ahead of the statement being parsed
+STREAM_LOW_WATER = 64
+STREAM_HIGH_WATER = 256
+# Seconds output may wait in the buffer between streamed statements
+STREAM_FLUSH_INTERVAL = 0.05
+
+def stream_statements(lines):
+    # Parses an iterable of source lines incrementally, yielding each
+    # top-level statement as soon as it is complete. Only the tokens of the
+    # statement being parsed and a small read-ahead window are held in memory.
+    #
+    # The parser looks up to two tokens past its cursor (to spot the '=' of
+    # an assignment), and an expression may continue on the next line, so a
+    # statement is only accepted once three more tokens have been buffered.
+    # A parse that fails within two tokens of the end of the buffer is
+    # retried with more input, reading twice as many lines each time.
+    lines = iter(lines)
+    buffer = []
+    line_number = 0
+    exhausted = False
+
+    def fill(count=1):
+        nonlocal line_number, exhausted
+        for _ in range(count):
+            line = next(lines, None)
+            if line is None:
+                exhausted = True
+                return
+            line_number += 1
+            if ENFORCE_UPPERCASE_CODE:
+                line = line.upper()
+            buffer.extend(TOKEN_PATTERN.findall(strip_comment(line.rstrip('\\n'), line_number)))
+
+    start = 0
+    want = 1
+    parse_next = None
+    while True:
+        if len(buffer) - start < STREAM_LOW_WATER and not exhausted:
+            # Top the buffer up in one go so the parser is rebuilt rarely
+            del buffer[:start]
+            start = 0
+            while len(buffer) < STREAM_HIGH_WATER and not exhausted:
+                fill()
+            parse_next = None
+        if start >= len(buffer):
+            return
+        if parse_next is None:
+            parse_next, position = statement_parser(buffer)
+        try:
+            statement, end = parse_next(start)
+        except ({config['language_name']}SyntaxError, IndexError, ValueError):
+            if exhausted or position() + 2 < len(buffer):
+                raise
+            end = len(buffer)
+        if end + 2 >= len(buffer) and not exhausted:
+            fill(want)
+            want *= 2
+            parse_next = None
+            continue
+        yield statement
+        start = end
+        want = 1
+
+def run_stream(lines, mode='interpret', opt_level=0, server=None, output=None):
+    # Runs each top-level statement as soon as it has been parsed, and
+    # writes out its output soon after
+    if mode not in ('interpret', 'compile'):
+        raise ValueError(f"Streaming is not supported in '{{mode}}' mode")
+    interpreter = Interpreter(server, output)
+    output = interpreter.output
+    compiler = interpreter.compiler() if mode == 'compile' else None
+    optimizer = Optimizer(opt_level)
+    try:
+        for statement in stream_statements(lines):
+            for statement in optimizer.optimize([statement]):
+                if compiler is not None:
+                    compiler.compile_program([statement])()
+                else:
+                    interpreter.resolve(statement)
+                    interpreter.visit(statement)
+            output.flush_stale(STREAM_FLUSH_INTERVAL)
+    except {config['language_name']}SyntaxError as e:
+        output.write(f"{{COMMAND_PREFIX}}PY ERROR: {{str(e).upper()}}\\n")
+        sys.exit(1)
+    finally:
+        output.flush()
+
+def run_file(filename, mode='interpret', cache=True, cache_dir=None, stream=False, opt_level=0, server=None,
+             output=None, profiler=None, metrics=None):
+    # A filename of '-' reads the program from standard input
+    if stream and profiler is not None:
+        raise ValueError("Streamed programs cannot be profiled")
+    if stream and metrics is not None:
+        raise ValueError("Streamed programs cannot be metered")
+    if filename == '-':
+        if stream:
+            return run_stream(sys.stdin, mode, opt_level, server, output)
+        return run(sys.stdin.read(), mode, opt_level=opt_level, server=server, output=output, profiler=profiler,
+                   metrics=metrics)
+    if filename.endswith(BYTECODE_EXTENSION):
+        if stream or profiler is not None or metrics is not None:
+            raise ValueError("Bytecode files cannot be streamed, profiled or metered")
+        return run_bytecode_file(filename, server, output)
+    if not filename.endswith(FILE_EXTENSION):
+        raise ValueError(f"Only {{FILE_EXTENSION}} files can be run")
+    if stream:
+        with open(filename, 'r') as file:
+            return run_stream(file, mode, opt_level, server, output)
+    with open(filename, 'r') as file:
+        code = file.read()
+    program_cache = None
+    if cache:
+        program_cache = ProgramCache(cache_dir) if cache_dir else ProgramCache.for_file(filename)
+    return run(code, mode, program_cache, opt_level, server, output, profiler, metrics)
+
+def run_bytecode_file(filename, server=None, output=None):
+    # Runs a file written by --save-bytecode in the VM, whatever the --mode
+    if server is not None:
+        raise ValueError("Concurrent servers are not supported in 'vm' mode")
+    program = Bytecode.load(filename)
+    if output is None:
+        output = Output()
+    try:
+        execute(program, 'vm', output=output)
+    finally:
+        output.flush()
+
+def bytecode_for_file(filename, opt_level=0):
+    # The bytecode of a program, read from '-' or a file, or of a file
+    # written by --save-bytecode
+    if filename == '-':
+        return prepare(sys.stdin.read(), 'vm', opt_level=opt_level)
+    if filename.endswith(BYTECODE_EXTENSION):
+        return Bytecode.load(filename)
+    if not filename.endswith(FILE_EXTENSION):
+        raise ValueError(f"Only {{FILE_EXTENSION}} files can be run")
+    with open(filename, 'r') as file:
+        return prepare(file.read(), 'vm', opt_level=opt_level)
+
+# Batch runner
+def batch_files(sources):
+    # Programs named by each source: a directory (searched recursively for
+    # FILE_EXTENSION files), a manifest file listing one program per line
+    # relative to itself, or a glob pattern
+    for source in sources:
+        if os.path.isdir(source):
+            for root, directories, files in os.walk(source):
+                directories.sort()
+                for name in sorted(files):
+                    if name.endswith(FILE_EXTENSION):
+                        yield os.path.join(root, name)
+        elif os.path.isfile(source) and not source.endswith(FILE_EXTENSION):
+            base = os.path.dirname(source)
+            with open(source, 'r') as manifest:
+                for line in manifest:
+                    line = line.strip()
+                    if line and not line.startswith('#'):
+                        yield os.path.join(base, line)
+        else:
+            import glob
+            matches = sorted(glob.glob(source, recursive=True))
+            if not matches:
+                raise ValueError(f"No programs match {{source}}")
+            yield from matches
+
+def run_batch_job(filename, mode, opt_level, cache, cache_dir):
+    # Runs one program as the command line would, capturing its output and
+    # exit status
+    stdout, stderr = io.StringIO(), io.StringIO()
+    status = 0
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+        try:
+            run_file(filename, mode, cache, cache_dir, opt_level=opt_level, output=Output(stdout))
+        except SystemExit as e:
+            status = e.code if isinstance(e.code, int) else int(e.code is not None)
+        except Exception as e:
+            print(f"ERROR: {{str(e).upper()}}")
+            status = 1
+    return status, stdout.getvalue(), stderr.getvalue(), time.perf_counter() - start
+
+def batch_worker(connection, mode, opt_level, cache, cache_dir):
+    # Runs the programs sent by a BatchRunner until it sends None or exits
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    try:
+        while True:
+            filename = connection.recv()
+            if filename is None:
+                return
+            connection.send(run_batch_job(filename, mode, opt_level, cache, cache_dir))
+    except (EOFError, BrokenPipeError):
+        pass
+
+class BatchResult:
+    __slots__ = ('filename', 'status', 'stdout', 'stderr', 'seconds', 'timed_out')
+
+    def __init__(self, filename, status, stdout, stderr, seconds, timed_out=False):
+        self.filename = filename
+        self.status = status
+        self.stdout = stdout
+        self.stderr = stderr
+        self.seconds = seconds
+        self.timed_out = timed_out
+
+class BatchRunner:
+    # Runs many programs on a pool of worker processes. Workers are forked
+    # from this process where possible, so they start with the interpreter
+    # already loaded, and they keep running from one program to the next;
+    # each program still gets a fresh Interpreter. A program that runs for
+    # longer than timeout seconds has its worker killed and replaced.
+    def __init__(self, jobs=None, timeout=None, mode='interpret', opt_level=0, cache=True, cache_dir=None):
+        if mode not in EXECUTION_MODES:
+            raise ValueError(f"Unknown execution mode: {{mode}}")
+        self.jobs = jobs or os.cpu_count() or 1
+        self.timeout = timeout
+        self.options = (mode, opt_level, cache, cache_dir)
+        import multiprocessing
+        methods = multiprocessing.get_all_start_methods()
+        self.context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+
+    def start_worker(self):
+        connection, worker_connection = self.context.Pipe()
+        process = self.context.Process(target=batch_worker, args=(worker_connection, *self.options), daemon=True)
+        process.start()
+        worker_connection.close()
+        return process, connection
+
+    def run(self, filenames):
+        # Yields a BatchResult for each program, in the order given
+        import multiprocessing.connection
+        filenames = list(filenames)
+        results = {{}}
+        next_job = emitted = 0
+        idle = [self.start_worker() for _ in range(min(self.jobs, len(filenames)))]
+        busy = {{}}
+        try:
+            while emitted < len(filenames):
+                while idle and next_job < len(filenames):
+                    process, connection = idle.pop()
+                    connection.send(filenames[next_job])
+                    busy[connection] = (process, next_job, time.monotonic())
+                    next_job += 1
+                timeout = None
+                if self.timeout is not None and busy:
+                    first_started = min(started for _, _, started in busy.values())
+                    timeout = max(0, first_started + self.timeout - time.monotonic())
+                for connection in multiprocessing.connection.wait(list(busy), timeout):
+                    process, index, started = busy.pop(connection)
+                    try:
+                        results[index] = BatchResult(filenames[index], *connection.recv())
+                        idle.append((process, connection))
+                    except EOFError:
+                        process.join()
+                        results[index] = BatchResult(filenames[index], process.exitcode, '',
+                                                     "ERROR: WORKER PROCESS EXITED\\n", time.monotonic() - started)
+                        idle.append(self.start_worker())
+                if self.timeout is not None:
+                    now = time.monotonic()
+                    for connection, (process, index, started) in list(busy.items()):
+                        if now - started >= self.timeout:
+                            del busy[connection]
+                            process.kill()
+                            process.join()
+                            connection.close()
+                            results[index] = BatchResult(filenames[index], None, '', '', now - started, timed_out=True)
+                            idle.append(self.start_worker())
+                while emitted in results:
+                    yield results.pop(emitted)
+                    emitted += 1
+        finally:
+            for process, connection in idle:
+                try:
+                    connection.send(None)
+                except OSError:
+                    process.kill()
+            for process, _, _ in busy.values():
+                process.kill()
+            for process, _ in idle:
+                process.join()
+            for process, _, _ in busy.values():
+                process.join()
+
+def run_batch(sources, jobs=None, timeout=None, json_output=False, mode='interpret', opt_level=0,
+              cache=True, cache_dir=None):
+    # Runs every program named by sources, printing each one's output under
+    # a header (or one JSON object per program) and a summary to stderr.
+    # Returns the exit status for the whole batch.
+    import json
+    filenames = list(batch_files(sources))
+    runner = BatchRunner(jobs, timeout, mode, opt_level, cache, cache_dir)
+    succeeded = failed = timed_out = 0
+    start = time.perf_counter()
+    for result in runner.run(filenames):
+        if result.timed_out:
+            timed_out += 1
+        elif result.status == 0:
+            succeeded += 1
+        else:
+            failed += 1
+        if json_output:
+            print(json.dumps({{
+                'file': result.filename, 'status': result.status, 'timed_out': result.timed_out,
+                'seconds': result.seconds, 'stdout': result.stdout, 'stderr': result.stderr,
+            }}))
+            continue
+        outcome = 'TIMED OUT' if result.timed_out else f'STATUS {{result.status}}'
+        print(f"==> {{result.filename}} ({{outcome}}, {{result.seconds * 1000:.1f}} MS) <==")
+        sys.stdout.write(result.stdout)
+        sys.stderr.write(result.stderr)
+    elapsed = time.perf_counter() - start
+    per_job = elapsed / len(filenames) * 1000 if filenames else 0
+    print(f"BATCH: {{len(filenames)}} PROGRAMS, {{succeeded}} SUCCEEDED, {{failed}} FAILED, {{timed_out}} TIMED OUT "
+          f"IN {{elapsed:.2f}}S ({{per_job:.2f}} MS PER PROGRAM)", file=sys.stderr)
+    return 0 if succeeded == len(filenames) else 1
+
+# Daemon
+# Prepared programs the daemon keeps in memory
+DAEMON_CACHE_SIZE = 256
+
+def daemon_socket_path():
+    # The client computes the same default, without importing this module
+    directory = os.environ.get('XDG_RUNTIME_DIR') or os.environ.get('TMPDIR') or '/tmp'
+    return os.path.join(directory, f'{{LANGUAGE_NAME.lower()}}-daemon-{{os.getuid()}}.sock')
+
+def send_frame(connection, kind, data):
+    # Replies to daemon clients are frames of a one-byte kind (b'1' stdout,
+    # b'2' stderr, b'x' exit status), a four-byte length and the data
+    connection.sendall(kind + len(data).to_bytes(4, 'big') + data)
+
+class FrameWriter:
+    # A text stream that sends what is written to a daemon client, a line at
+    # a time
+    def __init__(self, connection, kind):
+        self.connection = connection
+        self.kind = kind
+        self.pending = []
+
+    def write(self, text):
+        self.pending.append(text)
+        if '\\n' in text:
+            self.flush()
+        return len(text)
+
+    def flush(self):
+        if self.pending:
+            data = ''.join(self.pending).encode()
+            self.pending.clear()
+            send_frame(self.connection, self.kind, data)
+
+class ThreadOutput:
+    # Stands in for sys.stdout or sys.stderr in the daemon, so that each
+    # request's thread writes to its own client and other threads write to
+    # the original stream
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+
+    def redirect(self, target):
+        self.local.target = target
+
+    @property
+    def target(self):
+        return getattr(self.local, 'target', None) or self.stream
+
+    def write(self, text):
+        return self.target.write(text)
+
+    def flush(self):
+        self.target.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+class HotPrograms:
+    # Prepared programs kept in memory, dropping the least recently used
+    # beyond capacity. An entry is reused while its file's size and
+    # modification time are unchanged; execute() gives every run its own
+    # Interpreter, so one program can run for several clients at once.
+    def __init__(self, capacity=DAEMON_CACHE_SIZE, cache=True, cache_dir=None):
+        self.capacity = capacity
+        self.cache = cache
+        self.cache_dir = cache_dir
+        self.entries = {{}}
+        self.lock = threading.Lock()
+
+    def get(self, filename, mode, opt_level):
+        if mode not in EXECUTION_MODES:
+            raise ValueError(f"Unknown execution mode: {{mode}}")
+        if not filename.endswith(FILE_EXTENSION):
+            raise ValueError(f"Only {{FILE_EXTENSION}} files can be run")
+        status = os.stat(filename)
+        version = (status.st_mtime_ns, status.st_size)
+        key = (filename, mode, opt_level)
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None and entry[0] == version:
+                self.entries[key] = entry
+                return entry[1]
+        with open(filename, 'r') as file:
+            code = file.read()
+        program_cache = None
+        if self.cache:
+            program_cache = ProgramCache(self.cache_dir) if self.cache_dir else ProgramCache.for_file(filename)
+        program = prepare(code, mode, program_cache, opt_level)
+        with self.lock:
+            self.entries[key] = (version, program)
+            while len(self.entries) > self.capacity:
+                del self.entries[next(iter(self.entries))]
+        return program
+
+def serve_daemon_request(connection, programs):
+    # Runs the program a client asked for, as the command line would, and
+    # streams its output and exit status back
+    import json
+    line = Connection(connection).recvline()
+    if not line:
+        # A connection that asks for nothing, like another daemon checking
+        # whether this one is running
+        return
+    stdout, stderr = FrameWriter(connection, b'1'), FrameWriter(connection, b'2')
+    output = Output(stdout, line_buffered=True)
+    status = 0
+    sys.stdout.redirect(stdout)
+    sys.stderr.redirect(stderr)
+    try:
+        request = json.loads(line)
+        mode = request.get('mode', 'interpret')
+        program = programs.get(request['file'], mode, int(request.get('opt_level', 0)))
+        # Requests run on threads that share the daemon's working directory,
+        # so the client's is given to the interpreter instead of chdir()
+        interpreter = Interpreter(output=output)
+        interpreter.working_directory = request.get('cwd')
+        execute(program, mode, interpreter)
+    except {config['language_name']}SyntaxError as e:
+        output.write(f"{{COMMAND_PREFIX}}PY ERROR: {{str(e).upper()}}\\n")
+        status = 1
+    except SystemExit as e:
+        status = e.code if isinstance(e.code, int) else int(e.code is not None)
+    except Exception as e:
+        output.write(f"ERROR: {{str(e).upper()}}\\n")
+        status = 1
+    finally:
+        sys.stdout.redirect(None)
+        sys.stderr.redirect(None)
+    output.flush()
+    stderr.flush()
+    send_frame(connection, b'x', str(status).encode())
+
+def run_daemon(path=None, max_workers=64, cache_size=DAEMON_CACHE_SIZE, cache=True, cache_dir=None):
+    # Serves programs to clients on a Unix domain socket until SIGINT or
+    # SIGTERM, running each request on a ConnectionServer thread
+    import socket
+    if not hasattr(socket, 'AF_UNIX'):
+        raise ValueError("The daemon needs Unix domain sockets")
+    path = path or daemon_socket_path()
+    if os.path.exists(path):
+        if os.stat(path).st_uid != os.getuid():
+            raise ValueError(f"{{path}} belongs to another user")
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(path)
+        except OSError:
+            os.unlink(path)
+        else:
+            raise ValueError(f"A daemon is already listening on {{path}}")
+        finally:
+            probe.close()
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    # Created with mode 0600, so that only this user can send it programs
+    umask = os.umask(0o177)
+    try:
+        listener.bind(path)
+    finally:
+        os.umask(umask)
+    listener.listen(128)
+    listener.settimeout(1.0)
+    programs = HotPrograms(cache_size, cache, cache_dir)
+    server = ConnectionServer(max_workers)
+    print(f"{{LANGUAGE_NAME}} DAEMON LISTENING ON {{path}}", flush=True)
+    stdout, stderr = sys.stdout, sys.stderr
+    sys.stdout, sys.stderr = ThreadOutput(stdout), ThreadOutput(stderr)
+    def accept_loop():
+        while not server.stopping:
+            try:
+                connection, _ = listener.accept()
+            except socket.timeout:
+                continue
+            server.submit(connection, serve_daemon_request, connection, programs)
+    try:
+        server.serve(accept_loop)
+    finally:
+        sys.stdout, sys.stderr = stdout, stderr
+        listener.close()
+        with contextlib.suppress(OSError):
+            os.unlink(path)
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(
+        prog=f"{{LANGUAGE_NAME.lower()}}.py",
+        usage=f"python %(prog)s [options] <filename{{FILE_EXTENSION}} | filename{{BYTECODE_EXTENSION}} | -> | --batch SOURCE ... | --daemon>",
+    )
+    arg_parser.add_argument('filename', nargs='?', help="program to run, or '-' to read it from standard input")
+    arg_parser.add_argument('--mode', choices=EXECUTION_MODES, default='interpret',
+                            help="'interpret' walks the AST; 'compile' runs prebuilt closures; "
+                                 "'python' translates the program to Python bytecode; "
+                                 "'vm' runs the program's own bytecode on a stack machine")
+    arg_parser.add_argument('--opt-level', type=int, choices=OPT_LEVELS, default=0,
+                            help="1 folds constants and drops dead branches; "
+                                 "2 also caches loop-invariant expressions")
+    arg_parser.add_argument('--concurrent', action='store_true',
+                            help="handle each connection accepted by a server loop on a thread pool")
+    arg_parser.add_argument('--max-workers', type=int, default=64,
+                            help="connections handled at once with --concurrent (default: 64)")
+    arg_parser.add_argument('--max-pending', type=int, default=1024,
+                            help="accepted connections that may wait for a worker (default: 1024)")
+    arg_parser.add_argument('--shutdown-timeout', type=float, default=10.0,
+                            help="seconds handlers get to finish after SIGINT or SIGTERM (default: 10)")
+    arg_parser.add_argument('--workers', type=int,
+                            help="fork this many processes to run each server loop")
+    arg_parser.add_argument('--report-interval', type=float, default=0,
+                            help="seconds between per-worker throughput reports with --workers "
+                                 "(default: only when the loop ends)")
+    arg_parser.add_argument('--batch', action='append', metavar='SOURCE',
+                            help="run every program in a directory, glob or manifest file on a pool of "
+                                 "worker processes (can be repeated)")
+    arg_parser.add_argument('--jobs', type=int,
+                            help="worker processes for --batch (default: one per CPU)")
+    arg_parser.add_argument('--timeout', type=float,
+                            help="seconds each --batch program may run before it is killed")
+    arg_parser.add_argument('--json', action='store_true',
+                            help="print --batch results as one JSON object per program")
+    arg_parser.add_argument('--daemon', action='store_true',
+                            help="serve programs sent by the client script on a Unix domain socket")
+    arg_parser.add_argument('--socket',
+                            help="socket path for --daemon (default: one per user in $XDG_RUNTIME_DIR or /tmp)")
+    arg_parser.add_argument('--daemon-cache', type=int, default=DAEMON_CACHE_SIZE,
+                            help=f"prepared programs --daemon keeps in memory (default: {{DAEMON_CACHE_SIZE}})")
+    arg_parser.add_argument('--unbuffered', action='store_true',
+                            help="write program output as soon as it is printed")
+    arg_parser.add_argument('--output', metavar='FILE',
+                            help="write program output to FILE instead of standard output")
+    arg_parser.add_argument('--profile', action='store_true',
+                            help="time every source line and builtin and print a report to standard error")
+    arg_parser.add_argument('--profile-stacks', metavar='FILE',
+                            help="profile, and write collapsed stacks for flame graph tools to FILE")
+    arg_parser.add_argument('--metrics-file', metavar='FILE',
+                            help="append a JSON snapshot of the program's metrics to FILE periodically and at exit")
+    arg_parser.add_argument('--metrics-port', type=int, metavar='PORT',
+                            help="serve the program's metrics in the Prometheus text format on "
+                                 "http://127.0.0.1:PORT/metrics")
+    arg_parser.add_argument('--metrics-interval', type=float, default=METRICS_INTERVAL,
+                            help=f"seconds between --metrics-file snapshots (default: {{METRICS_INTERVAL:g}})")
+    arg_parser.add_argument('--no-cache', action='store_true',
+                            help="don't read or write the compiled-program cache")
+    arg_parser.add_argument('--clear-cache', action='store_true',
+                            help="remove cached programs before running (or on its own)")
+    arg_parser.add_argument('--save-bytecode', action='store_true',
+                            help=f"compile the program for the VM into a {{BYTECODE_EXTENSION}} file next to it "
+                                 "instead of running it")
+    arg_parser.add_argument('--disassemble', action='store_true',
+                            help="print the program's VM bytecode instead of running it")
+    arg_parser.add_argument('--stream', action='store_true',
+                            help="parse and run top-level statements as the program is read")
+    arg_parser.add_argument('--cache-dir',
+                            help=f"cache directory (default: __{{LANGUAGE_NAME.lower()}}cache__ next to the program)")
+    args = arg_parser.parse_args()
+    if args.filename is None and not args.clear_cache and not args.batch and not args.daemon:
+        arg_parser.print_usage()
+        sys.exit(1)
+
+    try:
+        if args.clear_cache:
+            if args.cache_dir:
+                ProgramCache(args.cache_dir).clear()
+            else:
+                ProgramCache.for_file(args.filename or os.path.join(os.getcwd(), FILE_EXTENSION)).clear()
+        if args.filename is not None and (args.save_bytecode or args.disassemble):
+            program = bytecode_for_file(args.filename, args.opt_level)
+            if args.disassemble:
+                print(disassemble(program))
+            if args.save_bytecode:
+                if not args.filename.endswith(FILE_EXTENSION):
+                    raise ValueError(f"Only {{FILE_EXTENSION}} files can be compiled to bytecode")
+                program.save(args.filename[:-len(FILE_EXTENSION)] + BYTECODE_EXTENSION)
+        elif args.filename is not None:
+            server = None
+            if args.concurrent:
+                server = ConnectionServer(args.max_workers, args.max_pending, args.shutdown_timeout)
+            metrics = None
+            if args.metrics_file or args.metrics_port is not None:
+                metrics = Metrics()
+                if args.metrics_file:
+                    metrics.write_periodically(args.metrics_file, args.metrics_interval)
+                if args.metrics_port is not None:
+                    metrics.serve(args.metrics_port)
+            if args.workers is not None:
+                server = PreforkServer(args.workers, server, args.shutdown_timeout, args.report_interval, metrics)
+            profiler = None
+            if args.profile or args.profile_stacks:
+                profiler = Profiler(os.path.basename(args.filename))
+            with open(args.output, 'w') if args.output else contextlib.nullcontext(sys.stdout) as stream:
+                output = Output(stream, 0 if args.unbuffered else None)
+                try:
+                    run_file(args.filename, args.mode, not args.no_cache, args.cache_dir, args.stream,
+                             args.opt_level, server, output, profiler, metrics)
+                finally:
+                    # Also after a failing program, which is often why it is profiled
+                    if profiler is not None and profiler.counts:
+                        output.flush()
+                        profiler.report()
+                        if args.profile_stacks:
+                            with open(args.profile_stacks, 'w') as file:
+                                profiler.write_stacks(file)
+        if args.daemon:
+            run_daemon(args.socket, args.max_workers, args.daemon_cache, not args.no_cache, args.cache_dir)
+        if args.batch:
+            sys.exit(run_batch(args.batch, args.jobs, args.timeout, args.json, args.mode, args.opt_level,
+                               not args.no_cache, args.cache_dir))
+    except Exception as e:
+        print(f"ERROR: {{str(e).upper()}}")
+        sys.exit(1)
+"""
+    write_file(os.path.join(lib_dir, f"{config['language_name'].lower()}.py"), interpreter_code)
+
+def generate_readme(lang_dir, config):
+    lower_name = config['language_name'].lower()
+    zipapp_note = ''
+    if config.get('zipapp', False):
+        zipapp_note = f"""
+`{lower_name}.pyz` holds the whole interpreter in one file that runs anywhere
+Python does, without the `lib` directory:
+
+```
+python {lower_name}.pyz your_program{config['file_extension']}
+```
+"""
+    readme_content = f"""
+# {config['language_name']} Programming Language
+
+{config['language_name']} is a custom programming language created to honor friendship.
+
+## Features
+
+- File extension: {config['file_extension']}
+- Comment prefix: {config['comment_prefix']}
+- Command prefix: {config['command_prefix']}
+- {'Case-insensitive' if not config['case_sensitive'] else 'Case-sensitive'}
+- {'Enforces uppercase comments' if config['enforce_uppercase_comments'] else 'Allows any case for comments'}
+- {'Enforces uppercase code' if config['enforce_uppercase_code'] else 'Allows any case for code'}
+- True value: {config['true_value']}
+- False value: {config['false_value']}
+
+## Running {config['language_name']} Programs
+
+Use the `{config['command_name']}` command followed by your {config['language_name']} file:
+
+```
+./{config['command_name']} your_program{config['file_extension']}
+```
+
+The command runs the interpreter as a module, so Python loads its cached
+bytecode instead of compiling it every time. The interpreter imports modules
+such as `socket` and `multiprocessing` only when a program uses a feature
+that needs them, so short programs start quickly.
+{zipapp_note}
+## Arrays
+
+`{array_type_prefix(config)} "1, 2.5, 3"` is an array of numbers. Arithmetic between an array and a
+number, or two arrays of the same length, works on every element at once, so a
+calculation over thousands of numbers is one statement instead of a loop:
+
+```
+PRICES = {array_type_prefix(config)} "2.5, 4, 10"
+TOTALS = PRICES * {config['command_prefix']}ARRAYOF({config['type_prefixes']['integer']} 3, {config['type_prefixes']['integer']} 1, {config['type_prefixes']['integer']} 2)
+{config['command_prefix']}PRINT({config['command_prefix']}SUM(TOTALS), {config['command_prefix']}MEAN(TOTALS))
+```
+
+`{config['command_prefix']}ARRAYOF(...)` makes an array of its arguments, `{config['command_prefix']}RANGE(N)` of the integers
+from 0 to N - 1 and `{config['command_prefix']}LOADARRAY(FILE)` of the numbers in a file. `{config['command_prefix']}SUM`,
+`{config['command_prefix']}MIN`, `{config['command_prefix']}MAX`, `{config['command_prefix']}MEAN` and `{config['command_prefix']}LENGTH` take an array, and
+`{config['command_prefix']}SLICE(ARRAY, START, STOP)` returns part of one. Arrays use NumPy when it is
+installed, and Python's `array` module otherwise.
+
+## Execution Modes
+
+Programs are interpreted by walking the syntax tree by default. Loop-heavy
+programs can be run with the closure compiler instead, which prepares every
+statement once before running it:
+
+```
+./{config['command_name']} --mode compile your_program{config['file_extension']}
+```
+
+For batch jobs, `--mode python` translates the program into Python source and
+runs it as compiled Python bytecode, which is the fastest way to run it.
+
+`--mode vm` compiles the program into a compact bytecode of its own and runs it
+on a stack machine, which is faster than walking the syntax tree. To skip
+lexing and parsing as well, save the bytecode once with `--save-bytecode` and
+run the `{config['file_extension']}c` file it writes next to the program:
+
+```
+./{config['command_name']} --save-bytecode your_program{config['file_extension']}
+./{config['command_name']} your_program{config['file_extension']}c
+```
+
+`--disassemble` prints a program's bytecode instead of running it.
+
+## Optimizer
+
+`--opt-level 1` folds constant expressions, applies `{config['command_prefix']}SHOUT` to literals and
+removes branches and loops whose condition is a constant. `--opt-level 2` also
+reuses the value of loop-invariant expressions instead of recomputing them on
+every iteration. Programs print the same output and raise the same errors at
+every level; the default, `--opt-level 0`, runs them exactly as written.
+
+## Concurrent Servers
+
+Run a server with `--concurrent` to handle each accepted connection on a thread
+pool instead of one at a time:
+
+```
+./{config['command_name']} --concurrent server{config['file_extension']}
+```
+
+Everything after the `{config['command_prefix']}ACCEPT` in the server loop runs once per connection,
+with a private copy of the program's variables, and the connection is closed
+when it finishes. Since the copy is private, a program whose handler assigns a
+variable that the loop reads before `{config['command_prefix']}ACCEPT`, such as a count of
+connections left, is refused; update such variables before `{config['command_prefix']}ACCEPT`.
+
+`--max-workers` and `--max-pending` bound how many connections are handled and
+queued at once, and `SIGINT`/`SIGTERM` stop the server after giving running
+handlers `--shutdown-timeout` seconds to finish.
+
+To use more cores, `--workers N` runs the program up to the server loop once and
+then forks `N` worker processes that accept connections from the same listening
+socket. Each worker handles connections like `--concurrent` does, on a thread
+pool if `--concurrent` is also given, and refuses the same programs. Each
+worker runs the loop on its own copy of the variables, so a loop that counts
+down connections before `{config['command_prefix']}ACCEPT` serves that many per worker. Crashed
+workers are restarted, and the number of connections each worker handled is
+reported when the server stops, or every `--report-interval` seconds:
+
+```
+./{config['command_name']} --workers 4 --concurrent server{config['file_extension']}
+```
+
+## Metrics
+
+`--metrics-port PORT` serves Prometheus metrics at `http://127.0.0.1:PORT/metrics`
+and `--metrics-file FILE` appends a JSON snapshot to a file every
+`--metrics-interval` seconds. They count statements, loop iterations, builtin
+calls, bytes sent, connections accepted with how long `{config['command_prefix']}ACCEPT` waited for
+each, and time spent lexing and parsing. With `--workers`, the metrics cover
+every worker.
+
+## Native Functions
+
+Python code that embeds the interpreter can make its own functions callable from
+{config['language_name']} programs:
+
+```python
+register_function('{config['command_prefix']}TWICE', lambda interpreter, value: value * 2, arity=1, pure=True)
+```
+
+The function receives the interpreter followed by its argument values. Calls to
+functions that are not registered are reported as soon as the program is parsed.
+
+## Sockets
+
+`{config['command_prefix']}SOCKET`, `{config['command_prefix']}BIND`, `{config['command_prefix']}LISTEN` and `{config['command_prefix']}ACCEPT` set up a listening server; listening
+sockets reuse their address, so a restarted server can bind straight away.
+Accepted connections support:
+
+- `{config['command_prefix']}RECV(CONNECTION, SIZE)`: up to `SIZE` bytes of text, or an empty string once the client has closed; `SIZE` must be at least 1
+- `{config['command_prefix']}RECVLINE(CONNECTION)`: the next line, including its newline, or an empty string once the client has closed
+- `{config['command_prefix']}SEND(CONNECTION, DATA)`: sends as much of `DATA` as the socket accepts at once
+- `{config['command_prefix']}SENDALL(CONNECTION, DATA)`: sends all of `DATA`
+- `{config['command_prefix']}CLOSE(CONNECTION)`: closes the connection (or a listening socket, given its name)
+
+Received data is buffered per connection, so a keep-alive loop can serve
+request after request on one connection:
+
+```
+LINE = {config['command_prefix']}RECVLINE(CONNECTION)
+{config['command_prefix']}WHILE LINE:
+    {config['command_prefix']}SENDALL(CONNECTION, LINE)
+    LINE = {config['command_prefix']}RECVLINE(CONNECTION)
+{config['block_end']}
+{config['command_prefix']}CLOSE(CONNECTION)
+```
+
+## Program Cache
+
+Lexed programs (and, with `--mode python` or `--mode vm`, their compiled code) are cached in a
+`__{config['language_name'].lower()}cache__` directory next to each program, so running an unchanged
+file again skips that work. Use `--no-cache` to bypass the cache,
+`--clear-cache` to empty it and `--cache-dir DIR` to keep it somewhere else.
+
+## Daemon
+
+To skip interpreter startup, start a daemon once and run programs through the
+client, which streams their output back and exits with their status:
+
+```
+python lib/{config['language_name'].lower()}.py --daemon &
+python -S lib/{config['language_name'].lower()}client.py your_program{config['file_extension']}
+```
+
+The daemon keeps recently used programs parsed, reloading any that change, and
+runs each one in a fresh interpreter. File names in a program are relative to
+the directory you run the client in. Without a daemon, or if the socket belongs
+to another user, the client runs the interpreter directly.
+
+## Batch Runs
+
+`--batch` runs every program in a directory, glob or manifest file (one program
+per line) on a pool of warm worker processes, which is far cheaper than starting
+the interpreter for each one:
+
+```
+./{config['command_name']} --batch jobs/ --jobs 8 --timeout 5
+```
+
+Each program's output and exit status are captured separately and printed in
+order under a header, or as JSON lines with `--json`, followed by a summary.
+Programs that run longer than `--timeout` seconds are killed.
+
+## Streaming
+
+Pass `--stream` to parse and run each top-level statement as soon as it has been
+read, instead of lexing and parsing the whole file first. Long programs start
+producing output straight away and only the statement being parsed is kept in
+memory. Use `-` as the filename to read the program from standard input:
+
+```
+cat program{config['file_extension']} | ./{config['command_name']} --stream -
+```
+
+Streaming works with the `interpret` and `compile` modes and skips the program cache.
+
+## Output
+
+`{config['command_prefix']}PRINT` writes to a 64 KB buffer that is flushed when it fills, after
+every line when writing to a terminal, before `{config['command_prefix']}ACCEPT` waits for a client
+and at exit. Printing in a loop into a pipe or file is therefore not limited
+by system calls. Pass `--unbuffered` (or set `PYTHONUNBUFFERED`) to write every
+line straight away, and `--output FILE` to write to a file instead of standard
+output.
+
+## Profiling
+
+`--profile` times every statement by source line and every builtin call, and
+writes a report of the busiest ones to standard error when the program ends.
+`--profile-stacks FILE` also saves the profile as collapsed stacks for flame
+graph tools such as `flamegraph.pl` or speedscope:
+
+```
+./{config['command_name']} --profile --profile-stacks profile.folded your_program{config['file_extension']}
+```
+
+Profiling works in the `interpret` and `compile` modes. It is not available
+with `--stream`, `--concurrent` or `--workers`.
+
+## Examples
+
+Check out the example programs in this directory:
+- `string_manipulation{config['file_extension']}`
+- `arithmetic{config['file_extension']}`
+- `server{config['file_extension']}`
+- `boolean_logic{config['file_extension']}`
+- `arrays{config['file_extension']}`
+
+Enjoy coding in {config['language_name']}!
+"""
+    write_file(os.path.join(lang_dir, 'README.md'), readme_content)
+
+def generate_examples(lang_dir, config):
+    # String manipulation example
+    string_example = f"""
+{config['comment_prefix']} String manipulation example
+
+NAME = {config['type_prefixes']['string']} "FRIEND"
 GREETING = {config['command_prefix']}SHOUT({config['type_prefixes']['string']} "Hello, ")
 FULL_GREETING = GREETING + NAME
 {config['command_prefix']}PRINT(FULL_GREETING)
 """
-    with open(os.path.join(lang_dir, f"string_manipulation{config['file_extension']}"), 'w') as f:
-        f.write(string_example)
+    write_file(os.path.join(lang_dir, f"string_manipulation{config['file_extension']}"), string_example)
 
     # Arithmetic example
     arithmetic_example = f"""
@@ -519,8 +4576,7 @@ QUOTIENT = A / B
 {config['command_prefix']}PRINT({config['type_prefixes']['string']} "PRODUCT:", PRODUCT)
 {config['command_prefix']}PRINT({config['type_prefixes']['string']} "QUOTIENT:", QUOTIENT)
 """
-    with open(os.path.join(lang_dir, f"arithmetic{config['file_extension']}"), 'w') as f:
-        f.write(arithmetic_example)
+    write_file(os.path.join(lang_dir, f"arithmetic{config['file_extension']}"), arithmetic_example)
 
     # Server example
     server_example = f"""
@@ -538,15 +4594,15 @@ SERVERSOCKET = {config['command_prefix']}SOCKET({config['type_prefixes']['string
     {config['command_prefix']}PRINT({config['command_prefix']}SHOUT({config['type_prefixes']['string']} "CONNECTED"))
     
     RESPONSE = {config['command_prefix']}SHOUT({config['type_prefixes']['string']} "HELLO")
-    {config['command_prefix']}SEND(CONNECTION, RESPONSE)
+    {config['command_prefix']}SENDALL(CONNECTION, RESPONSE)
     
     {config['command_prefix']}PRINT({config['type_prefixes']['string']} "CLOSING CONNECTION")
+    {config['command_prefix']}CLOSE(CONNECTION)
 {config['block_end']}
 
 {config['command_prefix']}PRINT({config['type_prefixes']['string']} "SERVER CLOSED")
 """
-    with open(os.path.join(lang_dir, f"server{config['file_extension']}"), 'w') as f:
-        f.write(server_example)
+    write_file(os.path.join(lang_dir, f"server{config['file_extension']}"), server_example)
 
     # Boolean logic example
     boolean_example = f"""
@@ -568,29 +4624,172 @@ B = {config['false_value']}
     {config['command_prefix']}PRINT({config['type_prefixes']['string']} "B IS {config['false_value']}")
 {config['block_end']}
 """
-    with open(os.path.join(lang_dir, f"boolean_logic{config['file_extension']}"), 'w') as f:
-        f.write(boolean_example)
+    write_file(os.path.join(lang_dir, f"boolean_logic{config['file_extension']}"), boolean_example)
 
-def generate_shell_script(lang_dir, command_name, lang_name):
+    # Array example
+    array_example = f"""
+{config['comment_prefix']} Array example
+
+PRICES = {array_type_prefix(config)} "2.5, 4, 10"
+QUANTITIES = {config['command_prefix']}ARRAYOF({config['type_prefixes']['integer']} 3, {config['type_prefixes']['integer']} 1, {config['type_prefixes']['integer']} 2)
+TOTALS = PRICES * QUANTITIES
+
+{config['command_prefix']}PRINT({config['type_prefixes']['string']} "TOTALS:", TOTALS)
+{config['command_prefix']}PRINT({config['type_prefixes']['string']} "SUM:", {config['command_prefix']}SUM(TOTALS))
+{config['command_prefix']}PRINT({config['type_prefixes']['string']} "MEAN:", {config['command_prefix']}MEAN(TOTALS))
+{config['command_prefix']}PRINT({config['type_prefixes']['string']} "LARGEST:", {config['command_prefix']}MAX(TOTALS))
+{config['command_prefix']}PRINT({config['type_prefixes']['string']} "FIRST TWO:", {config['command_prefix']}SLICE(TOTALS, {config['type_prefixes']['integer']} 0, {config['type_prefixes']['integer']} 2))
+{config['command_prefix']}PRINT({config['type_prefixes']['string']} "SQUARES:", {config['command_prefix']}RANGE({config['type_prefixes']['integer']} 5) * {config['command_prefix']}RANGE({config['type_prefixes']['integer']} 5))
+"""
+    write_file(os.path.join(lang_dir, f"arrays{config['file_extension']}"), array_example)
+
+def generate_client(lib_dir, config):
+    # A client for the interpreter's --daemon mode that imports only what it
+    # needs to send a request and relay the replies, so that it starts fast
+    lower_name = config['language_name'].lower()
+    client_code = f"""import _socket
+import os
+import sys
+
+LANGUAGE_NAME = "{config['language_name']}"
+FILE_EXTENSION = "{config['file_extension']}"
+INTERPRETER = os.path.join(os.path.dirname(os.path.abspath(__file__)), '{lower_name}.py')
+USAGE = f"usage: python -S {lower_name}client.py [--socket PATH] [--mode MODE] [--opt-level N] <filename{{FILE_EXTENSION}}>"
+
+def daemon_socket_path():
+    # Must match daemon_socket_path() in the interpreter
+    directory = os.environ.get('XDG_RUNTIME_DIR') or os.environ.get('TMPDIR') or '/tmp'
+    return os.path.join(directory, f'{{LANGUAGE_NAME.lower()}}-daemon-{{os.getuid()}}.sock')
+
+def parse_arguments(argv):
+    options = {{'socket': None, 'mode': 'interpret', 'opt_level': '0'}}
+    filename = None
+    arguments = iter(argv)
+    for argument in arguments:
+        if argument in ('--socket', '--mode', '--opt-level'):
+            value = next(arguments, None)
+            if value is None:
+                sys.exit(USAGE)
+            options[argument[2:].replace('-', '_')] = value
+        elif filename is None and not argument.startswith('--'):
+            filename = argument
+        else:
+            sys.exit(USAGE)
+    if filename is None:
+        sys.exit(USAGE)
+    return filename, options
+
+def json_string(text):
+    # Encodes text as a JSON string; json itself takes longer to import than
+    # the rest of this client takes to run
+    return '"' + ''.join(f'\\\\u{{ord(char):04x}}' if char in '"\\\\' or char < ' ' else char for char in text) + '"'
+
+def receive_exactly(connection, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = connection.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("The daemon closed the connection")
+        data += chunk
+    return bytes(data)
+
+def run_directly(filename, options):
+    # Without a daemon, run the program with the interpreter itself
+    os.execv(sys.executable, [sys.executable, INTERPRETER, '--mode', options['mode'],
+                              '--opt-level', options['opt_level'], filename])
+
+def owned_by_user(path):
+    # Whether path exists and belongs to this user. Anyone can create the
+    # default path when it is in a shared directory like /tmp, and a daemon
+    # listening there would receive this user's programs.
+    try:
+        owner = os.stat(path).st_uid
+    except OSError:
+        return False
+    if owner != os.getuid():
+        print(f"WARNING: {{path}} BELONGS TO ANOTHER USER; NOT USING THE DAEMON", file=sys.stderr)
+        return False
+    return True
+
+def main():
+    filename, options = parse_arguments(sys.argv[1:])
+    path = options['socket'] or daemon_socket_path()
+    if filename == '-' or not owned_by_user(path):
+        run_directly(filename, options)
+    # _socket rather than socket, which imports enum
+    connection = _socket.socket(_socket.AF_UNIX, _socket.SOCK_STREAM)
+    try:
+        connection.connect(path)
+    except OSError:
+        connection.close()
+        run_directly(filename, options)
+    # The daemon resolves the program's relative file names against cwd
+    request = ', '.join(f'{{json_string(key)}}: {{json_string(value)}}' for key, value in (
+        ('file', os.path.abspath(filename)), ('mode', options['mode']), ('opt_level', options['opt_level']),
+        ('cwd', os.getcwd())))
+    connection.sendall(f'{{{{{{request}}}}}}\\n'.encode())
+    streams = {{b'1': sys.stdout.buffer, b'2': sys.stderr.buffer}}
+    while True:
+        header = receive_exactly(connection, 5)
+        data = receive_exactly(connection, int.from_bytes(header[1:], 'big'))
+        if header[:1] == b'x':
+            sys.exit(int(data))
+        stream = streams[header[:1]]
+        stream.write(data)
+        stream.flush()
+
+if __name__ == "__main__":
+    main()
+"""
+    write_file(os.path.join(lib_dir, f"{lower_name}client.py"), client_code)
+
+def generate_shell_script(lang_dir, command_name, lang_name, isolated=False):
+    # Runs the interpreter as a module rather than as a script, so that
+    # Python loads its cached bytecode instead of compiling it on every run,
+    # and with python -S when isolated, which skips the site module
+    flags = ' -S' if isolated else ''
     script_content = f"""#!/bin/sh
 SCRIPT_DIR="$(cd "$(dirname "$0")" && pwd)"
-python "$SCRIPT_DIR/lib/{lang_name.lower()}.py" "$@"
+exec python{flags} -c 'import runpy, sys; sys.path[0] = sys.argv.pop(1); runpy.run_module("{lang_name.lower()}", run_name="__main__", alter_sys=True)' "$SCRIPT_DIR/lib" "$@"
 """
-    script_path = os.path.join(lang_dir, command_name)
-    with open(script_path, 'w', newline='\n') as f:  # Use Unix line endings
-        f.write(script_content)
-    
-    # Make the script executable
-    current_permissions = os.stat(script_path).st_mode
-    os.chmod(script_path, current_permissions | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    # Use Unix line endings, and make the script executable
+    write_file(os.path.join(lang_dir, command_name), script_content, newline='\n', executable=True)
+
+def generate_zipapp(lang_dir, lib_dir, lang_name):
+    # Packs the interpreter into one file that runs as python <name>.pyz.
+    # The archive holds bytecode next to the source so that starting it
+    # doesn't compile the source; a different Python version ignores the
+    # bytecode and compiles the source instead. Entries get a fixed date, so
+    # the same interpreter always produces the same archive.
+    lower_name = lang_name.lower()
+    with tempfile.TemporaryDirectory() as directory:
+        bytecode_path = os.path.join(directory, f"{lower_name}.pyc")
+        py_compile.compile(os.path.join(lib_dir, f"{lower_name}.py"), bytecode_path,
+                           dfile=f"{lower_name}.pyz/{lower_name}.py", doraise=True,
+                           invalidation_mode=py_compile.PycInvalidationMode.CHECKED_HASH)
+        with open(bytecode_path, 'rb') as f:
+            bytecode = f.read()
+    with open(os.path.join(lib_dir, f"{lower_name}.py"), 'rb') as f:
+        source = f.read()
+    main = f"import runpy\nrunpy.run_module('{lower_name}', run_name='__main__', alter_sys=True)\n"
+    archive = io.BytesIO()
+    archive.write(b"#!/usr/bin/env python\n")
+    with zipfile.ZipFile(archive, 'w') as z:
+        for name, data in (('__main__.py', main.encode()), (f"{lower_name}.py", source),
+                           (f"{lower_name}.pyc", bytecode)):
+            z.writestr(zipfile.ZipInfo(name, date_time=(1980, 1, 1, 0, 0, 0)), data)
+    write_file(os.path.join(lang_dir, f"{lower_name}.pyz"), archive.getvalue(), executable=True)
 
 def main():
-    if len(sys.argv) != 2:
-        print("Usage: python langmaker.py <config_file.json>")
+    parser = argparse.ArgumentParser(description="Generate languages from JSON config files")
+    parser.add_argument('configs', nargs='+', metavar='config',
+                        help="A config file, a directory of config files, or a JSON list of config file paths")
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(),
+                        help="Processes to generate languages in (default: one per CPU)")
+    parser.add_argument('--force', action='store_true', help="Regenerate languages that are up to date")
+    args = parser.parse_args()
+    if generate_languages(find_configs(args.configs), args.jobs, args.force):
         sys.exit(1)
-    
-    config_file = sys.argv[1]
-    generate_language(config_file)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
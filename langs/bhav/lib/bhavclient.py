@@ -0,0 +1,93 @@
+import _socket
+import os
+import sys
+
+LANGUAGE_NAME = "BHAV"
+FILE_EXTENSION = ".bhav"
+INTERPRETER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bhav.py')
+USAGE = f"usage: python -S bhavclient.py [--socket PATH] [--mode MODE] [--opt-level N] <filename{FILE_EXTENSION}>"
+
+def daemon_socket_path():
+    # Must match daemon_socket_path() in the interpreter
+    directory = os.environ.get('XDG_RUNTIME_DIR') or os.environ.get('TMPDIR') or '/tmp'
+    return os.path.join(directory, f'{LANGUAGE_NAME.lower()}-daemon-{os.getuid()}.sock')
+
+def parse_arguments(argv):
+    options = {'socket': None, 'mode': 'interpret', 'opt_level': '0'}
+    filename = None
+    arguments = iter(argv)
+    for argument in arguments:
+        if argument in ('--socket', '--mode', '--opt-level'):
+            value = next(arguments, None)
+            if value is None:
+                sys.exit(USAGE)
+            options[argument[2:].replace('-', '_')] = value
+        elif filename is None and not argument.startswith('--'):
+            filename = argument
+        else:
+            sys.exit(USAGE)
+    if filename is None:
+        sys.exit(USAGE)
+    return filename, options
+
+def json_string(text):
+    # Encodes text as a JSON string; json itself takes longer to import than
+    # the rest of this client takes to run
+    return '"' + ''.join(f'\\u{ord(char):04x}' if char in '"\\' or char < ' ' else char for char in text) + '"'
+
+def receive_exactly(connection, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = connection.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("The daemon closed the connection")
+        data += chunk
+    return bytes(data)
+
+def run_directly(filename, options):
+    # Without a daemon, run the program with the interpreter itself
+    os.execv(sys.executable, [sys.executable, INTERPRETER, '--mode', options['mode'],
+                              '--opt-level', options['opt_level'], filename])
+
+def owned_by_user(path):
+    # Whether path exists and belongs to this user. Anyone can create the
+    # default path when it is in a shared directory like /tmp, and a daemon
+    # listening there would receive this user's programs.
+    try:
+        owner = os.stat(path).st_uid
+    except OSError:
+        return False
+    if owner != os.getuid():
+        print(f"WARNING: {path} BELONGS TO ANOTHER USER; NOT USING THE DAEMON", file=sys.stderr)
+        return False
+    return True
+
+def main():
+    filename, options = parse_arguments(sys.argv[1:])
+    path = options['socket'] or daemon_socket_path()
+    if filename == '-' or not owned_by_user(path):
+        run_directly(filename, options)
+    # _socket rather than socket, which imports enum
+    connection = _socket.socket(_socket.AF_UNIX, _socket.SOCK_STREAM)
+    try:
+        connection.connect(path)
+    except OSError:
+        connection.close()
+        run_directly(filename, options)
+    # The daemon resolves the program's relative file names against cwd
+    request = ', '.join(f'{json_string(key)}: {json_string(value)}' for key, value in (
+        ('file', os.path.abspath(filename)), ('mode', options['mode']), ('opt_level', options['opt_level']),
+        ('cwd', os.getcwd())))
+    connection.sendall(f'{{{request}}}\n'.encode())
+    streams = {b'1': sys.stdout.buffer, b'2': sys.stderr.buffer}
+    while True:
+        header = receive_exactly(connection, 5)
+        data = receive_exactly(connection, int.from_bytes(header[1:], 'big'))
+        if header[:1] == b'x':
+            sys.exit(int(data))
+        stream = streams[header[:1]]
+        stream.write(data)
+        stream.flush()
+
+if __name__ == "__main__":
+    main()
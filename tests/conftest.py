@@ -0,0 +1,29 @@
+import contextlib
+import importlib.util
+import io
+import os
+
+import pytest
+
+INTERPRETER = os.path.join(os.path.dirname(__file__), '..', 'langs', 'bhav', 'lib', 'bhav.py')
+
+@pytest.fixture(scope='session')
+def lang():
+    # The checked-in bhav interpreter, which langmaker generates from the
+    # example config
+    spec = importlib.util.spec_from_file_location('interpreter_under_test', INTERPRETER)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def run_program(lang, code, mode='interpret', opt_level=0):
+    # What a program printed, and the exception that ended it if any
+    stream = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(stream):
+            lang.run(code, mode, opt_level=opt_level, output=lang.Output(stream))
+    except SystemExit:
+        return stream.getvalue(), 'exit'
+    except Exception as e:
+        return stream.getvalue(), f"{type(e).__name__}: {e}"
+    return stream.getvalue(), None
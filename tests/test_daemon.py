@@ -0,0 +1,47 @@
+import importlib.util
+import os
+import subprocess
+import sys
+
+import pytest
+
+from conftest import INTERPRETER
+
+CLIENT = os.path.join(os.path.dirname(INTERPRETER), 'bhavclient.py')
+
+@pytest.fixture
+def daemon(tmp_path):
+    # A daemon started in a directory of its own, and the path of its socket
+    path = str(tmp_path / 'daemon.sock')
+    directory = tmp_path / 'daemon'
+    directory.mkdir()
+    process = subprocess.Popen([sys.executable, INTERPRETER, '--daemon', '--socket', path], cwd=directory,
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    try:
+        assert 'LISTENING' in process.stdout.readline()
+        yield path
+    finally:
+        process.terminate()
+        process.communicate(timeout=10)
+
+def test_daemon_resolves_files_against_the_client_directory(lang, tmp_path, daemon):
+    p, s = lang.COMMAND_PREFIX, lang.TYPE_PREFIX_STRING
+    directory = tmp_path / 'client'
+    directory.mkdir()
+    (directory / 'NUMS.TXT').write_text('1 2 3\n')
+    (directory / f'sum{lang.FILE_EXTENSION}').write_text(f'{p}PRINT({p}SUM({p}LOADARRAY({s} "NUMS.TXT")))\n')
+    result = subprocess.run([sys.executable, '-S', CLIENT, '--socket', daemon, f'sum{lang.FILE_EXTENSION}'],
+                            cwd=directory, capture_output=True, text=True, timeout=30)
+    assert (result.stdout, result.stderr, result.returncode) == ('6\n', '', 0)
+
+def test_client_ignores_a_socket_of_another_user(tmp_path, monkeypatch, capsys):
+    spec = importlib.util.spec_from_file_location('client_under_test', CLIENT)
+    client = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(client)
+    path = tmp_path / 'daemon.sock'
+    assert not client.owned_by_user(str(path))
+    path.touch()
+    assert client.owned_by_user(str(path))
+    monkeypatch.setattr(client.os, 'getuid', lambda: path.stat().st_uid + 1)
+    assert not client.owned_by_user(str(path))
+    assert 'BELONGS TO ANOTHER USER' in capsys.readouterr().err
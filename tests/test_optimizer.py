@@ -0,0 +1,89 @@
+import pytest
+
+from conftest import run_program
+
+def make_corpus(lang):
+    # Programs whose output (or error) must not depend on the optimization level
+    p, i, f, s = lang.COMMAND_PREFIX, lang.TYPE_PREFIX_INTEGER, lang.TYPE_PREFIX_FLOAT, lang.TYPE_PREFIX_STRING
+    t, n, end = lang.TRUE_VALUE, lang.FALSE_VALUE, lang.BLOCK_END
+    return {
+        'folding': [
+            f"DAY = {i} 60 * {i} 60 * {i} 24",
+            f"RATE = {f} 1.5 * {i} 2 + {i} 7 / {i} 2",
+            f"MIXED = {t} + {t} * {i} 3",
+            f"{p}PRINT(DAY, RATE, MIXED, {s} \"A\" + {s} \"B\", {s} \"AB\" * {i} 3)",
+        ],
+        'shout': [
+            f"{p}PRINT({p}SHOUT({s} \"quiet\"), {p}SHOUT({f} 2.5), {p}SHOUT({t}))",
+            f"{p}PRINT({p}SHOUT({s} \"A\" + {s} \"B\"))",
+        ],
+        'dead_branches': [
+            f"X = {i} 1",
+            f"{p}IF {n}:",
+            f"    {p}PRINT({s} \"NEVER\")",
+            f"{p}ELSE:",
+            f"    {p}PRINT({s} \"ELSE\")",
+            end,
+            f"{p}IF {i} 2 - {i} 2:",
+            "    X = Y",
+            end,
+            f"{p}WHILE {n}:",
+            f"    {p}PRINT({s} \"NEVER\")",
+            end,
+            f"{p}IF {t}:",
+            f"    {p}PRINT({s} \"ALWAYS\", X)",
+            end,
+        ],
+        'invariants': [
+            f"BASE = {i} 3",
+            f"OUTER = {i} 3",
+            f"{p}WHILE OUTER:",
+            f"    INNER = {i} 2",
+            f"    {p}WHILE INNER:",
+            f"        {p}PRINT(BASE * {i} 60 * {i} 60, BASE * OUTER + {i} 1, INNER)",
+            f"        INNER = INNER - {i} 1",
+            f"    {end}",
+            f"    OUTER = OUTER - {i} 1",
+            end,
+        ],
+        'zero_iterations': [
+            f"N = {i} 0",
+            f"{p}WHILE N:",
+            f"    {p}PRINT(MISSING * {i} 2)",
+            end,
+            f"{p}PRINT({s} \"DONE\")",
+        ],
+        'error_order': [
+            f"N = {i} 2",
+            f"{p}WHILE N:",
+            f"    {p}PRINT({s} \"BEFORE\")",
+            f"    X = {i} 1 / {i} 0 + Z",
+            f"    N = N - {i} 1",
+            end,
+        ],
+        'undefined_invariant': [
+            f"N = {i} 2",
+            f"{p}WHILE N:",
+            f"    {p}PRINT(N)",
+            f"    X = MISSING * {i} 2",
+            f"    N = N - {i} 1",
+            end,
+        ],
+        'type_error': [
+            f"X = {s} \"A\" - {i} 1",
+        ],
+    }
+
+CORPUS_NAMES = ('folding', 'shout', 'dead_branches', 'invariants', 'zero_iterations', 'error_order',
+                'undefined_invariant', 'type_error')
+
+@pytest.mark.parametrize('name', CORPUS_NAMES)
+def test_every_mode_and_level_matches_the_unoptimized_interpreter(lang, name):
+    code = '\n'.join(make_corpus(lang)[name])
+    expected = run_program(lang, code, 'interpret', 0)
+    for mode in lang.EXECUTION_MODES:
+        for level in lang.OPT_LEVELS:
+            assert run_program(lang, code, mode, level) == expected, f"--mode {mode} --opt-level {level}"
+
+def test_corpus_names_cover_the_corpus(lang):
+    assert set(make_corpus(lang)) == set(CORPUS_NAMES)
@@ -0,0 +1,104 @@
+import socket
+import subprocess
+import sys
+import time
+
+import pytest
+
+from conftest import INTERPRETER
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+def make_server_program(lang, port, count_in_handler):
+    # Serves three connections, counting them down either before ACCEPT or
+    # in the handler after it, then prints DONE
+    p, i, s = lang.COMMAND_PREFIX, lang.TYPE_PREFIX_INTEGER, lang.TYPE_PREFIX_STRING
+    count = f"    N = N - {i} 1"
+    lines = [
+        f'SERVER = {p}SOCKET({s} "SERVER")',
+        f"{p}BIND(SERVER, {i} {port})",
+        f"{p}LISTEN(SERVER, {i} 16)",
+        f"N = {i} 3",
+        f"{p}WHILE N:",
+    ]
+    if not count_in_handler:
+        lines.append(count)
+    lines += [
+        f"    CONNECTION = {p}ACCEPT(SERVER)",
+        f'    {p}SENDALL(CONNECTION, {s} "HI")',
+        f"    {p}CLOSE(CONNECTION)",
+    ]
+    if count_in_handler:
+        lines.append(count)
+    lines += [lang.BLOCK_END, f'{p}PRINT({s} "DONE")']
+    return '\n'.join(lines)
+
+def start_server(lang, tmp_path, flags, count_in_handler):
+    port = free_port()
+    path = tmp_path / f'server{lang.FILE_EXTENSION}'
+    path.write_text(make_server_program(lang, port, count_in_handler))
+    process = subprocess.Popen([sys.executable, INTERPRETER, *flags, str(path)],
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    return process, port
+
+def request(port, timeout=10.0):
+    # What the server sent on one connection, retrying until it listens
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            connection = socket.create_connection(('127.0.0.1', port), timeout=timeout)
+            break
+        except ConnectionRefusedError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+    with connection:
+        chunks = []
+        while True:
+            chunk = connection.recv(1024)
+            if not chunk:
+                return b''.join(chunks).decode()
+            chunks.append(chunk)
+
+def finish(process):
+    try:
+        return process.communicate(timeout=10)
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.communicate()
+
+CONCURRENT_FLAGS = [['--concurrent'], ['--mode', 'compile', '--concurrent']]
+
+@pytest.mark.parametrize('flags', [[]] + CONCURRENT_FLAGS, ids=' '.join)
+def test_bounded_server_loop_stops(lang, tmp_path, flags):
+    process, port = start_server(lang, tmp_path, flags, count_in_handler=False)
+    try:
+        responses = [request(port) for _ in range(3)]
+    finally:
+        stdout, stderr = finish(process)
+    assert responses == ['HI'] * 3
+    assert process.returncode == 0, stderr
+    assert stdout.endswith('DONE\n')
+
+def test_serial_server_loop_may_count_in_its_handler(lang, tmp_path):
+    process, port = start_server(lang, tmp_path, [], count_in_handler=True)
+    try:
+        responses = [request(port) for _ in range(3)]
+    finally:
+        stdout, stderr = finish(process)
+    assert responses == ['HI'] * 3
+    assert stdout.endswith('DONE\n')
+
+@pytest.mark.parametrize('flags', CONCURRENT_FLAGS + [['--workers', '2'], ['--workers', '2', '--concurrent']],
+                         ids=' '.join)
+def test_concurrent_handler_cannot_assign_loop_variables(lang, tmp_path, flags):
+    # The handler's N = N - 1 would change only its own copy of N, so the
+    # loop would never stop; the program is refused before accepting
+    process, port = start_server(lang, tmp_path, flags, count_in_handler=True)
+    stdout, stderr = finish(process)
+    assert process.returncode == 1
+    assert stdout == f"ERROR: CONCURRENT SERVER LOOPS CANNOT ASSIGN VARIABLES THE LOOP READS AFTER {lang.COMMAND_PREFIX}ACCEPT: N\n"
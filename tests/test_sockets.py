@@ -0,0 +1,51 @@
+import socket
+import threading
+
+import pytest
+
+@pytest.fixture
+def pair(lang):
+    # A Connection and the socket at the other end of it
+    ours, theirs = socket.socketpair()
+    connection = lang.Connection(ours)
+    yield connection, theirs
+    connection.close()
+    theirs.close()
+
+def test_recv_keeps_characters_split_across_reads_whole(pair):
+    connection, peer = pair
+    peer.sendall('é!'.encode())
+    assert connection.recv(1) == 'é'
+    assert connection.recv(1) == '!'
+
+def test_recv_completes_a_character_from_the_next_packet(pair):
+    connection, peer = pair
+    # The first read finds only the character's first byte
+    encoded = '€'.encode()
+    peer.sendall(encoded[:1])
+    rest = threading.Timer(0.1, peer.sendall, [encoded[1:]])
+    rest.start()
+    try:
+        assert connection.recv(16) == '€'
+    finally:
+        rest.join()
+
+def test_recvline_continues_a_character_that_recv_split(pair):
+    connection, peer = pair
+    peer.sendall('aé\n'.encode())
+    assert connection.recv(2) == 'a'
+    assert connection.recvline() == 'é\n'
+
+def test_recv_returns_an_empty_string_only_at_end_of_stream(pair):
+    connection, peer = pair
+    peer.sendall(b'\xc3')
+    peer.close()
+    assert connection.recv(16) == '�'
+    assert connection.recv(16) == ''
+
+@pytest.mark.parametrize('size', [0, -1])
+def test_recv_refuses_sizes_below_one(lang, pair, size):
+    connection, peer = pair
+    peer.sendall(b'DATA')
+    with pytest.raises(ValueError, match=f"RECV needs a size of at least 1, not {size}"):
+        lang.FUNCTIONS[f'{lang.COMMAND_PREFIX}RECV'].function(None, connection, size)